@@ -1,17 +1,19 @@
 import GPy
 import numpy as np
-import matplotlib.pyplot as plt
 import pickle
 import os
 from functools import partial
 from scipy.special import erfc
 from scipy.optimize import minimize
-from get_factorial import get_factorial
+import initial_design
 import copy
 import time
 import test_function_base
 from ep_unimodality import phi
 import unimodal 
+from results_store import ResultsWriter
+from thompson_sampling import ThompsonSampling
+from random_streams import as_generator, spawn
 
 def get_quantiles(fmin, m, s):
     '''
@@ -68,18 +70,28 @@ def PI(x, fmin=None, model = None, n=None, d=None):
     df_acqu = -(phi/s)* (dmdx + dsdx * u)
     return -f_acqu, -df_acqu
 
+# Thompson sampling: minimizes one approximate posterior sample path per iteration
+TS = ThompsonSampling()
+
 class BayesianOptimization(object):
-    def __init__(self, func_id, func, acquisition_function, bounds=None, max_iter=100, noise = 0.0):
+    def __init__(self, func_id, func, acquisition_function, bounds=None, max_iter=100, noise = 0.0, seed=None, design='factorial', design_size=None, pool=None, rng=None):
         self.func_id = func_id
         self.func = func
-        self.acq = acquisition_function
         self.dim = self.func.dim
         self.max_iter = max_iter
         self.noise=noise
-        self.reset()
+        self.seed = func_id if seed is None else seed
+        # all random draws of the run (design, acquisition starts, Thompson sampling) come from rng, by default seeded with seed
+        self.rng = as_generator(self.seed if rng is None else rng)
+        self.design_rng, acquisition_rng = spawn(self.rng, 2)
+        # Thompson sampling keeps state between calls, so each run uses its own instance
+        self.acq = acquisition_function.copy(acquisition_rng) if isinstance(acquisition_function, ThompsonSampling) else acquisition_function
+        self.design, self.design_size, self.pool = design, design_size, pool
+        self.timings = {'initial_fit': [], 'fit': [], 'acquisition': [], 'evaluation': []}
         if bounds is None:
             bounds = np.array([[0,1] for i in range(self.dim)])
         self.bounds = bounds
+        self.reset()
         
         self.f_min = []
         self.f_min_ref = []
@@ -91,26 +103,46 @@ class BayesianOptimization(object):
         self.f_min = self.f_min + [preds.reshape((-1))[ind]]
         self.x_min = self.x_min + [ind]
         
-    def save_metrics(self, folder):
+    def get_metrics(self):
         x_min = self.X[self.x_min,:]
-        f_min_ref = np.array([self.func.evaluate_clean(x_min[i,:]) for i in range(x_min.shape[0])])
-        tmp = {'f_min': self.f_min, 'x_min': self.x_min, 'x':self.X, 'f_min_ref':f_min_ref, 'x_min_real':self.func.min_loc, 'f_id': self.func_id}
-        pickle.dump(tmp, open(folder + str(self.func_id) + ".p", "wb" ) )
+        f_min_ref = self.func.evaluate_clean(x_min)
+        return {'f_min': self.f_min, 'x_min': self.x_min, 'x':self.X, 'f_min_ref':f_min_ref, 'x_min_real':self.func.min_loc, 'f_id': self.func_id, 'f_opt': self.func.fmin, 'timings': self.timings}
+
+    def save_metrics(self, folder):
+        pickle.dump(self.get_metrics(), open(folder + str(self.func_id) + ".p", "wb" ) )
+
+    def get_record(self, **tags):
+        """ Metrics as (scalars, arrays) for results_store.ResultsWriter.append. tags are stored as additional scalar columns. """
+        metrics = self.get_metrics()
+        scalars = dict(tags, f_id=self.func_id, f_opt=metrics['f_opt'], seed=self.seed)
+        arrays = {'f_min': metrics['f_min'], 'x_min': metrics['x_min'], 'x': self.X, 'y': self.Y, 'f_min_ref': metrics['f_min_ref'], 'x_min_real': metrics['x_min_real']}
+        arrays.update(('time_' + phase, timings) for phase, timings in self.timings.items())
+        return scalars, arrays
+
+    def write_metrics(self, writer, key, **tags):
+        writer.append(key, *self.get_record(**tags))
     
     def reset(self):
         self.X, self.Y = self.get_XY();
+        # the fit to the initial design is usually the most expensive one and is timed separately from the per-iteration fits
+        start = time.time()
         self.get_model(self.X, self.Y)
+        self.timings['initial_fit'].append(time.time() - start)
         
     def get_XY(self):
-        x = get_factorial(self.dim)*3./10. + 0.5
-        x = np.append(x, 0.5*np.ones((1, self.dim)), axis=0)
-        y = np.array([self.func.do_evaluate(x[i,:]) for i in range(x.shape[0])]).reshape((-1,1))
+        x = initial_design.get_design(self.design, self.design_size, self.dim, self.bounds, rng=self.design_rng)
+        y = initial_design.evaluate_design(self.func, x, pool=self.pool)
         return x, y
     
     def _add_point(self, x_new, force=False):
+        start = time.time()
+        y_new = np.reshape(self.func.do_evaluate(x_new), (-1,1))
+        self.timings['evaluation'].append(time.time() - start)
         self.X = np.append(self.X, x_new, axis=0)
-        self.Y = np.append(self.Y, np.array([[self.func.do_evaluate(x_new)]]), axis=0)
+        self.Y = np.append(self.Y, y_new, axis=0)
+        start = time.time()
         self.get_model(self.X, self.Y)
+        self.timings['fit'].append(time.time() - start)
     
     def _get_size(self):
         return self.X.shape[0]
@@ -144,7 +176,7 @@ class BayesianOptimization(object):
         acq_n = lambda x: self.acq(np.array([x]), fmin = min(preds), model = self.model, n=self.X.shape[0], d=self.dim)
         best = np.inf
         for i in range(num_points):
-            x = np.random.rand(1,self.dim)
+            x = self.rng.random(self.dim)
             opt = minimize(acq_n, x, method='L-BFGS-B', bounds = tuple((self.bounds[i,0], self.bounds[i,1]) for i in range(self.dim) ), jac=True, tol=1e-50)
             temp,_ = acq_n(opt.x)
             if temp < best:
@@ -153,7 +185,6 @@ class BayesianOptimization(object):
         return np.array([x_best])
     
     def optimize(self):
-        np.random.seed(self.func_id)
         for i in range(self.max_iter):
             print("Iteration {}".format(i))
             n = self._get_size()
@@ -161,6 +192,7 @@ class BayesianOptimization(object):
                 start = time.time()
                 x_new = self.maximize_acquisition()
                 end = time.time()
+                self.timings['acquisition'].append(end-start)
                 print("Maximizing acq. took: {}".format(str(end-start)))
                 start = time.time()
                 self._add_point(x_new, force=False)
@@ -173,6 +205,9 @@ class BayesianOptimization(object):
 class UnimodalBayesianOptimization(BayesianOptimization):
 
     def get_model(self, X, Y, gp=None):
+        # the virtual points Xd of the unimodality constraints form a 1-D grid
+        if self.dim != 1:
+            raise NotImplementedError('UnimodalBayesianOptimization only supports 1-D functions, got dim = %d' % self.dim)
         if gp is None:
             ker_const = GPy.kern.Bias(input_dim=self.dim, variance=0.5)
             ker_const.variance.constrain_fixed(value=0.5, warning=True, trigger_parent=True)
@@ -217,15 +252,10 @@ if __name__ == "__main__":
     l_new = test_function_base.noisify_functions(l_new, 0.05)
     bo = UnimodalBayesianOptimization(func_id=0, func = l_new[0][0], acquisition_function=EI, max_iter=2, noise = 0.05)
     X,Y = bo.optimize()
-    path = root +'vanilla/'
-    if not os.path.exists(path):
-        os.mkdir(path)
-    bo.save_metrics(path)
+    writer = ResultsWriter(root)
+    bo.write_metrics(writer, 'unimodal_0', model='unimodal', acquisition='EI')
     
     print("BO with vanilla GP")
     bo = BayesianOptimization(func_id=0, func = l_new[0][0], acquisition_function=EI, max_iter=2, noise = 0.05)
     X,Y = bo.optimize()
-    path=root+'unimodal/'
-    if not os.path.exists(path):
-        os.mkdir(path)
-    bo.save_metrics(path)
\ No newline at end of file
+    bo.write_metrics(writer, 'vanilla_0', model='vanilla', acquisition='EI')
\ No newline at end of file
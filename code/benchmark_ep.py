@@ -0,0 +1,150 @@
+""" Scaling benchmark of the inference path: time and peak memory of ep_unimodality, UnimodalGP.optimize, predict,
+    predict_g and sample_z_probabilities.
+
+    The problems are those of benchmark_precision.make_problem (demo-like quadratic objectives with Xd on a regular grid).
+    Starting from a base problem (N observations, M virtual points per dimension, D dimensions), one of N, M and D is
+    varied at a time, so that each sweep gives the scaling curve in one quantity. Times are the best of repeats runs,
+    peak memory is the peak of the Python allocations (numpy arrays included) of a separate run traced by tracemalloc.
+
+    The report rows are written to a JSON file, and can be compared against a stored baseline; rows more than threshold
+    slower (or using more memory) than the baseline row of the same operation and problem are reported as regressions
+    and give exit status 1.
+
+    python benchmark_ep.py --output ep.json
+    python benchmark_ep.py --num-observations 20 40 80 --grid-sizes 10 --dims 1 --baseline ep.json
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+
+import numpy as np
+
+import unimodal
+import ep_unimodality as ep
+from benchmark_precision import make_problem
+
+OPERATIONS = ['ep', 'optimize', 'predict', 'predict_g', 'sample_z_probabilities']
+
+
+def measure(func, setup=None, repeats=3):
+    """ Return the best time of repeats calls of func (each after setup, which is not timed) and the peak memory in bytes
+        of one more call traced by tracemalloc """
+    times = []
+    for i in range(repeats + 1):
+        args = setup() if setup is not None else ()
+        if i == repeats:
+            tracemalloc.start()
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            t0 = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - t0)
+    return min(times), peak
+
+
+def benchmark(D, N, M, num_points=1000, num_samples=1000, max_iters=10, repeats=3, seed=0):
+    """ Time the operations on one problem and return a list of report rows """
+    X, y, Xd, f_kernel_base, g_kernel_base = make_problem(D, N, M, seed)
+    model = unimodal.UnimodalGP(X=X, Y=y, Xd=Xd, f_kernel_base=f_kernel_base, g_kernel_base=g_kernel_base, sigma2=1.)
+    Xp = np.random.RandomState(seed + 1).uniform(-10, 10, size=(num_points, D))
+
+    operations = {
+        'ep': (lambda: ep.ep_unimodality(model.Xf, model.Xg, model.X, model.Y, Kf_kernel=model.Kf_kernel, Kg_kernel_list=model.Kg_kernel_list,
+                                         sigma2=model.sigma2, t2=model.Xd, nu2=1., tol=1e-10, max_itt=100), None),
+        'optimize': (lambda copy: copy.optimize(max_iters=max_iters), lambda: (model.copy(),)),
+        'predict': (lambda: model.predict(Xp), None),
+        'predict_g': (lambda: [model.predict_g(Xp, g_index=d) for d in range(D)], None),
+        'sample_z_probabilities': (lambda: model.sample_z_probabilities(Xp, num_samples=num_samples), None),
+    }
+
+    rows = []
+    for operation in OPERATIONS:
+        func, setup = operations[operation]
+        run_time, peak_memory = measure(func, setup, repeats)
+        rows.append(dict(operation=operation, D=D, N=N, M=len(Xd), time=run_time, peak_memory=peak_memory))
+    return rows
+
+
+def sweep(base, num_observations, grid_sizes, dims, **kwargs):
+    """ Benchmark the base problem (N, M, D) and the problems with one of N, M or D replaced by the values in
+        num_observations, grid_sizes and dims. Returns the report rows, each with the swept quantity in 'sweep'. """
+    problems = [('base', base)]
+    problems += [('N', (N, base[1], base[2])) for N in num_observations if N != base[0]]
+    problems += [('M', (base[0], M, base[2])) for M in grid_sizes if M != base[1]]
+    problems += [('D', (base[0], base[1], D)) for D in dims if D != base[2]]
+
+    rows = []
+    for name, (N, M, D) in problems:
+        for row in benchmark(D, N, M, **kwargs):
+            row['sweep'] = name
+            rows.append(row)
+    return rows
+
+
+def compare(rows, baseline_rows, threshold=0.25):
+    """ Add the ratios to the baseline (time_ratio, memory_ratio) to the rows that have a baseline row with the same
+        operation and problem, and return the rows that are more than threshold slower or larger """
+    key = lambda row: (row['operation'], row['D'], row['N'], row['M'])
+    baseline = dict((key(row), row) for row in baseline_rows)
+
+    regressions = []
+    for row in rows:
+        if key(row) not in baseline:
+            continue
+        reference = baseline[key(row)]
+        row['time_ratio'] = row['time']/max(reference['time'], 1e-12)
+        row['memory_ratio'] = row['peak_memory']/max(reference['peak_memory'], 1)
+        if row['time_ratio'] > 1 + threshold or row['memory_ratio'] > 1 + threshold:
+            regressions.append(row)
+    return regressions
+
+
+def print_report(rows):
+    print('%6s %3s %5s %6s %24s %10s %12s %8s %8s' % ('sweep', 'D', 'N', 'M', 'operation', 'time [s]', 'memory [MB]', 't/base', 'm/base'))
+    for row in rows:
+        ratios = ['%8.2f' % row[ratio] if ratio in row else '%8s' % '-' for ratio in ['time_ratio', 'memory_ratio']]
+        print('%6s %3d %5d %6d %24s %10.4f %12.2f %s %s' % (row['sweep'], row['D'], row['N'], row['M'], row['operation'], row['time'],
+                                                       row['peak_memory']/2.**20, ratios[0], ratios[1]))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Scaling benchmark of EP, optimization and prediction of UnimodalGP.')
+    parser.add_argument('--base', type=int, nargs=3, default=[20, 10, 1], metavar=('N', 'M', 'D'), help='base problem')
+    parser.add_argument('--num-observations', type=int, nargs='*', default=[10, 20, 40, 80])
+    parser.add_argument('--grid-sizes', type=int, nargs='*', default=[5, 10, 20, 40], help='virtual points per dimension')
+    parser.add_argument('--dims', type=int, nargs='*', default=[1, 2, 3])
+    parser.add_argument('--num-points', type=int, default=1000, help='prediction points')
+    parser.add_argument('--num-samples', type=int, default=1000, help='samples of sample_z_probabilities')
+    parser.add_argument('--max-iters', type=int, default=10, help='iterations of optimize')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='optional JSON file for the report')
+    parser.add_argument('--baseline', default=None, help='optional JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='relative slowdown or memory increase reported as regression')
+    args = parser.parse_args()
+
+    rows = sweep(tuple(args.base), args.num_observations, args.grid_sizes, args.dims, num_points=args.num_points,
+                 num_samples=args.num_samples, max_iters=args.max_iters, repeats=args.repeats, seed=args.seed)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(rows, json.load(f)['rows'], args.threshold)
+
+    print_report(rows)
+    if args.output is not None:
+        meta = dict(python=platform.python_version(), numpy=np.__version__, machine=platform.machine(), processor=platform.processor())
+        with open(args.output, 'w') as f:
+            json.dump(dict(meta=meta, rows=rows), f, indent=2)
+
+    if regressions:
+        print('%d regressions of more than %d%%:' % (len(regressions), 100*args.threshold))
+        print_report(regressions)
+        sys.exit(1)
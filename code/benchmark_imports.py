@@ -0,0 +1,73 @@
+""" Cold-start import times of the modules of the package.
+
+    Each module is imported in fresh Python processes (so that nothing is cached in sys.modules) and the report contains
+    the median import time over the repeats and the heavy dependencies that the import loaded. A process that only
+    predicts with a frozen model needs frozen_predictor, which should load neither GPy nor matplotlib.
+
+    python benchmark_imports.py --output imports.json
+    python benchmark_imports.py --modules unimodal --preload my_site_setup
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+MODULES = ['frozen_predictor', 'ep_unimodality', 'variational_unimodality', 'unimodal', 'bayesian_optimization', 'util']
+HEAVY = ['GPy', 'matplotlib', 'scipy.stats', 'scipy.integrate', 'scipy.optimize']
+
+CHILD = """
+import sys, time, json
+sys.path.insert(0, %(path)r)
+for module in %(preload)r:
+    __import__(module)
+before = set(sys.modules)
+t0 = time.perf_counter()
+__import__(%(module)r)
+run_time = time.perf_counter() - t0
+print(json.dumps(dict(time=run_time, loaded=[name for name in %(heavy)r if name in sys.modules and name not in before])))
+"""
+
+
+def time_import(module, preload=(), path=None):
+    """ Import module in a fresh interpreter after the modules in preload and return (time, heavy modules loaded) """
+    path = os.path.dirname(os.path.abspath(__file__)) if path is None else path
+    code = CHILD % dict(path=path, preload=list(preload), module=module, heavy=HEAVY)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['time'], result['loaded']
+
+
+def benchmark(modules, repeats=5, preload=()):
+    rows = []
+    for module in modules:
+        times, loaded = [], []
+        for i in range(repeats):
+            run_time, loaded = time_import(module, preload)
+            times.append(run_time)
+        rows.append(dict(module=module, time=sorted(times)[len(times)//2], loaded=loaded))
+    return rows
+
+
+def print_report(rows):
+    print('%24s %10s  %s' % ('module', 'time [s]', 'heavy modules loaded'))
+    for row in rows:
+        print('%24s %10.3f  %s' % (row['module'], row['time'], ', '.join(row['loaded']) or '-'))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure cold-start import times of the package modules.')
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--preload', nargs='*', default=[], help='modules imported before the timer starts')
+    parser.add_argument('--output', default=None, help='optional JSON file for the report rows')
+    args = parser.parse_args()
+
+    rows = benchmark(args.modules, args.repeats, args.preload)
+
+    print_report(rows)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,73 @@
+""" Time and log predictive density of hyperparameter optimization with the inference engines of UnimodalGP.
+
+    For each dimension, the problem of benchmark_precision is split into training and test observations, and the
+    hyperparameters are optimized with
+
+        ep                  EP throughout
+        variational         the variational engine throughout
+        variational+ep      the variational engine for the optimization, followed by a final EP fit
+
+    The report contains the optimization time, the approximate log marginal likelihood of the final fit and the mean log
+    predictive density of the test observations.
+
+    python benchmark_inference.py --dims 1 2 --output inference.json
+"""
+
+import json
+import time
+import argparse
+
+import numpy as np
+
+import unimodal
+from benchmark_precision import make_problem
+
+ENGINES = ['ep', 'variational', 'variational+ep']
+
+
+def benchmark(D, N, M, num_test, max_iters=50, seed=0):
+    """ Optimize a model with each engine and return a list of report rows """
+    X, y, Xd, f_kernel_base, g_kernel_base = make_problem(D, N + num_test, M, seed)
+    X, Xtest, y, ytest = X[:N], X[N:], y[:N], y[N:]
+
+    rows = []
+    for engine in ENGINES:
+        t0 = time.time()
+        model = unimodal.UnimodalGP(X=X, Y=y, Xd=Xd, f_kernel_base=f_kernel_base.copy(), g_kernel_base=g_kernel_base.copy(), sigma2=1.,
+                                    inference=engine.split('+')[0])
+        model.optimize(max_iters=max_iters)
+        if engine.endswith('+ep'):
+            model.set_inference('ep')
+        run_time = time.time() - t0
+
+        rows.append(dict(D=D, N=N, M=len(Xd), engine=engine, time=run_time, log_likelihood=float(model.log_likelihood()),
+                         lpd=float(np.mean(model.log_predictive_density(Xtest, ytest)))))
+    return rows
+
+
+def print_report(rows):
+    print('%3s %5s %5s %16s %10s %14s %10s' % ('D', 'N', 'M', 'engine', 'time [s]', 'log_lik', 'test lpd'))
+    for row in rows:
+        print('%3d %5d %5d %16s %10.3f %14.4f %10.4f' % (row['D'], row['N'], row['M'], row['engine'], row['time'], row['log_likelihood'], row['lpd']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare the inference engines of UnimodalGP for hyperparameter optimization.')
+    parser.add_argument('--dims', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--num-observations', type=int, default=20)
+    parser.add_argument('--num-test', type=int, default=200)
+    parser.add_argument('--grid-size', type=int, default=10, help='virtual points per dimension')
+    parser.add_argument('--max-iters', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='optional JSON file for the report rows')
+    args = parser.parse_args()
+
+    rows = []
+    for D in args.dims:
+        rows += benchmark(D, args.num_observations, args.grid_size, args.num_test, max_iters=args.max_iters, seed=args.seed)
+
+    print_report(rows)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
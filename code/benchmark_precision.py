@@ -0,0 +1,111 @@
+""" Timing and accuracy of the float32 dtype policy of UnimodalGP against the float64 path.
+
+    For each dimension, a demo-like problem (quadratic objective, RBF + Bias kernel for f, RBF kernel for g, Xd on a
+    regular grid) is fitted with dtype=np.float64 and dtype=np.float32 at the same hyperparameters. The report contains
+    the EP and prediction times of both and the largest differences of the log marginal likelihood and of the predictive
+    means and variances of f and g over random prediction points. Mean errors are relative to the largest predictive
+    standard deviation, variance errors relative to the float64 variances.
+
+    python benchmark_precision.py --dims 1 2 --num-points 100 10000 --output precision.json
+"""
+
+import json
+import time
+import argparse
+
+import numpy as np
+import GPy
+
+import unimodal
+
+DTYPES = ['float64', 'float32']
+
+
+def make_problem(D, N, M, seed=0):
+    """ Return X, y, Xd and the f and g base kernels of a D-dimensional problem with N observations and M**D virtual points """
+    random_state = np.random.RandomState(seed)
+    X = random_state.uniform(-10, 10, size=(N, D))
+    y = 0.1*np.sum((X - 2)**2, axis=1)[:, None] + random_state.normal(0, 1, size=(N, 1))
+
+    axis = np.linspace(-10, 10, M)
+    Xd = np.column_stack([x.ravel() for x in np.meshgrid(*[axis]*D)])
+
+    f_kernel_base = GPy.kern.RBF(input_dim=D, lengthscale=4., variance=10.) + GPy.kern.Bias(input_dim=D, variance=1.)
+    g_kernel_base = GPy.kern.RBF(input_dim=D, lengthscale=4., variance=1.)
+    return X, y, Xd, f_kernel_base, g_kernel_base
+
+
+def timed(func, repeats):
+    t0 = time.time()
+    for i in range(repeats):
+        result = func()
+    return result, (time.time() - t0)/repeats
+
+
+def benchmark(D, N, M, num_points, repeats=3, seed=0):
+    """ Fit both dtypes and return a list of report rows, one per number of prediction points """
+    X, y, Xd, f_kernel_base, g_kernel_base = make_problem(D, N, M, seed)
+
+    models, fit_times = {}, {}
+    for dtype in DTYPES:
+        t0 = time.time()
+        models[dtype] = unimodal.UnimodalGP(X=X, Y=y, Xd=Xd, f_kernel_base=f_kernel_base.copy(), g_kernel_base=g_kernel_base.copy(), sigma2=1., dtype=dtype)
+        fit_times[dtype] = time.time() - t0
+        # the woodbury terms are computed once per posterior, exclude them from the prediction times
+        models[dtype].predict(X[:1])
+
+    rows = []
+    random_state = np.random.RandomState(seed + 1)
+    for P in num_points:
+        Xp = random_state.uniform(-10, 10, size=(P, D))
+
+        predictions, predict_times = {}, {}
+        for dtype in DTYPES:
+            predictions[dtype], predict_times[dtype] = timed(lambda: models[dtype].predict(Xp, include_likelihood=False), repeats)
+
+        (mean64, var64), (mean32, var32) = predictions['float64'], predictions['float32']
+        g_mean_error, g_var_error = 0., 0.
+        for d in range(D):
+            (g_mean64, g_var64), (g_mean32, g_var32) = [models[dtype].predict_g(Xp, g_index=d) for dtype in DTYPES]
+            g_mean_error = max(g_mean_error, np.max(np.abs(g_mean32 - g_mean64))/np.sqrt(np.max(g_var64)))
+            g_var_error = max(g_var_error, np.max(np.abs(g_var32 - g_var64)/g_var64))
+
+        rows.append(dict(D=D, N=N, M=len(Xd), P=P,
+                         fit_time_float64=fit_times['float64'], fit_time_float32=fit_times['float32'],
+                         predict_time_float64=predict_times['float64'], predict_time_float32=predict_times['float32'],
+                         log_lik_error=abs(models['float32'].log_likelihood() - models['float64'].log_likelihood()),
+                         mean_error=float(np.max(np.abs(mean32 - mean64))/np.sqrt(np.max(var64))),
+                         var_error=float(np.max(np.abs(var32 - var64)/var64)),
+                         g_mean_error=float(g_mean_error), g_var_error=float(g_var_error)))
+    return rows
+
+
+def print_report(rows):
+    columns = ['D', 'M', 'P', 'fit_time_float64', 'fit_time_float32', 'predict_time_float64', 'predict_time_float32',
+               'log_lik_error', 'mean_error', 'var_error', 'g_mean_error', 'g_var_error']
+    headers = ['D', 'M', 'P', 'fit64 [s]', 'fit32 [s]', 'predict64 [s]', 'predict32 [s]', 'log_lik err', 'mean err', 'var err', 'g mean err', 'g var err']
+    print(' '.join('%13s' % header for header in headers))
+    for row in rows:
+        print(' '.join('%13d' % row[column] if isinstance(row[column], int) else '%13.3e' % row[column] for column in columns))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare the float32 and float64 dtype policies of UnimodalGP.')
+    parser.add_argument('--dims', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--num-observations', type=int, default=20)
+    parser.add_argument('--grid-size', type=int, default=10, help='virtual points per dimension')
+    parser.add_argument('--num-points', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='optional JSON file for the report rows')
+    args = parser.parse_args()
+
+    rows = []
+    for D in args.dims:
+        rows += benchmark(D, args.num_observations, args.grid_size, args.num_points, repeats=args.repeats, seed=args.seed)
+
+    print_report(rows)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
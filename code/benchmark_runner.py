@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import argparse
+import itertools
+import traceback
+import multiprocessing
+from collections import namedtuple
+
+from results_store import ResultsStore, ResultsWriter
+
+# BLAS/OpenMP implementations read these when they are first loaded, so they are set before the workers start
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+# failed jobs of the last sweep with their tracebacks, written to the results folder
+FAILED = 'failed.json'
+
+MODELS = ['vanilla', 'unimodal']
+ACQUISITIONS = ['EI', 'LCB', 'PI', 'TS']
+
+
+class Job(namedtuple('Job', ['dim', 'func_index', 'seed', 'model', 'acquisition'])):
+    """ One BO run: function func_index of dimension dim, optimized with the given model, acquisition and seed. """
+
+    @property
+    def key(self):
+        return 'd%d_f%d_s%d_%s_%s' % (self.dim, self.func_index, self.seed, self.model, self.acquisition)
+
+
+def get_jobs(num_functions, max_dim, seeds, models=MODELS, acquisitions=ACQUISITIONS):
+    """ Enumerate the sweep over the functions of test_function_base.get_gaussian_functions(num_functions, max_dim, .),
+        seeds, models and acquisition functions. The unimodal model only supports 1-D functions (see
+        bayesian_optimization.UnimodalBayesianOptimization), so its jobs of higher dimensions are skipped. """
+    num_per_dim = int(num_functions/max_dim)
+    jobs = [Job(*job) for job in itertools.product(range(1, max_dim + 1), range(num_per_dim), seeds, models, acquisitions)]
+    return [job for job in jobs if job.model != 'unimodal' or job.dim == 1]
+
+
+def completed_jobs(folder):
+    """ Return the keys of all jobs stored in the results store in folder. """
+    return set(ResultsStore(folder).keys())
+
+
+def run_job(job, num_peaks=1, noise=0.05, max_iter=20, design='factorial', design_size=None):
+    """ Run a single BO job. Returns (job.key, record, error), where record is the (scalars, arrays) pair of
+        BayesianOptimization.get_record if the job succeeded and error a traceback if it failed. """
+
+    try:
+        # imported here so that a broken environment is reported as a failed job
+        import numpy as np
+        import test_function_base
+        import bayesian_optimization as bo
+
+        # independent streams for the noise and the BO run, the same for all models and acquisitions of a function and seed
+        noise_rng, bo_rng = np.random.SeedSequence([job.seed, job.dim, job.func_index]).spawn(2)
+        func = test_function_base.Gaussian(dim=job.dim, num_peaks=num_peaks, seed=job.func_index)
+        func = test_function_base.Noisifier(test_function_base.Normalizer(func), 'add', noise, rng=noise_rng)
+
+        BO = bo.UnimodalBayesianOptimization if job.model == 'unimodal' else bo.BayesianOptimization
+        acquisition = getattr(bo, job.acquisition)
+
+        t0 = time.time()
+        optimizer = BO(func_id=job.func_index, func=func, acquisition_function=acquisition, max_iter=max_iter, noise=noise, seed=job.seed,
+                       design=design, design_size=design_size, rng=bo_rng)
+        optimizer.optimize()
+
+        scalars, arrays = optimizer.get_record(dim=job.dim, model=job.model, acquisition=job.acquisition)
+        scalars['wall_time'] = time.time() - t0
+
+        return job.key, (scalars, arrays), None
+    except Exception:
+        return job.key, None, traceback.format_exc()
+
+
+def _run_job(args):
+    job, job_kwargs = args
+    return run_job(job, **job_kwargs)
+
+
+def write_results(results, folder, total=None, flush_every=50, flush_seconds=600.):
+    """ Write the (key, record, error) triples of run_job from the iterable results to a results_store in folder. The
+        records are flushed in shards of flush_every runs, or earlier when flush_seconds have passed since the first run
+        of a shard, so that a killed sweep loses at most that much work. The shards are merged once all results are
+        written, also if some jobs failed. The failed jobs are not stored (a resumed sweep runs them again) and are
+        written with their tracebacks to FAILED in folder instead. Returns a dict of failed job keys and tracebacks. """
+
+    failed = {}
+    t0 = time.time()
+    with ResultsWriter(folder, flush_every=flush_every, flush_seconds=flush_seconds) as writer:
+        for i, (key, record, error) in enumerate(results):
+            if error is not None:
+                failed[key] = error
+                print('Job %s failed:\n%s' % (key, error))
+            else:
+                writer.append(key, *record)
+            print('[%d/%s] %s %s after %4.1fs' % (i + 1, '?' if total is None else total, key, 'failed' if error else 'done', time.time() - t0))
+
+    ResultsStore(folder).compact()
+
+    with open(os.path.join(folder, FAILED), 'w') as f:
+        json.dump(failed, f, indent=1)
+    if len(failed) > 0:
+        print('%d jobs failed, see %s:\n%s' % (len(failed), os.path.join(folder, FAILED), '\n'.join(sorted(failed))))
+
+    return failed
+
+
+def run_benchmark(jobs, folder, num_workers=None, threads_per_job=1, flush_every=50, flush_seconds=600., **job_kwargs):
+    """ Run jobs on a process pool and write the results to a results_store in folder (see write_results). Jobs already
+        in the store are skipped, so a killed sweep can be resumed by calling run_benchmark again with the same
+        arguments. Returns a dict of failed job keys and tracebacks. """
+
+    done = completed_jobs(folder)
+    todo = [job for job in jobs if job.key not in done]
+    print('%d of %d jobs already completed, running %d' % (len(jobs) - len(todo), len(jobs), len(todo)))
+
+    if num_workers is None:
+        num_workers = max(1, multiprocessing.cpu_count()//threads_per_job)
+
+    # spawned workers inherit the environment at start-up, so limit BLAS threads only while the pool is created
+    old_environ = {v: os.environ.get(v) for v in THREAD_VARIABLES}
+    os.environ.update({v: str(threads_per_job) for v in THREAD_VARIABLES})
+    try:
+        pool = multiprocessing.get_context('spawn').Pool(num_workers)
+    finally:
+        for v, value in old_environ.items():
+            if value is None:
+                del os.environ[v]
+            else:
+                os.environ[v] = value
+
+    with pool:
+        results = pool.imap_unordered(_run_job, [(job, job_kwargs) for job in todo])
+        return write_results(results, folder, total=len(todo), flush_every=flush_every, flush_seconds=flush_seconds)
+
+
+if __name__ == "__main__":
+    import initial_design
+
+    parser = argparse.ArgumentParser(description='Run BO benchmark over the Gaussian test functions.')
+    parser.add_argument('--root', default='./results/benchmark/')
+    parser.add_argument('--num-functions', type=int, default=20)
+    parser.add_argument('--max-dim', type=int, default=2)
+    parser.add_argument('--num-peaks', type=int, default=1)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--models', nargs='+', default=MODELS, choices=MODELS)
+    parser.add_argument('--acquisitions', nargs='+', default=ACQUISITIONS, choices=ACQUISITIONS)
+    parser.add_argument('--max-iter', type=int, default=20)
+    parser.add_argument('--noise', type=float, default=0.05)
+    parser.add_argument('--design', default='factorial', choices=sorted(initial_design.DESIGNS))
+    parser.add_argument('--design-size', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads-per-job', type=int, default=1)
+    parser.add_argument('--flush-every', type=int, default=50)
+    parser.add_argument('--flush-seconds', type=float, default=600.)
+    args = parser.parse_args()
+
+    jobs = get_jobs(args.num_functions, args.max_dim, args.seeds, args.models, args.acquisitions)
+    failed = run_benchmark(jobs, args.root, num_workers=args.workers, threads_per_job=args.threads_per_job,
+                           flush_every=args.flush_every, flush_seconds=args.flush_seconds,
+                           num_peaks=args.num_peaks, noise=args.noise, max_iter=args.max_iter,
+                           design=args.design, design_size=args.design_size)
+    print('%d jobs failed' % len(failed))
@@ -100,8 +100,8 @@ print(unimodal)
 
 # make predictions
 mu_ep, var_ep = unimodal_model.predict(Xp)
-mu_ep_g1, var_ep_g1 = unimodal_model.predict_g(Xp, g_index=0)
-mu_ep_g2, var_ep_g2 = unimodal_model.predict_g(Xp, g_index=1)
+mu_ep_g, var_ep_g = unimodal_model.predict_g_all(Xp)
+(mu_ep_g1, mu_ep_g2), (var_ep_g1, var_ep_g2) = mu_ep_g[:, :2].T, var_ep_g[:, :2].T
 
 # reshape to 2D
 mu_ep = mu_ep.reshape((len(xs), len(ys)))
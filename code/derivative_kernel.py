@@ -0,0 +1,112 @@
+""" Fused multi-output covariance of f and its partial derivatives for RBF and RBF + Bias base kernels.
+
+    RBFDerivative replaces GPy.kern.MultioutputKern over [base] + [DiffKern(base, d) for d in dims]. Inputs carry the
+    output index in the last column as produced by GPy.util.multioutput.build_XY: 0 for f and k > 0 for the derivative
+    with respect to dimension dims[k - 1]. All blocks are computed from a single set of scaled differences u (see
+    rbf_kernels) as
+
+        K = k_rbf*(F1*F2 + Delta) + bias*[both rows are values]
+
+    where F1 = -u_d for a derivative row (1 otherwise), F2 = u_e for a derivative column (1 otherwise) and
+    Delta = delta_de/lengthscale_d**2 if both are derivatives. The gradients with respect to the variance, bias and
+    (ARD) lengthscales are computed from the same quantities.
+"""
+
+import numpy as np
+
+from GPy.kern.src.kern import CombinationKernel
+from paramz.caching import Cache_this
+
+from rbf_kernels import rbf_parameters, scaled_differences
+
+
+def supports(kernel):
+    """ True if kernel is an RBF or RBF + Bias kernel supported by RBFDerivative """
+    try:
+        rbf_parameters(kernel)
+    except ValueError:
+        return False
+    return True
+
+
+class RBFDerivative(CombinationKernel):
+
+    def __init__(self, base_kernel, dims=None, name='RBFDerivative'):
+        rbf_parameters(base_kernel)
+        self.dims = np.arange(base_kernel.input_dim) if dims is None else np.asarray(dims, dtype=int)
+        self.index_dim = -1
+        super(RBFDerivative, self).__init__(kernels=[base_kernel], extra_dims=[self.index_dim], name=name)
+
+        # optional kernel_cache.KernelCache for the factors of the covariance of X with itself, which K and
+        # update_gradients_full then share
+        self.kernel_cache = None
+
+    @property
+    def base_kernel(self):
+        return self.parts[0]
+
+    def _split(self, X):
+        """ Return the inputs, a mask of the derivative rows and the dimension of each derivative row (0 for value rows) """
+        index = X[:, self.index_dim].astype(int)
+        derivative = index > 0
+        return X[:, :self.index_dim], derivative, np.where(derivative, self.dims[np.maximum(index - 1, 0)], 0)
+
+    def _factors(self, X, X2=None):
+        if X2 is None and self.kernel_cache is not None:
+            return self.kernel_cache.get(self, 'factors', lambda: self._compute_factors(X, X), X)
+        return self._compute_factors(X, X if X2 is None else X2)
+
+    def _compute_factors(self, X, X2):
+        x, d1, e1 = self._split(X)
+        x2, d2, e2 = self._split(X2)
+        variance, lengthscale, bias = rbf_parameters(self.base_kernel)
+
+        u, r2 = scaled_differences(x, x2, lengthscale)
+        k = variance*np.exp(-0.5*r2)
+
+        rows, cols = np.arange(len(x))[:, None], np.arange(len(x2))[None, :]
+        U1 = np.where(d1[:, None], u[rows, cols, e1[:, None]], 0.)
+        U2 = np.where(d2[None, :], u[rows, cols, e2[None, :]], 0.)
+        F1 = np.where(d1[:, None], -U1, 1.)
+        F2 = np.where(d2[None, :], U2, 1.)
+        same = d1[:, None] & d2[None, :] & (e1[:, None] == e2[None, :])
+        Delta = same/lengthscale[e1][:, None]**2
+        values = ~d1[:, None] & ~d2[None, :]
+
+        return dict(variance=variance, lengthscale=lengthscale, bias=bias, u=u, k=k, U1=U1, U2=U2, F1=F1, F2=F2,
+                    Delta=Delta, same=same, values=values, d1=d1, e1=e1, d2=d2, e2=e2)
+
+    @Cache_this(limit=3, ignore_args=())
+    def K(self, X, X2=None):
+        f = self._factors(X, X2)
+        return f['k']*(f['F1']*f['F2'] + f['Delta']) + f['bias']*f['values']
+
+    @Cache_this(limit=3, ignore_args=())
+    def Kdiag(self, X):
+        _, derivative, dims = self._split(X)
+        variance, lengthscale, bias = rbf_parameters(self.base_kernel)
+        return np.where(derivative, variance/lengthscale[dims]**2, variance + bias)
+
+    def update_gradients_full(self, dL_dK, X, X2=None):
+        f = self._factors(X, X2)
+        variance, lengthscale, bias, u, k, U1, U2, F1, F2 = [f[name] for name in ['variance', 'lengthscale', 'bias', 'u', 'k', 'U1', 'U2', 'F1', 'F2']]
+        d1, e1, d2, e2 = f['d1'], f['e1'], f['d2'], f['e2']
+        D = len(lengthscale)
+
+        G = dL_dK*k
+        H = G*(F1*F2 + f['Delta'])
+
+        # d k_rbf/d lengthscale_c = k_rbf*(x_c - x'_c)**2/lengthscale_c**3 = k_rbf*u_c**2*lengthscale_c
+        dl = np.einsum('ij,ijc->c', H, u*u)*lengthscale
+        # derivatives of F1 = -u_d, F2 = u_e and Delta with respect to lengthscale_d, lengthscale_e
+        dl += np.bincount(e1[d1], weights=np.sum(2.*G*U1*F2, axis=1)[d1], minlength=D)/lengthscale
+        dl -= np.bincount(e2[d2], weights=np.sum(2.*G*F1*U2, axis=0)[d2], minlength=D)/lengthscale
+        dl -= np.bincount(e1[d1], weights=np.sum(2.*G*f['same'], axis=1)[d1], minlength=D)/lengthscale**3
+
+        parts = self.base_kernel.parts if type(self.base_kernel).__name__ == 'Add' else [self.base_kernel]
+        for part in parts:
+            if type(part).__name__ == 'RBF':
+                part.variance.gradient = np.sum(H)/variance
+                part.lengthscale.gradient = dl if part.ARD else np.sum(dl)
+            else:
+                part.variance.gradient = np.sum(dL_dK*f['values'])
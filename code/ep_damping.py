@@ -0,0 +1,100 @@
+""" Adaptive damping of the site updates of ep_unimodality.
+
+    With the fixed damping alpha of ep_unimodality, unstable fits oscillate and run until max_itt without converging.
+    An AdaptiveDamping object passed as damping= keeps a damping factor per site, which
+
+        is multiplied by decrease when the precision updates of the site have changed sign in window consecutive updates
+            (oscillation), or when its update was rejected because of a negative precision: a cavity precision or a
+            variance of the tilted distribution that is not positive, or moments that are not finite
+        grows by the factor increase (up to alpha_max) after each update without oscillation
+
+    Rejected updates leave the site unchanged (ep_unimodality records them as skipped sites). The damping also stops
+    the run when it diverges: when the convergence residual is not finite, or when the best residual of the last
+    patience iterations is not below min_progress times the best residual before them.
+
+    Sites whose precision is clamped to zero (non log-concave factors) propose negative precisions in every iteration
+    by design, so these proposals are clamped as in GPy's EP and do not change the damping. Lowering the damping of
+    single sites more eagerly (on every negative proposal or sign change) slows down EP on stable problems.
+"""
+
+import numpy as np
+
+
+class AdaptiveDamping(object):
+    """ Per-site damping factors of an EP run and its divergence check (see module docstring) """
+
+    def __init__(self, alpha=1., alpha_min=0.05, alpha_max=None, decrease=0.5, increase=1.1, window=3, oscillation_tol=0.1,
+                 patience=20, min_progress=0.5):
+        self.alpha, self.alpha_min = alpha, alpha_min
+        self.alpha_max = alpha if alpha_max is None else alpha_max
+        self.decrease, self.increase = decrease, increase
+        # sign changes of precision updates smaller than oscillation_tol times the site precision are not counted
+        self.window, self.oscillation_tol = window, oscillation_tol
+        self.patience, self.min_progress = patience, min_progress
+        self.reset()
+
+    def reset(self):
+        """ Forget the damping factors and residuals of a previous run """
+        self.damping = {}
+        self._last_step = {}
+        self._flips = {}
+        self.residuals = []
+        self.diverged = False
+        self.num_rejected = 0
+        self.num_oscillations = 0
+
+    def _site_arrays(self, key, n):
+        if key not in self.damping:
+            self.damping[key] = np.full(n, float(self.alpha))
+            self._last_step[key] = np.zeros(n)
+            self._flips[key] = np.zeros(n, dtype=int)
+        return self.damping[key], self._last_step[key], self._flips[key]
+
+    def reject(self, key, i, n):
+        """ Lower the damping of site i (of the n sites in group key) after a rejected update or failed moment matching """
+        damping = self._site_arrays(key, n)[0]
+        damping[i] = max(damping[i]*self.decrease, self.alpha_min)
+        self.num_rejected += 1
+
+    def update_site(self, key, ga_approx, i, eta, post_params, marg_moments, cavity):
+        """ Damped update of site i of ga_approx (as gaussianApproximation._update_i) with the damping of the site. key
+            identifies the group of sites, e.g. 'f' or ('g', d). Returns False if the update was rejected. """
+        n = len(ga_approx.tau)
+        sigma2_hat, mu_hat = marg_moments.sigma2_hat[i], marg_moments.mu_hat[i]
+        if not (cavity.tau[i] > 0 and sigma2_hat > 0 and np.isfinite(mu_hat) and np.isfinite(sigma2_hat)):
+            self.reject(key, i, n)
+            return False
+
+        damping, last_step, flips = self._site_arrays(key, n)
+        step_tau = (1./sigma2_hat - 1./post_params.Sigma_diag[i])/eta
+        step_v = (mu_hat/sigma2_hat - post_params.mu[i]/post_params.Sigma_diag[i])/eta
+        tau = ga_approx.tau[i]
+
+        flips[i] = flips[i] + 1 if step_tau*last_step[i] < 0 and abs(step_tau) > self.oscillation_tol*tau else 0
+        last_step[i] = step_tau
+        oscillating = flips[i] >= self.window
+        if oscillating:
+            damping[i] = max(damping[i]*self.decrease, self.alpha_min)
+            flips[i] = 0
+            self.num_oscillations += 1
+
+        # the precision is kept positive as in gaussianApproximation._update_i
+        ga_approx.tau[i] = max(tau + damping[i]*step_tau, np.finfo(float).eps)
+        ga_approx.v[i] += damping[i]*step_v
+
+        if not oscillating:
+            damping[i] = min(damping[i]*self.increase, self.alpha_max)
+        return True
+
+    def end_iteration(self, residual):
+        """ Update the divergence check with the residual of an iteration and return whether the run diverged """
+        self.residuals.append(residual)
+        if not np.isfinite(residual):
+            self.diverged = True
+        elif len(self.residuals) > self.patience:
+            before, recent = self.residuals[:-self.patience], self.residuals[-self.patience:]
+            self.diverged = min(recent) > self.min_progress*min(before)
+        return self.diverged
+
+    def __repr__(self):
+        return 'AdaptiveDamping(rejected=%d, oscillations=%d, diverged=%s)' % (self.num_rejected, self.num_oscillations, self.diverged)
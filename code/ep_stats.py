@@ -0,0 +1,86 @@
+""" Telemetry of the inference runs of ep_unimodality (and vi_unimodality).
+
+    An EPStats object passed as stats= records for each iteration the time spent in the phases
+
+        g_sweep                 site updates of the probit factors of g'
+        fg_sweep                site updates of the factors coupling f' and g
+        posterior               refreshes of the posteriors of f and g after the sweeps
+        marginal_likelihood     marginal likelihood and gradients, once after the last iteration
+
+    the convergence residual, and the sites skipped because of numerical problems by type ('g' or 'fg'). An optional
+    callback is called with the stats object after every iteration.
+"""
+
+import time
+from contextlib import contextmanager
+
+PHASES = ['g_sweep', 'fg_sweep', 'posterior', 'marginal_likelihood']
+SITE_TYPES = ['g', 'fg']
+
+
+class EPStats(object):
+    """ Per-iteration phase timings, convergence residuals and skipped sites of an inference run (see module docstring) """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.timings = {phase: [] for phase in PHASES}
+        self.residuals = []
+        self.skipped = {site_type: [] for site_type in SITE_TYPES}
+        self.iterations = 0
+        self.converged = False
+        self.diverged = False
+        self.total_time = 0.
+        self._t0 = time.perf_counter()
+        self._current = None
+
+    @contextmanager
+    def phase(self, name):
+        """ Add the time spent in the with block to phase name of the current iteration """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            if self._current is None:
+                # outside of the iterations (marginal likelihood)
+                self.timings[name].append(elapsed)
+            else:
+                self._current[name] = self._current.get(name, 0.) + elapsed
+
+    def start_iteration(self):
+        self._current = {}
+
+    def end_iteration(self, residual):
+        for phase in PHASES[:-1]:
+            self.timings[phase].append(self._current.get(phase, 0.))
+        self._current = None
+        self.residuals.append(float(residual))
+        self.iterations += 1
+        if self.callback is not None:
+            self.callback(self)
+
+    def skip(self, site_type, iteration, d, j):
+        """ Record a skipped site update of type 'g' or 'fg' for dimension d and virtual point j """
+        self.skipped[site_type].append((iteration, int(d), int(j)))
+
+    def finish(self, converged, diverged=False):
+        self.converged = converged
+        self.diverged = diverged
+        self.total_time = time.perf_counter() - self._t0
+
+    @property
+    def num_skipped(self):
+        return {site_type: len(sites) for site_type, sites in self.skipped.items()}
+
+    def phase_totals(self):
+        return {phase: sum(times) for phase, times in self.timings.items()}
+
+    def summary(self):
+        """ JSON serializable summary of the run """
+        return dict(iterations=self.iterations, converged=self.converged, diverged=self.diverged, total_time=self.total_time,
+                    phase_totals=self.phase_totals(), num_skipped=self.num_skipped,
+                    final_residual=self.residuals[-1] if self.residuals else None)
+
+    def __repr__(self):
+        totals = ', '.join('%s=%.3fs' % item for item in self.phase_totals().items())
+        return 'EPStats(iterations=%d, converged=%s, %s, skipped=%s)' % (self.iterations, self.converged, totals, self.num_skipped)
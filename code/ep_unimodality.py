@@ -1,32 +1,47 @@
 import numpy as np
 import time
-from scipy.integrate import quad, dblquad
-from scipy.stats import norm
-from scipy.misc import logsumexp
+import json
+from functools import partial
+from scipy.special import ndtr, log_ndtr
+from scipy.linalg import solve_triangular
 
-import GPy
-from GPy.inference.latent_function_inference.expectation_propagation import posteriorParams, marginalMoments, gaussianApproximation, cavityParams
-from GPy.inference.latent_function_inference.posterior import PosteriorEP as Posterior
-
-from GPy.util.linalg import  dtrtrs, dpotrs, tdot, symmetrify, jitchol
+# GPy (EP containers, posterior objects and its linear algebra) is imported in the functions that use it, so that
+# importing this module is cheap
 
 from probit_moments import ProbitMoments
 from moment_functions import compute_moments_softinformation, compute_moments_strict
-from util import mult_diag
+from ep_stats import EPStats
+from npz_io import save_npz, load_npz
+from random_streams import as_generator
 
 npdf = lambda x, m, v: 1./np.sqrt(2*np.pi*v)*np.exp(-(x-m)**2/(2*v))
 log_npdf = lambda x, m, v: -0.5*np.log(2*np.pi*v) -(x-m)**2/(2*v)
-phi = lambda x: norm.cdf(x)
-logphi = lambda x: norm.logcdf(x)
+phi = lambda x: ndtr(x)
+logphi = lambda x: log_ndtr(x)
 
 log_2_pi = np.log(2*np.pi)
 
-def update_posterior(K, eta, theta):
+def update_posterior(K, eta, theta, lean=False):
+    from GPy.util.linalg import jitchol
+    from GPy.inference.latent_function_inference.expectation_propagation import posteriorParams
+
     D = K.shape[0]
     sqrt_theta = np.sqrt(theta)
+
+    if lean:
+        # B is formed in place and released after the factorization, so that at most three n x n arrays are alive at
+        # once: K, B and L here, then K, L and V in LeanPosterior
+        B = sqrt_theta[:, None]*K
+        B *= sqrt_theta
+        B[np.diag_indices(D)] += 1.
+        L = jitchol(B)
+        del B
+        return LeanPosterior(K, eta, sqrt_theta, L)
+
     G = sqrt_theta[:, None]*K
     B = np.identity(D) + G*sqrt_theta
     L = jitchol(B)
+
     V = np.linalg.solve(L, G)
     Sigma_full = K - np.dot(V.T, V)
     mu = np.dot(Sigma_full, eta)
@@ -36,11 +51,111 @@ def update_posterior(K, eta, theta):
 
     # return mu, Sigma, Sigma_full, L
 
-def ep_unimodality(X1, X2, t, y, Kf_kernel, Kg_kernel_list, sigma2, t2=None, m=None, max_itt=50, nu=10., nu2 = 1., alpha=0.9, tol=1e-6, verbose=0, moment_function=None, seed=0):
-
-    np.random.seed(seed)
+class LeanPosterior(object):
+    """ Posterior N(mu, Sigma) with Sigma = K - K S^(1/2) B^-1 S^(1/2) K, stored as the Cholesky factor L of
+        B = I + S^(1/2) K S^(1/2), mu and the diagonal of Sigma, which is all the EP updates read. The dense Sigma is
+        only computed when accessed (e.g. for prediction), after which it is cached. """
+
+    def __init__(self, K, eta, sqrt_theta, L):
+        self.K, self.L, self.sqrt_theta = K, L, sqrt_theta
+
+        V = solve_triangular(L, sqrt_theta[:, None]*K, lower=True, overwrite_b=True, check_finite=False)
+        self.Sigma_diag = np.diag(K) - np.sum(V**2, axis=0)
+        self.mu = np.dot(K, eta) - np.dot(V.T, np.dot(V, eta))
+        self._Sigma = None
+
+    @property
+    def Sigma(self):
+        if self._Sigma is None:
+            V = solve_triangular(self.L, self.sqrt_theta[:, None]*self.K, lower=True, overwrite_b=True, check_finite=False)
+            self._Sigma = self.K - np.dot(V.T, V)
+        return self._Sigma
+
+class DenseBackend(object):
+    """ Linear algebra backend of ep_unimodality based on dense Cholesky factorizations (the default).
+        If lean is True, the posteriors are LeanPosterior objects without the dense covariance.
+        See iterative_backend.IterativeBackend for an alternative without factorizations. """
+
+    def __init__(self, lean=True):
+        self.lean = lean
+
+    def posterior(self, K, eta, theta):
+        return update_posterior(K, eta, theta, lean=self.lean)
+
+    def inference(self, K, ga_approx, cav_params, Z_tilde):
+        return _inference(K, ga_approx, cav_params, None, Z_tilde)
+
+def update_g_posterior(Kg, eta, theta, backend):
+    """ Posterior for a covariance matrix using backend, or for a structured prior from grid_structure """
+    if hasattr(Kg, 'posterior'):
+        return Kg.posterior(eta, theta)
+    return backend.posterior(Kg, eta, theta)
+
+###################################################################################
+# Checkpoints
+###################################################################################
+
+CHECKPOINT_VERSION = 2
+
+def _checkpoint_arrays(f_ga_approx, f_marg_moments, f_cavity, g_ga_approx_list, g_marg_moments_list, g_cavity_list):
+    """ (name, containers, attribute) of the arrays in a checkpoint, one row per container """
+    for prefix, ga_approx, marg_moments, cavity in [('f', [f_ga_approx], [f_marg_moments], [f_cavity]),
+                                                    ('g', g_ga_approx_list, g_marg_moments_list, g_cavity_list)]:
+        for name, containers, attributes in [('sites', ga_approx, ['v', 'tau']), ('moments', marg_moments, ['Z_hat', 'mu_hat', 'sigma2_hat']),
+                                             ('cavity', cavity, ['v', 'tau'])]:
+            for attribute in attributes:
+                yield '%s_%s_%s' % (prefix, name, attribute), containers, attribute
+
+def save_ep_checkpoint(path, itt, converged, rng, *containers):
+    """ Atomically write the EP state after itt iterations to the .npz file at path: the site parameters, marginal moments
+        and cavities of f and each g (containers as for _checkpoint_arrays) and the state of the generator rng. The
+        posteriors are functions of the sites and are recomputed on resume. """
+    arrays = {name: np.array([getattr(container, attribute) for container in group]) for name, group, attribute in _checkpoint_arrays(*containers)}
+    save_npz(path, version=CHECKPOINT_VERSION, itt=itt, converged=converged, rng_state=json.dumps(rng.bit_generator.state), **arrays)
+
+def load_ep_checkpoint(path, rng, *containers):
+    """ Restore the state written by save_ep_checkpoint into the generator rng and the EP containers.
+        Returns the number of iterations done and whether EP had converged. """
+    data = load_npz(path)
+    if int(data['version']) != CHECKPOINT_VERSION:
+        raise ValueError('Unsupported EP checkpoint version %d' % int(data['version']))
+
+    for name, group, attribute in _checkpoint_arrays(*containers):
+        values = data[name]
+        if values.shape != (len(group), len(getattr(group[0], attribute))):
+            raise ValueError('EP checkpoint %s does not match the problem: %s has shape %s' % (path, name, values.shape))
+        for container, value in zip(group, values):
+            getattr(container, attribute)[:] = value
+
+    rng.bit_generator.state = json.loads(str(data['rng_state']))
+    return int(data['itt']), bool(data['converged'])
+
+def ep_unimodality(X1, X2, t, y, Kf_kernel, Kg_kernel_list, sigma2, t2=None, m=None, max_itt=50, nu=10., nu2 = 1., alpha=0.9, tol=1e-6, verbose=0, moment_function=None, seed=0, return_sites=False, g_priors=None, backend=None, kernel_dtype=np.float64, stats=None,
+                   checkpoint=None, checkpoint_every=1, resume_from=None, probit_table=None, eta=1., damping=None):
+    """ EP for the unimodal GP. If checkpoint is a path, the EP state is written to it (atomically, see
+        save_ep_checkpoint) every checkpoint_every iterations and after the last iteration. resume_from is the path of such
+        a checkpoint of a run with the same arguments, which is continued exactly where it stopped, up to max_itt
+        iterations in total. probit_table is an optional probit_moments.ProbitTable, which replaces the exact log Phi and
+        phi/Phi in the moment matching of the g sites and of the default (strict) fg sites by table lookups.
+
+        eta is the power of power EP (1 for EP): the cavities remove eta times the sites and the site updates are scaled
+        by 1/eta, as in GPy's EP, and the marginal likelihood is the EP expression at the final sites. The site updates
+        are damped by the fixed alpha, or by an ep_damping.AdaptiveDamping passed as damping, which adapts the damping
+        per site, rejects updates with negative precisions and stops iterating when the run diverges. The damping state
+        is not part of checkpoints. """
+    from GPy.inference.latent_function_inference.expectation_propagation import marginalMoments, gaussianApproximation, cavityParams
+
+    # seed is an int or a np.random.Generator (see random_streams), the global random state is not used
+    rng = as_generator(seed)
     t0 = time.time()
 
+    if backend is None:
+        backend = DenseBackend()
+
+    # telemetry (see ep_stats)
+    if stats is None:
+        stats = EPStats()
+
     if t2 is None:
         t2 = t.copy()
 
@@ -55,14 +170,17 @@ def ep_unimodality(X1, X2, t, y, Kf_kernel, Kg_kernel_list, sigma2, t2=None, m=N
 
     # moment function
     if moment_function is None:
-        moment_function = compute_moments_strict
+        moment_function = partial(compute_moments_strict, table=probit_table)
 
 
     ###################################################################################
     # Contruct kernels
     ###################################################################################
-    Kf = Kf_kernel.K(X1)
-    Kg_list = [kg.K(X2) for kg in Kg_kernel_list]
+    # the kernel matrices are stored in kernel_dtype, factorizations and site parameters are float64. The kernels
+    # evaluate them in float64, so the float64 matrix is briefly alive next to its cast copy
+    Kf = Kf_kernel.K(X1).astype(kernel_dtype, copy=False)
+    # structured priors (e.g. for Xd on a grid) replace the dense covariances of g
+    Kg_list = [kg.K(X2).astype(kernel_dtype, copy=False) for kg in Kg_kernel_list] if g_priors is None else g_priors
 
 
     ###################################################################################
@@ -83,29 +201,39 @@ def ep_unimodality(X1, X2, t, y, Kf_kernel, Kg_kernel_list, sigma2, t2=None, m=N
     g_ga_approx_list = [gaussianApproximation(v=np.zeros(2*M), tau=np.zeros(2*M)) for d in range(D)]
     g_cavity_list = [cavityParams(2*M) for d in range(D)]
 
-    # hardcode eta to 1
-    eta = 1
+    # adaptive damping (see ep_damping)
+    if damping is not None:
+        damping.reset()
+
+    # continue from a checkpoint
+    containers = (f_ga_approx, f_marg_moments, f_cavity, g_ga_approx_list, g_marg_moments_list, g_cavity_list)
+    start_itt = 0
+    if resume_from is not None:
+        start_itt, converged = load_ep_checkpoint(resume_from, rng, *containers)
+        if converged:
+            start_itt = max_itt
 
     ###################################################################################
     # Prepare global approximations
     ###################################################################################
-    f_posterior = update_posterior(Kf, f_ga_approx.v, f_ga_approx.tau)
-    g_posterior_list = [update_posterior(Kg_list[d], g_ga_approx_list[d].v, g_ga_approx_list[d].tau) for d in range(D)]
+    f_posterior = backend.posterior(Kf, f_ga_approx.v, f_ga_approx.tau)
+    g_posterior_list = [update_g_posterior(Kg_list[d], g_ga_approx_list[d].v, g_ga_approx_list[d].tau, backend) for d in range(D)]
 
 
 
     ###################################################################################
     # Iterate
     ###################################################################################
-    for itt in range(max_itt):
+    for itt in range(start_itt, max_itt):
 
         old_params = np.hstack((f_posterior.mu, f_posterior.Sigma_diag)) # , mu_g, Sigma_g
+        stats.start_iteration()
 
         if verbose > 0:
             print('Iteration %d' % (itt + 1))
 
         # approximate constraints to enforce monotonicity to g
-        d_list = np.random.choice(range(D), size=D, replace=False)
+        d_list = rng.permutation(D)
         for d in d_list:
 
             # get relevant EP parameters for dimension d
@@ -114,31 +242,37 @@ def ep_unimodality(X1, X2, t, y, Kf_kernel, Kg_kernel_list, sigma2, t2=None, m=N
             g_cavity = g_cavity_list[d]
             g_marg_mom = g_marg_moments_list[d]
 
-            j_list = np.random.choice(range(M), size=M, replace=False) if M > 0 else []
-            for j in j_list:
+            j_list = rng.permutation(M)
+            with stats.phase('g_sweep'):
+                for j in j_list:
 
-                # compute offset for radient indices
-                i = M + j
+                    # compute offset for radient indices
+                    i = M + j
 
-                # update cavity
-                g_cavity._update_i(eta=eta, ga_approx=g_ga_approx, post_params=g_posterior, i=i)
+                    # update cavity
+                    g_cavity._update_i(eta=eta, ga_approx=g_ga_approx, post_params=g_posterior, i=i)
 
-                # match moments
-                try:
-                    g_marg_mom.Z_hat[i], g_marg_mom.mu_hat[i], g_marg_mom.sigma2_hat[i] = match_moments_g(m[d,j], g_cavity.v[i], g_cavity.tau[i], nu)
-                except AssertionError:
-                    print('Numerical problem g-term i = %d, j = %d for dim = %d in iteration %d. Skipping update' % (i, j, d, itt))
-                    continue
+                    # match moments
+                    try:
+                        g_marg_mom.Z_hat[i], g_marg_mom.mu_hat[i], g_marg_mom.sigma2_hat[i] = match_moments_g(m[d,j], g_cavity.v[i], g_cavity.tau[i], nu, probit_table)
+                    except AssertionError:
+                        print('Numerical problem g-term i = %d, j = %d for dim = %d in iteration %d. Skipping update' % (i, j, d, itt))
+                        stats.skip('g', itt, d, j)
+                        if damping is not None:
+                            damping.reject(('g', d), i, 2*M)
+                        continue
 
-                # update
-                g_ga_approx._update_i(eta=eta, delta=alpha, post_params=g_posterior, marg_moments=g_marg_mom, i=i)
+                    # update
+                    if not _update_site(g_ga_approx, ('g', d), i, eta, alpha, damping, g_posterior, g_marg_mom, g_cavity):
+                        stats.skip('g', itt, d, j)
 
 
             # update joint
-            g_posterior_list[d] = update_posterior(Kg_list[d], g_ga_approx.v, g_ga_approx.tau)
+            with stats.phase('posterior'):
+                g_posterior_list[d] = update_g_posterior(Kg_list[d], g_ga_approx.v, g_ga_approx.tau, backend)
 
       # approximate constraints to enforce a single sign change for f'
-        d_list = np.random.choice(range(D), size=D, replace=False)
+        d_list = rng.permutation(D)
         for d in d_list:
 
             # get relevant EP parameters for dimension d
@@ -147,80 +281,379 @@ def ep_unimodality(X1, X2, t, y, Kf_kernel, Kg_kernel_list, sigma2, t2=None, m=N
             g_cavity = g_cavity_list[d]
             g_marg_mom = g_marg_moments_list[d]
 
-            j_list = np.random.choice(range(M), size=M, replace=False) if M > 0 else []
-            for j in j_list:
-
-                i = N + d*M +  j
-
-                # update cavities for f & g
-                f_cavity._update_i(eta=eta, ga_approx=f_ga_approx, post_params=f_posterior, i=i)
-                g_cavity._update_i(eta=eta, ga_approx=g_ga_approx, post_params=g_posterior, i=j)
-
-                # match moments
-                try:
-                    mom_f, mom_g = match_moments_fg(f_cavity.v[i], f_cavity.tau[i], g_cavity.v[j], g_cavity.tau[j], nu2, moment_function)
-                except AssertionError:
-                    print('Numerical problem fg-term i = %d, j = %d for dim = %d in iteration %d. Skipping update' % (i, j, d, itt))
-                    continue
-
-                # update marginal moments
-                f_marg_moments.Z_hat[i], f_marg_moments.mu_hat[i], f_marg_moments.sigma2_hat[i] = mom_f
-                g_marg_mom.Z_hat[j], g_marg_mom.mu_hat[j], g_marg_mom.sigma2_hat[j] = mom_g
-
-                # update sites
-                f_ga_approx._update_i(eta=eta, delta=alpha, post_params=f_posterior, marg_moments=f_marg_moments, i=i)
-                g_ga_approx._update_i(eta=eta, delta=alpha, post_params=g_posterior, marg_moments=g_marg_mom, i=j)
+            j_list = rng.permutation(M)
+            with stats.phase('fg_sweep'):
+                for j in j_list:
+
+                    i = N + d*M +  j
+
+                    # update cavities for f & g
+                    f_cavity._update_i(eta=eta, ga_approx=f_ga_approx, post_params=f_posterior, i=i)
+                    g_cavity._update_i(eta=eta, ga_approx=g_ga_approx, post_params=g_posterior, i=j)
+
+                    # match moments
+                    try:
+                        mom_f, mom_g = match_moments_fg(f_cavity.v[i], f_cavity.tau[i], g_cavity.v[j], g_cavity.tau[j], nu2, moment_function)
+                    except AssertionError:
+                        print('Numerical problem fg-term i = %d, j = %d for dim = %d in iteration %d. Skipping update' % (i, j, d, itt))
+                        stats.skip('fg', itt, d, j)
+                        if damping is not None:
+                            damping.reject('f', i, Df)
+                            damping.reject(('g', d), j, 2*M)
+                        continue
+
+                    # update marginal moments
+                    f_marg_moments.Z_hat[i], f_marg_moments.mu_hat[i], f_marg_moments.sigma2_hat[i] = mom_f
+                    g_marg_mom.Z_hat[j], g_marg_mom.mu_hat[j], g_marg_mom.sigma2_hat[j] = mom_g
+
+                    # update sites
+                    updated_f = _update_site(f_ga_approx, 'f', i, eta, alpha, damping, f_posterior, f_marg_moments, f_cavity)
+                    updated_g = _update_site(g_ga_approx, ('g', d), j, eta, alpha, damping, g_posterior, g_marg_mom, g_cavity)
+                    if not (updated_f and updated_g):
+                        stats.skip('fg', itt, d, j)
 
             # update posterior
-            g_posterior_list[d] = update_posterior(Kg_list[d], g_ga_approx.v, g_ga_approx.tau)
-            f_posterior = update_posterior(Kf, f_ga_approx.v, f_ga_approx.tau)
+            with stats.phase('posterior'):
+                g_posterior_list[d] = update_g_posterior(Kg_list[d], g_ga_approx.v, g_ga_approx.tau, backend)
+                f_posterior = backend.posterior(Kf, f_ga_approx.v, f_ga_approx.tau)
 
       # check for convergence
         new_params = np.hstack((f_posterior.mu, f_posterior.Sigma_diag)) # , mu_g, Sigma_g
-        if len(old_params) > 0 and np.mean((new_params-old_params)**2)/np.mean(old_params**2) < tol:
+        residual = np.mean((new_params-old_params)**2)/np.mean(old_params**2) if len(old_params) > 0 else np.inf
+        stats.end_iteration(residual)
+
+        if checkpoint is not None and ((itt + 1) % checkpoint_every == 0 or itt + 1 == max_itt or residual < tol):
+            save_ep_checkpoint(checkpoint, itt + 1, residual < tol, rng, *containers)
+
+        if residual < tol:
             run_time = time.time() - t0
 
             if verbose > 0:
                 print('Converged in %d iterations in %4.3fs' % (itt + 1, run_time))
             break
 
+        if damping is not None and damping.end_iteration(residual):
+            print('EP diverged in iteration %d (residual %g). Stopping' % (itt + 1, residual))
+            break
+
     #############################################################################3
     # Marginal likelihood & gradients
     #############################################################################3
 
-    # compute normalization constant for likelihoods
-    for i in range(N):
-        f_cavity._update_i(eta=eta, ga_approx=f_ga_approx, post_params=f_posterior, i=i)
-        f_marg_moments.Z_hat[i] = npdf(y[i, 0], f_cavity.v[i]/f_cavity.tau[i], 1./f_cavity.tau[i] + sigma2)
+    with stats.phase('marginal_likelihood'):
+        # compute normalization constant for likelihoods
+        for i in range(N):
+            f_cavity._update_i(eta=eta, ga_approx=f_ga_approx, post_params=f_posterior, i=i)
+            f_marg_moments.Z_hat[i] = npdf(y[i, 0], f_cavity.v[i]/f_cavity.tau[i], 1./f_cavity.tau[i] + sigma2)
 
 
-    # marginal likelihood and gradient contribution from f
-    Z_tilde = _log_Z_tilde(f_marg_moments, f_ga_approx, f_cavity)
-    f_post, f_logZ, f_grad = _inference(Kf, f_ga_approx, f_cavity, None, Z_tilde)
-    grad_dict = {'dL_dK_f': f_grad['dL_dK']}
+        # marginal likelihood and gradient contribution from f
+        Z_tilde = _log_Z_tilde(f_marg_moments, f_ga_approx, f_cavity)
+        f_post, f_logZ, f_grad = backend.inference(Kf, f_ga_approx, f_cavity, Z_tilde)
+        grad_dict = {'dL_dK_f': f_grad['dL_dK']}
 
-    # marginal likelihood and gradient contribution from each g
-    g_logZs = []
-    g_grads = []
-    for d in range(D):
-        Z_tilde = _log_Z_tilde(g_marg_moments_list[d], g_ga_approx_list[d], g_cavity_list[d])
-        g_post, g_logZ, g_grad = _inference(Kg_list[d], g_ga_approx_list[d], g_cavity_list[d], None, Z_tilde)
+        # marginal likelihood and gradient contribution from each g
+        g_logZs = []
+        g_grads = []
+        for d in range(D):
+            Z_tilde = _log_Z_tilde(g_marg_moments_list[d], g_ga_approx_list[d], g_cavity_list[d])
+            if hasattr(Kg_list[d], 'inference'):
+                g_post, g_logZ, g_grad = Kg_list[d].inference(g_ga_approx_list[d], Z_tilde)
+            else:
+                g_post, g_logZ, g_grad = backend.inference(Kg_list[d], g_ga_approx_list[d], g_cavity_list[d], Z_tilde)
 
-        g_logZs.append(g_logZ)
-        g_grads.append(g_grad)
+            g_logZs.append(g_logZ)
+            g_grads.append(g_grad)
 
-    
-    for d in range(D):
-        grad_dict['dL_dK_g%d' % d] = g_grads[d]['dL_dK']
 
-    # sum contributions
-    logZ = f_logZ + np.sum(g_logZs)
+        for d in range(D):
+            grad_dict['dL_dK_g%d' % d] = g_grads[d]['dL_dK']
+
+        # sum contributions
+        logZ = f_logZ + np.sum(g_logZs)
+
+    stats.finish(converged=len(stats.residuals) > 0 and stats.residuals[-1] < tol, diverged=damping is not None and damping.diverged)
 
 
     # Done
+    if return_sites:
+        return f_posterior, g_posterior_list, Kf, logZ, grad_dict, f_ga_approx, g_ga_approx_list
+
     return f_posterior, g_posterior_list, Kf, logZ, grad_dict#, mu_g, Sigma_g, Sigma_full_g, logZ
 
+###################################################################################
+# Batched EP for many independent models
+###################################################################################
+
+class _Stacked(object):
+    """ Stacked site, cavity or moment arrays of several EP approximations, with the attribute names of the GPy containers """
+
+    def __init__(self, **arrays):
+        self.__dict__.update(arrays)
+
+def batch_cholesky(A):
+    """ Cholesky factors of a stack of matrices, with jitchol for the matrices that are not numerically positive definite """
+    try:
+        return np.linalg.cholesky(A)
+    except np.linalg.LinAlgError:
+        from GPy.util.linalg import jitchol
+        return np.array([jitchol(a) for a in A])
+
+class BatchPosterior(object):
+    """ mu, Sigma_diag and the Cholesky factors L of B = I + S^(1/2) K S^(1/2) (see LeanPosterior) for a stack of
+        covariances K (B x n x n) and site parameters eta, theta (B x n) """
+
+    def __init__(self, K, eta, theta):
+        sqrt_theta = np.sqrt(theta)
+        G = sqrt_theta[:, :, None]*K
+        self.L = batch_cholesky(np.identity(K.shape[-1]) + G*sqrt_theta[:, None, :])
+
+        V = np.linalg.solve(self.L, G)
+        self.Sigma_diag = np.diagonal(K, axis1=1, axis2=2) - np.sum(V**2, axis=1)
+        self.mu = np.einsum('bij,bj->bi', K, eta) - np.einsum('bji,bj->bi', V, np.einsum('bij,bj->bi', V, eta))
+
+def _batch_update_sites(sites, cavity, moments, post, index, eta, alpha, mask, damping=None, key=None, shifts=None):
+    """ Moment and damped site updates of sites[:, index] for the models in mask, as gaussianApproximation._update_i:
+        the steps are scaled by alpha/eta and the precisions are clamped at machine epsilon. moments is a
+        (Z_hat, mu_hat, sigma2_hat) tuple of arrays; sites whose moments are not finite are skipped. damping is None or
+        a list with an ep_damping.AdaptiveDamping (or None) per model, which then updates or rejects the sites of model b
+        in its group key, where the site index of model b is the stacked index minus shifts[b]. Returns the number of
+        skipped sites. """
+    Z_hat, mu_hat, sigma2_hat = [np.broadcast_to(a, mask.shape) for a in moments]
+    mu, Sigma_diag = post.mu[:, index], post.Sigma_diag[:, index]
+    valid = mask & np.isfinite(Z_hat) & np.isfinite(mu_hat) & np.isfinite(sigma2_hat) & (sigma2_hat > 0)
+    cavity.Z_hat[:, index] = np.where(valid, Z_hat, cavity.Z_hat[:, index])
+
+    damped = np.zeros(len(mask), dtype=bool) if damping is None else np.array([d is not None for d in damping])
+    fixed = valid & ~damped[:, None]
+
+    tau = np.maximum(sites.tau[:, index] + alpha/eta*(1./sigma2_hat - 1./Sigma_diag), np.finfo(float).eps)
+    v = sites.v[:, index] + alpha/eta*(mu_hat/sigma2_hat - mu/Sigma_diag)
+
+    sites.tau[:, index] = np.where(fixed, tau, sites.tau[:, index])
+    sites.v[:, index] = np.where(fixed, v, sites.v[:, index])
+    skipped = np.sum(mask & ~valid)
+
+    # site by site updates with the damping of each model, on views of the model's own sites
+    for b in np.flatnonzero(damped & np.any(mask, axis=1)):
+        shift = 0 if shifts is None else shifts[b]
+        local = index - shift
+        view = lambda container, names: _Stacked(**{name: getattr(container, name)[b, shift:] for name in names})
+        ga_approx, post_params, cav = view(sites, ['v', 'tau']), view(post, ['mu', 'Sigma_diag']), view(cavity, ['v', 'tau'])
+
+        n = len(ga_approx.tau)
+        marg_moments = _Stacked(mu_hat=np.zeros(n), sigma2_hat=np.ones(n))
+        marg_moments.mu_hat[local], marg_moments.sigma2_hat[local] = mu_hat[b], sigma2_hat[b]
+        for i, is_masked, is_valid in zip(local, mask[b], valid[b]):
+            if not is_masked:
+                continue
+            if not is_valid:
+                damping[b].reject(key, i, n)
+            elif not damping[b].update_site(key, ga_approx, i, eta, post_params, marg_moments, cav):
+                skipped += 1
+
+    return skipped
+
+def _batch_cavity(sites, post, index, mask, cavity, eta=1.):
+    """ Cavity parameters at sites[:, index] as cavityParams._update_i, stored in cavity for the models in mask """
+    tau = 1./post.Sigma_diag[:, index] - eta*sites.tau[:, index]
+    v = post.mu[:, index]/post.Sigma_diag[:, index] - eta*sites.v[:, index]
+    cavity.tau[:, index] = np.where(mask, tau, cavity.tau[:, index])
+    cavity.v[:, index] = np.where(mask, v, cavity.v[:, index])
+    return cavity.v[:, index], cavity.tau[:, index]
+
+def _batch_inference(K, sites, cavity):
+    """ Log marginal likelihoods and dL_dK for stacked EP approximations (see _inference) """
+    post = BatchPosterior(K, sites.v, sites.tau)
+    n = K.shape[-1]
+
+    B_logdet = 2*np.sum(np.log(np.diagonal(post.L, axis1=1, axis2=2)), axis=1)
+    log_marginal = 0.5*(-n*log_2_pi - B_logdet + np.sum(sites.v*post.mu, axis=1)) + _log_Z_tilde(cavity, sites, cavity)
+
+    # alpha = (K + S^-1)^-1 S^-1 v = v - S mu, (K + S^-1)^-1 = S^(1/2) B^-1 S^(1/2)
+    alpha = sites.v - sites.tau*post.mu
+    LWi = np.linalg.solve(post.L, np.sqrt(sites.tau)[:, :, None]*np.identity(n))
+    Wi = np.einsum('bki,bkj->bij', LWi, LWi)
+    dL_dK = 0.5*(alpha[:, :, None]*alpha[:, None, :] - Wi)
+
+    return post, log_marginal, dL_dK
+
+def ep_unimodality_batch(Kf_list, Kg_list, y_list, sigma2_list, m=None, max_itt=50, nu=10., nu2=1., alpha=0.9, tol=1e-6, verbose=0, moment_function=None, seed=0, probit_table=None,
+                         eta=1., damping=None):
+    """ Run EP for B independent models at once.
+
+        Kf_list[b] is the covariance of f at [X_b; Xd_b] with N_b + D*M rows, Kg_list[b] the list of D covariances of
+        g at [Xd_b; Xd_b], y_list[b] the N_b observations and sigma2_list[b] the noise variance of model b. All models must
+        share D and M, while N_b may differ: the covariances of f are padded to max(N_b) observations with unit variance,
+        uncorrelated rows whose sites have zero precision, so they do not change the posterior or the marginal likelihood.
+
+        The site updates of each sweep use the posterior from before the sweep (as in ep_unimodality), so they are
+        computed for all sites and models at once with vectorized moment matching, and the posteriors with a stacked
+        Cholesky factorization. With the same seed, the sweeps visit the dimensions in the same order as ep_unimodality,
+        and each model stops updating when it has converged. moment_function must accept arrays. probit_table and eta
+        are as in ep_unimodality. damping is None (fixed damping alpha) or a list with an ep_damping.AdaptiveDamping per
+        model, which damps the sites of that model as in ep_unimodality and stops updating the model when it diverges.
+
+        Returns a list with the return_sites=True output of ep_unimodality for each model. """
+    from GPy.inference.latent_function_inference.expectation_propagation import gaussianApproximation
+
+    # seed is an int or a np.random.Generator (see random_streams), the global random state is not used
+    rng = as_generator(seed)
+    t0 = time.time()
+
+    if moment_function is None:
+        moment_function = partial(compute_moments_strict, table=probit_table)
+
+    B = len(Kf_list)
+    D = len(Kg_list[0])
+    M = Kg_list[0][0].shape[0]//2
+    N_list = [len(y) for y in y_list]
+    N = max(N_list)
+    Df = N + D*M
+
+    if m is None:
+        m = np.ones((D, M))
+
+    if damping is not None:
+        if len(damping) != B:
+            raise ValueError('damping must contain one AdaptiveDamping (or None) per model')
+        for model_damping in damping:
+            if model_damping is not None:
+                model_damping.reset()
+
+    ###################################################################################
+    # Stack and pad
+    ###################################################################################
+    observed = np.arange(N)[None, :] < np.array(N_list)[:, None]
+    index_list = [np.concatenate((np.arange(Nb), np.arange(N, Df))) for Nb in N_list]
+    shifts = N - np.array(N_list)
+
+    Kf = np.tile(np.identity(Df), (B, 1, 1))
+    for b in range(B):
+        Kf[b][np.ix_(index_list[b], index_list[b])] = Kf_list[b]
+    Kg = np.array([[np.asarray(K) for K in Kg_b] for Kg_b in Kg_list])
+
+    y = np.zeros((B, N))
+    y[observed] = np.concatenate([np.ravel(y_b) for y_b in y_list])
+    sigma2 = np.asarray(sigma2_list, dtype=float)*np.ones(B)
+
+    ###################################################################################
+    # Sites, cavities and global approximations
+    ###################################################################################
+    f_sites = _Stacked(v=np.zeros((B, Df)), tau=np.zeros((B, Df)))
+    f_sites.v[:, :N] = np.where(observed, y/sigma2[:, None], 0.)
+    f_sites.tau[:, :N] = np.where(observed, 1./sigma2[:, None], 0.)
+    f_cavity = _Stacked(v=np.zeros((B, Df)), tau=np.ones((B, Df)), Z_hat=np.ones((B, Df)))
+
+    g_sites = [_Stacked(v=np.zeros((B, 2*M)), tau=np.zeros((B, 2*M))) for d in range(D)]
+    g_cavity = [_Stacked(v=np.zeros((B, 2*M)), tau=np.ones((B, 2*M)), Z_hat=np.ones((B, 2*M))) for d in range(D)]
+
+    f_post = BatchPosterior(Kf, f_sites.v, f_sites.tau)
+    g_post = [BatchPosterior(Kg[:, d], g_sites[d].v, g_sites[d].tau) for d in range(D)]
+
+    active = np.ones(B, dtype=bool)
+    values, derivatives = np.arange(M), M + np.arange(M)
+
+    ###################################################################################
+    # Iterate
+    ###################################################################################
+    for itt in range(max_itt):
+
+        old_params = np.hstack((f_post.mu, f_post.Sigma_diag))
+        skipped = 0
+
+        # approximate constraints to enforce monotonicity to g
+        d_list = rng.permutation(D)
+        for d in d_list:
+            # the order of the sites within a sweep does not matter, draw it to keep the random state of ep_unimodality
+            rng.permutation(M)
+
+            mask = active[:, None]*np.ones((1, M), dtype=bool)
+            v_cav, tau_cav = _batch_cavity(g_sites[d], g_post[d], derivatives, mask, g_cavity[d], eta)
+            moments = match_moments_g(m[d], v_cav, tau_cav, nu, probit_table)
+            skipped += _batch_update_sites(g_sites[d], g_cavity[d], moments, g_post[d], derivatives, eta, alpha, mask, damping, ('g', d))
+
+            g_post[d] = BatchPosterior(Kg[:, d], g_sites[d].v, g_sites[d].tau)
+
+        # approximate constraints to enforce a single sign change for f'
+        d_list = rng.permutation(D)
+        for d in d_list:
+            rng.permutation(M)
+
+            f_index = N + d*M + np.arange(M)
+            mask = active[:, None]*np.ones((1, M), dtype=bool)
+            f_v_cav, f_tau_cav = _batch_cavity(f_sites, f_post, f_index, mask, f_cavity, eta)
+            g_v_cav, g_tau_cav = _batch_cavity(g_sites[d], g_post[d], values, mask, g_cavity[d], eta)
+
+            with np.errstate(all='ignore'):
+                mom_f, mom_g = match_moments_fg(f_v_cav, f_tau_cav, g_v_cav, g_tau_cav, nu2, moment_function)
+
+            # the sites are updated where both moments are valid
+            valid = mask & np.isfinite(mom_f[1]) & np.isfinite(mom_f[2]) & np.isfinite(mom_g[1]) & np.isfinite(mom_g[2])
+            skipped += _batch_update_sites(f_sites, f_cavity, mom_f, f_post, f_index, eta, alpha, valid, damping, 'f', shifts) + np.sum(mask & ~valid)
+            _batch_update_sites(g_sites[d], g_cavity[d], mom_g, g_post[d], values, eta, alpha, valid, damping, ('g', d))
+            if damping is not None:
+                for b, j in zip(*np.nonzero(mask & ~valid)):
+                    if damping[b] is not None:
+                        damping[b].reject('f', f_index[j] - shifts[b], Df - shifts[b])
+                        damping[b].reject(('g', d), j, 2*M)
+
+            g_post[d] = BatchPosterior(Kg[:, d], g_sites[d].v, g_sites[d].tau)
+            f_post = BatchPosterior(Kf, f_sites.v, f_sites.tau)
+
+        if verbose > 0:
+            print('Iteration %d: %d active models, %d site updates skipped' % (itt + 1, np.sum(active), skipped))
+
+        # check for convergence of each model, ignoring the padded rows
+        new_params = np.hstack((f_post.mu, f_post.Sigma_diag))
+        rows = np.hstack((observed, np.ones((B, D*M), dtype=bool)))
+        rows = np.hstack((rows, rows))
+        change = np.sum(rows*(new_params - old_params)**2, axis=1)/np.sum(rows*old_params**2, axis=1)
+        converged = change < tol
+        if damping is not None:
+            for b in np.flatnonzero(active & ~converged):
+                if damping[b] is not None and damping[b].end_iteration(change[b]):
+                    print('EP diverged for model %d in iteration %d (residual %g). Stopping' % (b, itt + 1, change[b]))
+                    converged[b] = True
+        active &= ~converged
+
+        if not np.any(active):
+            if verbose > 0:
+                print('Converged in %d iterations in %4.3fs' % (itt + 1, time.time() - t0))
+            break
+
+    #############################################################################3
+    # Marginal likelihood & gradients
+    #############################################################################3
+
+    # normalization constants of the likelihood terms
+    obs = np.arange(N)
+    _batch_cavity(f_sites, f_post, obs, np.ones((B, N), dtype=bool), f_cavity, eta)
+    f_cavity.Z_hat[:, :N] = np.where(observed, npdf(y, f_cavity.v[:, :N]/f_cavity.tau[:, :N], 1./f_cavity.tau[:, :N] + sigma2[:, None]), 1.)
+
+    _, f_logZ, f_dL_dK = _batch_inference(Kf, f_sites, f_cavity)
+    g_inference = [_batch_inference(Kg[:, d], g_sites[d], g_cavity[d]) for d in range(D)]
+
+    results = []
+    for b in range(B):
+        index = index_list[b]
+        sites = gaussianApproximation(v=f_sites.v[b, index], tau=f_sites.tau[b, index])
+        f_posterior = LeanPosterior(Kf_list[b], sites.v, np.sqrt(sites.tau), f_post.L[b][np.ix_(index, index)])
+
+        g_sites_b = [gaussianApproximation(v=g_sites[d].v[b].copy(), tau=g_sites[d].tau[b].copy()) for d in range(D)]
+        g_posteriors = [LeanPosterior(Kg[b, d], g_sites_b[d].v, np.sqrt(g_sites_b[d].tau), g_post[d].L[b]) for d in range(D)]
+
+        grad_dict = {'dL_dK_f': f_dL_dK[b][np.ix_(index, index)]}
+        for d in range(D):
+            grad_dict['dL_dK_g%d' % d] = g_inference[d][2][b]
+
+        logZ = f_logZ[b] + sum(g_inference[d][1][b] for d in range(D))
+        results.append((f_posterior, g_posteriors, Kf_list[b], logZ, grad_dict, sites, g_sites_b))
+
+    return results
+
 def compute_dl_dK(posterior, K, eta, theta, prior_mean = 0):
+    from GPy.util.linalg import dtrtrs, dpotrs, tdot, symmetrify
     tau, v = theta, eta
 
     tau_tilde_root = np.sqrt(tau)
@@ -256,13 +689,22 @@ def compute_marginal_likelihood_mvn(posterior, eta, theta, skip_problematic=None
     return -0.5*len(mu)*np.log(2*np.pi)  - logdet - quadterm
 
 
-def match_moments_g(m, eta_cav, theta_cav, nu):
+def _update_site(ga_approx, key, i, eta, alpha, damping, post_params, marg_moments, cavity):
+    """ Site update of ga_approx[i] damped by alpha, or by the damping of the site in damping (an AdaptiveDamping, which
+        may reject the update). Returns whether the site was updated. """
+    if damping is None:
+        ga_approx._update_i(eta=eta, delta=alpha, post_params=post_params, marg_moments=marg_moments, i=i)
+        return True
+    return damping.update_site(key, ga_approx, i, eta, post_params, marg_moments, cavity)
+
+
+def match_moments_g(m, eta_cav, theta_cav, nu, table=None):
 
     # compute mean and variance of cavity
     m_cav, v_cav = eta_cav/theta_cav, 1./theta_cav
 
     # compute moments
-    Z, site_m, site_m2 = ProbitMoments.compute_moments(m=0, v=1./(m*nu), mu=m_cav, sigma2=v_cav, return_normalizer=True, normalized=True)
+    Z, site_m, site_m2 = ProbitMoments.compute_moments(m=0, v=1./(m*nu), mu=m_cav, sigma2=v_cav, return_normalizer=True, normalized=True, table=table)
     
     # compute variance
     site_v = site_m2 - site_m**2
@@ -286,17 +728,18 @@ def match_moments_fg(eta_cav_fp, theta_cav_fp, eta_cav_g, theta_cav_g, nu2, mome
     return (Z, site_fp_m, site_fp_v), (1, site_g_m, site_g_v)
 
 def _log_Z_tilde(marg_moments, ga_approx, cav_params):
+    """ Sum over the last axis, i.e. one value per EP approximation for stacked site parameters """
     return np.sum((np.log(marg_moments.Z_hat) + 0.5*np.log(2*np.pi) + 0.5*np.log(1+ga_approx.tau/cav_params.tau) - 0.5 * ((ga_approx.v)**2 * 1./(cav_params.tau + ga_approx.tau))
-            + 0.5*(cav_params.v * ( ( (ga_approx.tau/cav_params.tau) * cav_params.v - 2.0 * ga_approx.v ) * 1./(cav_params.tau + ga_approx.tau)))))
+            + 0.5*(cav_params.v * ( ( (ga_approx.tau/cav_params.tau) * cav_params.v - 2.0 * ga_approx.v ) * 1./(cav_params.tau + ga_approx.tau)))), axis=-1)
 
 
 def _ep_marginal(K, ga_approx, Z_tilde):
-    post_params = posteriorParams._recompute(K, ga_approx)
+    post_params = update_posterior(K, ga_approx.v, ga_approx.tau, lean=True)
 
     # Gaussian log marginal excluding terms that can go to infinity due to arbitrarily small tau_tilde.
     # These terms cancel out with the terms excluded from Z_tilde
     B_logdet = np.sum(2.0*np.log(np.diag(post_params.L)))
-    log_marginal =  0.5*(-len(ga_approx.tau) * log_2_pi - B_logdet + np.sum(ga_approx.v * np.dot(post_params.Sigma,ga_approx.v)))
+    log_marginal =  0.5*(-len(ga_approx.tau) * log_2_pi - B_logdet + np.sum(ga_approx.v * post_params.mu))
     log_marginal += Z_tilde
 
     return log_marginal, post_params
@@ -304,6 +747,9 @@ def _ep_marginal(K, ga_approx, Z_tilde):
 
 
 def _inference(K, ga_approx, cav_params, likelihood, Z_tilde, Y_metadata=None):
+    from GPy.util.linalg import dtrtrs, dpotrs, tdot, symmetrify
+    from GPy.inference.latent_function_inference.posterior import PosteriorEP as Posterior
+
     log_marginal, post_params = _ep_marginal(K, ga_approx, Z_tilde)
 
     tau_tilde_root = np.sqrt(ga_approx.tau)
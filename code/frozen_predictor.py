@@ -0,0 +1,125 @@
+""" Frozen, GPy-free predictor for a fitted UnimodalGP.
+
+    For a fitted model, the predictive distribution of f (and similarly of each g) at new inputs Xp is
+
+        mean = Kpf.dot(a),                 a = Kff^-1 mu
+        var  = kpp - sum((Kpf.dot(W))*Kpf)  W = Kff^-1 - Kff^-1 Sigma Kff^-1
+
+    where mu and Sigma are the EP posterior of f and its derivatives at Xf. FrozenUnimodalGP stores the training inputs,
+    the kernel hyperparameters and the precomputed woodbury vectors a and matrices W, and evaluates the cross-covariances
+    Kpf in closed form with rbf_kernels. It depends on numpy only and can be saved to and loaded from a single .npz file.
+"""
+
+import numpy as np
+
+from rbf_kernels import scaled_differences, cross_covariance, derivative_cross_covariances
+from npz_io import save_npz, load_npz
+import mode_locator
+
+FORMAT_VERSION = 1
+
+
+class FrozenUnimodalGP(object):
+    """ Predictor with the predict and predict_g interface of UnimodalGP. The g arrays are stacked over dimensions, i.e.
+        g_lengthscale has shape (D, D), g_woodbury_vector (D, 2M) and g_woodbury_matrix (D, 2M, 2M). """
+
+    def __init__(self, X, Xd, sigma2, f_variance, f_lengthscale, f_bias, f_woodbury_vector, f_woodbury_matrix,
+                 g_variance, g_lengthscale, g_bias, g_woodbury_vector, g_woodbury_matrix):
+        self.X, self.Xd = np.asanyarray(X), np.asanyarray(Xd)
+        self.N, self.D = self.X.shape
+        self.M = self.Xd.shape[0]
+        self.sigma2 = float(sigma2)
+
+        self.f_variance, self.f_lengthscale, self.f_bias = np.asarray(f_variance), np.asarray(f_lengthscale), np.asarray(f_bias)
+        self.f_woodbury_vector, self.f_woodbury_matrix = np.asanyarray(f_woodbury_vector), np.asanyarray(f_woodbury_matrix)
+
+        self.g_variance, self.g_lengthscale, self.g_bias = np.asarray(g_variance), np.asarray(g_lengthscale), np.asarray(g_bias)
+        self.g_woodbury_vector, self.g_woodbury_matrix = np.asanyarray(g_woodbury_vector), np.asanyarray(g_woodbury_matrix)
+
+    @property
+    def dtype(self):
+        return self.f_woodbury_matrix.dtype
+
+    def astype(self, dtype):
+        """ Copy of the predictor with all arrays cast to dtype, e.g. np.float32 to halve memory and bandwidth in predict """
+        return FrozenUnimodalGP(**{name: value.astype(dtype) if value.dtype.kind == 'f' else value for name, value in self._arrays().items()})
+
+    def predict(self, Xnew, include_likelihood=True):
+        """ Predictive mean and variance of f (plus the noise variance if include_likelihood is True) at Xnew """
+        Xnew = np.asarray(Xnew, dtype=self.dtype)
+        Kpf = cross_covariance(Xnew, self.X, self.Xd, self.f_variance, self.f_lengthscale, self.f_bias)
+
+        pred_mean = np.dot(Kpf, self.f_woodbury_vector)
+        pred_var = self.f_variance + self.f_bias - np.sum(np.dot(Kpf, self.f_woodbury_matrix)*Kpf, axis=1)
+
+        if include_likelihood:
+            pred_var = pred_var + self.sigma2
+
+        return pred_mean, pred_var
+
+    def predict_g(self, Xnew, g_index=0, full_cov=False):
+        """ Predictive mean and (co)variance of g for dimension g_index at Xnew """
+        Xnew = np.asarray(Xnew, dtype=self.dtype)
+        variance, lengthscale, bias = self.g_variance[g_index], self.g_lengthscale[g_index], self.g_bias[g_index]
+        W = self.g_woodbury_matrix[g_index]
+
+        Kpg = cross_covariance(Xnew, self.Xd, self.Xd, variance, lengthscale, bias, dims=[g_index])
+        pred_mean = np.dot(Kpg, self.g_woodbury_vector[g_index])
+
+        if full_cov:
+            _, r2 = scaled_differences(Xnew, Xnew, lengthscale)
+            pred_cov = variance*np.exp(-0.5*r2) + bias - np.dot(np.dot(Kpg, W), Kpg.T)
+        else:
+            pred_cov = variance + bias - np.sum(np.dot(Kpg, W)*Kpg, axis=1)
+
+        return pred_mean, pred_cov
+
+    def predict_g_all(self, Xnew):
+        """ Predictive means and variances of g for all dimensions at Xnew, both of shape (len(Xnew), D) """
+        Xnew = np.asarray(Xnew, dtype=self.dtype)
+        Kpg = derivative_cross_covariances(Xnew, self.Xd, self.g_variance, self.g_lengthscale, self.g_bias)
+        return predict_stacked(Kpg, self.g_variance + self.g_bias, self.g_woodbury_vector, self.g_woodbury_matrix)
+
+    def locate_mode(self, bounds=None, **kwargs):
+        """ Mode of f bracketed by the sign changes of the posterior means of g (see mode_locator.locate_mode) """
+        return mode_locator.locate_mode(self, bounds=bounds, **kwargs)
+
+    def save(self, path):
+        """ Save the predictor to an (uncompressed) .npz file """
+        save_npz(path, version=FORMAT_VERSION, **self._arrays())
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """ Load a predictor saved with save. If mmap is True, the woodbury matrices and inputs are memory-mapped. """
+        data = load_npz(path, mmap=mmap)
+        if int(data['version']) != FORMAT_VERSION:
+            raise ValueError('Unsupported frozen predictor format version %d' % int(data['version']))
+        return cls(**{name: data[name] for name in data if name != 'version'})
+
+    def _arrays(self):
+        names = ['X', 'Xd', 'sigma2', 'f_variance', 'f_lengthscale', 'f_bias', 'f_woodbury_vector', 'f_woodbury_matrix',
+                 'g_variance', 'g_lengthscale', 'g_bias', 'g_woodbury_vector', 'g_woodbury_matrix']
+        return {name: np.asarray(getattr(self, name)) for name in names}
+
+
+def predict_stacked(Kp, prior_variance, vectors, matrices):
+    """ Predictive means and variances, shape (Np, D), from the cross-covariances Kp (D, Np, n), the prior variances (D,)
+        and the stacked woodbury vectors (D, n) and matrices (D, n, n) of D independent posteriors """
+    mean = np.einsum('dpn,dn->pd', Kp, vectors)
+    # one BLAS product per dimension, np.matmul of the stacks is several times slower
+    var = prior_variance - np.column_stack([np.einsum('pn,pn->p', np.dot(K, W), K) for K, W in zip(Kp, matrices)])
+    return mean, var
+
+
+def woodbury(K, mu, Sigma):
+    """ Return the woodbury vector K^-1 mu and matrix K^-1 - K^-1 Sigma K^-1 of a posterior N(mu, Sigma) with prior covariance K """
+    vector = np.linalg.solve(K, mu)
+    matrix = np.linalg.solve(K, np.linalg.solve(K, K - Sigma).T)
+    return vector, 0.5*(matrix + matrix.T)
+
+
+def site_woodbury(mu, Sigma, v, tau):
+    """ Woodbury vector and matrix of an EP posterior N(mu, Sigma) with site parameters v and tau. These equal v - tau*mu
+        and (K + S^-1)^-1 = S - S Sigma S with S = diag(tau), which avoids solves with the (often ill-conditioned) K. """
+    matrix = np.diag(tau) - tau[:, None]*Sigma*tau[None, :]
+    return v - tau*mu, 0.5*(matrix + matrix.T)
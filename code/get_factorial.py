@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.linalg import hadamard
 
 def get_factorial(dims):
     if dims == 1:
@@ -118,4 +119,12 @@ def get_factorial(dims):
                               [+1.,  -1.,  +1.,  +1.,  -1.,  -1.,  +1.,  -1.,  -1.,  -1.,  +1.],\
                               [-1.,  +1.,  +1.,  +1.,  -1.,  +1.,  -1.,  -1.,  -1.,  -1.,  -1.],\
                               [+1.,  +1.,  +1.,  +1.,  +1.,  +1.,  +1.,  +1.,  +1.,  +1.,  +1.]])
-    return factorial
\ No newline at end of file
+    else:
+        factorial = fractional_factorial(dims)
+    return factorial
+
+def fractional_factorial(dims):
+    """ Two-level resolution III design for any number of factors: columns 1 to dims of the Sylvester-Hadamard matrix
+        with the smallest power of two number of runs larger than dims """
+    num_runs = 2**int(np.ceil(np.log2(dims + 1)))
+    return hadamard(num_runs)[:, 1:dims + 1].astype(float)
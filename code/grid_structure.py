@@ -0,0 +1,145 @@
+""" Kronecker-structured priors for g when the virtual points Xd form a tensor grid.
+
+    For a separable RBF kernel and Xd = x_0 x x_1 x ... x x_{D-1}, the covariance of [g(Xd), dg/dx_d(Xd)] is, up to a
+    permutation of the rows, variance*kron(F_0, ..., F_{D-1}), where F_a is the 1-D RBF covariance on the axis x_a for
+    a != d and F_d is the 2m_d x 2m_d covariance of [g, g'] on x_d. The eigendecompositions of the small factors give the
+    eigenpairs of the full matrix, of which the leading ones (eigenvalues above rtol times the largest) are kept and the
+    remainder is replaced by its diagonal:
+
+        Kg ~ diag(a) + U U^T,    U = Q_r Lambda_r^(1/2)
+
+    With EP sites S = diag(tau), v, the posterior Sigma = (Kg^-1 + S)^-1 and the log determinant needed by the marginal
+    likelihood then only require the r x r matrix E = I + U^T diag(tau/(1 + a*tau)) U, i.e. O(M r^2) instead of O(M^3).
+
+    The largest factor has 2m_d rows, so the eigendecompositions cost O(max_a m_a^3) instead of O(M^3). For D = 1 the
+    only factor is the full 2M x 2M covariance, so there is no saving and detect_grid does not report 1-D grids.
+"""
+
+from collections import namedtuple
+from functools import reduce
+
+import numpy as np
+from scipy.linalg import solve_triangular
+
+# dense matrices are cheaper than the structured form for small grids
+MIN_STRUCTURED_SIZE = 500
+
+Grid = namedtuple('Grid', ['axes', 'row_of'])
+
+
+def detect_grid(X):
+    """ If the rows of X form a full tensor grid in at least 2 dimensions, return Grid(axes, row_of), where axes are the
+        sorted coordinates along each dimension and row_of[i_0, ..., i_{D-1}] is the row of X at grid point
+        (axes[0][i_0], ...). Otherwise (including any X with a single column) return None. """
+    X = np.asarray(X)
+    if X.shape[1] < 2:
+        return None
+    axes = [np.unique(X[:, a]) for a in range(X.shape[1])]
+    shape = tuple(len(axis) for axis in axes)
+
+    if np.prod(shape) != len(X):
+        return None
+
+    index = np.column_stack([np.searchsorted(axis, X[:, a]) for a, axis in enumerate(axes)])
+    flat = np.ravel_multi_index(index.T, shape)
+    if len(np.unique(flat)) != len(X):
+        return None
+
+    row_of = np.zeros(len(X), dtype=int)
+    row_of[flat] = np.arange(len(X))
+    return Grid(axes, row_of.reshape(shape))
+
+
+def rbf_factor(x, lengthscale):
+    return np.exp(-0.5*(x[:, None] - x[None, :])**2/lengthscale**2)
+
+
+def rbf_derivative_factor(x, lengthscale):
+    """ 1-D covariance of [g(x), g'(x)] for a unit variance RBF kernel """
+    T = rbf_factor(x, lengthscale)
+    u = (x[:, None] - x[None, :])/lengthscale**2
+    return np.block([[T, T*u], [-u*T, T*(1./lengthscale**2 - u**2)]])
+
+
+class KroneckerPrior(object):
+    """ Low rank plus diagonal approximation diag(a) + U U^T of the covariance of [g(Xd), dg/dx_d(Xd)] on a tensor grid,
+        in the row order of UnimodalGP.Xg """
+
+    def __init__(self, grid, variance, lengthscale, d, rtol=1e-10, max_rank=None):
+        D = len(grid.axes)
+        lengthscale = np.ones(D)*lengthscale
+        M = grid.row_of.size
+
+        factors = [rbf_derivative_factor(axis, lengthscale[a]) if a == d else rbf_factor(axis, lengthscale[a]) for a, axis in enumerate(grid.axes)]
+        eigs = [np.linalg.eigh(F) for F in factors]
+        sizes = tuple(len(F) for F in factors)
+
+        # leading eigenvalues of the Kronecker product
+        eigenvalues = variance*reduce(np.multiply.outer, [np.maximum(lam, 0) for lam, _ in eigs]).ravel()
+        order = np.argsort(eigenvalues)[::-1]
+        order = order[eigenvalues[order] > rtol*eigenvalues[order[0]]][:max_rank]
+        K_index = np.unravel_index(order, sizes)
+
+        # Kronecker eigenvectors, evaluated at the selected columns only
+        J_index = np.indices(sizes).reshape(D, -1)
+        U = np.sqrt(eigenvalues[order])*reduce(np.multiply, [Q[J_index[a][:, None], K_index[a][None, :]] for a, (_, Q) in enumerate(eigs)])
+
+        # rows of the Kronecker order in Xg: g values first, then derivatives
+        grid_index = list(J_index)
+        derivative = grid_index[d] // len(grid.axes[d])
+        grid_index[d] = grid_index[d] % len(grid.axes[d])
+        perm = derivative*M + grid.row_of[tuple(grid_index)]
+
+        self.U = np.zeros_like(U)
+        self.U[perm] = U
+
+        diag = variance*np.where(np.arange(2*M) < M, 1., 1./lengthscale[d]**2)
+        self.a = np.maximum(diag - np.sum(self.U**2, axis=1), 0.)
+        self.shape = (2*M, 2*M)
+
+    @property
+    def rank(self):
+        return self.U.shape[1]
+
+    def dense(self):
+        return np.diag(self.a) + np.dot(self.U, self.U.T)
+
+    def posterior(self, eta, theta):
+        return LowRankPosterior(self, eta, theta)
+
+    def inference(self, ga_approx, Z_tilde):
+        """ Log marginal likelihood and its gradient with respect to the (approximated) covariance, as ep_unimodality._inference """
+        post = self.posterior(ga_approx.v, ga_approx.tau)
+        tau = ga_approx.tau
+
+        B_logdet = np.sum(np.log(1 + self.a*tau)) + 2*np.sum(np.log(np.diag(post.L)))
+        log_marginal = 0.5*(-len(tau)*np.log(2*np.pi) - B_logdet + np.dot(ga_approx.v, post.mu)) + Z_tilde
+
+        # (K + S^-1)^-1 = S - S Sigma S = diag(tau*c) - Y Y^T
+        alpha = ga_approx.v - tau*post.mu
+        Y = solve_triangular(post.L, (tau*post.c*self.U.T), lower=True).T
+        Wi = np.diag(tau*post.c) - np.dot(Y, Y.T)
+        dL_dK = 0.5*(np.outer(alpha, alpha) - Wi)
+
+        return post, log_marginal, {'dL_dK': dL_dK}
+
+
+class LowRankPosterior(object):
+    """ Posterior N(mu, Sigma) with Sigma = diag(p) + R E^-1 R^T, where p = a*c, R = c*U and c = 1/(1 + a*tau).
+        Provides mu and Sigma_diag as used by the EP updates; the dense Sigma is computed on demand. """
+
+    def __init__(self, prior, eta, theta):
+        self.c = 1./(1 + prior.a*theta)
+        self.p = prior.a*self.c
+
+        E = np.identity(prior.rank) + np.dot(prior.U.T, (theta*self.c)[:, None]*prior.U)
+        self.L = np.linalg.cholesky(E)
+
+        V = solve_triangular(self.L, self.c*prior.U.T, lower=True)
+        self.mu = self.p*eta + np.dot(V.T, np.dot(V, eta))
+        self.Sigma_diag = self.p + np.sum(V**2, axis=0)
+        self._V = V
+
+    @property
+    def Sigma(self):
+        return np.diag(self.p) + np.dot(self._V.T, self._V)
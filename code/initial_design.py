@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.spatial.distance import pdist
+
+from get_factorial import get_factorial
+from random_streams import as_generator
+
+
+def factorial_design(n, dim, rng=None):
+    """ Fractional factorial design at 0.5 +- 0.3 plus the center point (rng is ignored). Its size is fixed by dim, so
+        n must be None or equal to that size. """
+    x = get_factorial(dim)*3./10. + 0.5
+    x = np.append(x, 0.5*np.ones((1, dim)), axis=0)
+    if n is not None and n != len(x):
+        raise ValueError('The factorial design in %d dimensions has %d points, got n=%d (use n=None or another design)' % (dim, len(x), n))
+    return x
+
+
+def latin_hypercube(n, dim, rng=None):
+    """ Random Latin hypercube design: each dimension has exactly one point in each of the n strata. """
+    rng = as_generator(rng)
+    strata = np.column_stack([rng.permutation(n) for d in range(dim)])
+    return (strata + rng.random((n, dim)))/n
+
+
+def sobol(n, dim, scramble=True, rng=None):
+    """ First n points of a (scrambled) Sobol sequence. Requires scipy >= 1.7. """
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError('Sobol designs require scipy.stats.qmc (scipy >= 1.7)')
+
+    sampler = qmc.Sobol(d=dim, scramble=scramble, seed=as_generator(rng))
+    return sampler.random_base2(int(np.ceil(np.log2(max(n, 1)))))[:n]
+
+
+def maximin(n, dim, num_candidates=100, rng=None):
+    """ Latin hypercube design with the largest minimum distance between points out of num_candidates random ones. """
+    rng = as_generator(rng)
+    best, best_distance = None, -np.inf
+    for i in range(num_candidates):
+        x = latin_hypercube(n, dim, rng)
+        distance = np.min(pdist(x)) if n > 1 else 0.
+        if distance > best_distance:
+            best, best_distance = x, distance
+    return best
+
+
+DESIGNS = {'factorial': factorial_design, 'lhs': latin_hypercube, 'sobol': sobol, 'maximin': maximin}
+
+
+def get_design(name, n, dim, bounds=None, rng=None):
+    """ Generate an initial design with n points in dim dimensions, scaled from the unit cube to bounds (array of shape (dim, 2)).
+        If n is None, the factorial design has its natural size and the other designs 2*dim + 1 points. Random designs
+        are drawn from rng (see random_streams). """
+    if name not in DESIGNS:
+        raise ValueError('Unknown design %s, choose from %s' % (name, sorted(DESIGNS)))
+
+    if n is None and name != 'factorial':
+        n = 2*dim + 1
+    x = DESIGNS[name](n, dim, rng=rng)
+
+    if bounds is not None:
+        bounds = np.asarray(bounds, dtype=float)
+        x = bounds[:, 0] + x*(bounds[:, 1] - bounds[:, 0])
+
+    return x
+
+
+def evaluate_design(func, x, pool=None):
+    """ Evaluate func at the rows of x and return the values as a column vector. Functions with a true vectorized
+        attribute are evaluated in a single batch call, otherwise the points are evaluated with pool.map if a pool is given. """
+    if getattr(func, 'vectorized', False):
+        y = func.do_evaluate(x)
+    elif pool is not None:
+        y = pool.map(func.do_evaluate, list(x))
+    else:
+        y = [func.do_evaluate(x[i, :]) for i in range(x.shape[0])]
+    return np.reshape(y, (-1, 1))
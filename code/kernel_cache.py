@@ -0,0 +1,123 @@
+""" Kernel matrices shared by EP, the gradient updates and prediction of a UnimodalGP.
+
+    During hyperparameter optimization, the same covariance of f at Xf is needed by ep_unimodality (K) and by
+    update_gradients_full (which recomputes the scaled differences of RBFDerivative), and prediction at a fixed set of
+    points (e.g. the candidates of an acquisition function) needs the same cross-covariances repeatedly. A KernelCache
+    stores such values under (kernel, name, parameter vector, inputs), where the inputs are identified by shape, dtype
+    and a hash of their contents, so that in-place changes of an input array or of the parameters never return stale
+    values. Kernels are identified by a token that the cache assigns to each kernel object and forgets, together with
+    the values of the kernel, when the kernel is garbage collected (unlike id(kernel), which may then be reused). The
+    least recently used entries are evicted when the cached arrays exceed max_bytes.
+
+    Prediction inputs are often used once (e.g. the points of an optimizer step). K(..., source=Xnew) therefore neither
+    hashes nor stores the inputs built from the caller's array Xnew until the same array object is passed again.
+
+    Copies and pickles of a cache are empty, so model.copy() and process pools do not duplicate the cached arrays.
+"""
+
+import itertools
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _array_key(X):
+    if X is None:
+        return None
+    X = np.ascontiguousarray(X)
+    return X.shape, X.dtype.str, hash(X.tobytes())
+
+
+def _nbytes(value):
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return getattr(value, 'nbytes', 0)
+
+
+class KernelCache(object):
+    """ LRU cache of values computed from a kernel and its inputs (see module docstring) """
+
+    def __init__(self, max_bytes=128*2**20):
+        self.max_bytes = max_bytes
+        # id(obj) -> (weakref to obj, token) for the kernels and sources seen by the cache
+        self._tokens = {}
+        self._next_token = itertools.count()
+        self.clear()
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _token(self, obj):
+        """ (token, new) for obj, where new is whether obj had not been seen by the cache """
+        entry = self._tokens.get(id(obj))
+        if entry is not None and entry[0]() is obj:
+            return entry[1], False
+        token = next(self._next_token)
+        self._tokens[id(obj)] = (weakref.ref(obj, lambda ref, key=id(obj): self._forget(key, token)), token)
+        return token, True
+
+    def _forget(self, key, token):
+        """ Drop the token of a garbage collected object and the values cached under it """
+        if key in self._tokens and self._tokens[key][1] == token:
+            del self._tokens[key]
+        for entry_key in [entry_key for entry_key in self._entries if entry_key[0] == token]:
+            self.nbytes -= self._entries.pop(entry_key)[1]
+
+    def key(self, kernel, name, X, X2=None):
+        return self._token(kernel)[0], name, np.asarray(kernel.param_array).tobytes(), _array_key(X), _array_key(X2)
+
+    def get(self, kernel, name, compute, X, X2=None):
+        """ Cached value of compute() for kernel, name and the inputs X, X2 (compute is called on a miss) """
+        key = self.key(kernel, name, X, X2)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+        self.misses += 1
+        value = compute()
+        size = _nbytes(value)
+        if size <= self.max_bytes:
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+        return value
+
+    def K(self, kernel, X, X2=None, source=None):
+        """ kernel.K(X, X2) through the cache. If source is the caller's array from which the inputs were built, the
+            first call with a source object computes K without hashing or storing it (see module docstring). """
+        if source is not None:
+            try:
+                new = self._token(source)[1]
+            except TypeError:
+                # e.g. lists, which cannot be tracked
+                new = True
+            if new:
+                self.misses += 1
+                return kernel.K(X, X2)
+        return self.get(kernel, 'K', lambda: kernel.K(X, X2), X, X2)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __deepcopy__(self, memo):
+        # registered in memo, so that the copies of the kernels of a model share the copy of its cache
+        memo[id(self)] = copy = KernelCache(self.max_bytes)
+        return copy
+
+    def __getstate__(self):
+        return dict(max_bytes=self.max_bytes)
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+    def __repr__(self):
+        return 'KernelCache(entries=%d, MB=%.1f, hits=%d, misses=%d)' % (len(self), self.nbytes/2.**20, self.hits, self.misses)
@@ -1,19 +1,18 @@
 import numpy as np
-from scipy.integrate import quad
-from scipy.stats import norm
-from scipy.misc import logsumexp
+from scipy.special import erf, ndtr
 
-from probit_moments import ProbitMoments
-from GPy.util.univariate_Gaussian import std_norm_pdf, std_norm_cdf, derivLogCdfNormal, logCdfNormal
+from probit_moments import ProbitMoments, derivLogCdfNormal, logCdfNormal
 
 
 
-phi = lambda x: norm.cdf(x)
+phi = lambda x: ndtr(x)
 npdf = lambda x, m, v: 1./np.sqrt(2*np.pi*v)*np.exp(-(x-m)**2/(2*v))
 
 
 
 def compute_moments_softinformation(mf, vf, mg, vg, n_std=6, nu2 = 1.):
+    # quadrature is only needed here, import it on first use
+    from scipy.integrate import quad
 
     def tilted_marginalized_f(g):
         """ Return m0, m1, m2 given by
@@ -55,7 +54,16 @@ def compute_moments_softinformation(mf, vf, mg, vg, n_std=6, nu2 = 1.):
     
 
 
-def compute_moments_strict(mf, vf, mg, vg, nu2 = 1.):
+def _log_cdf_and_ratio(z, table):
+    """ log Phi(z), phi(z)/Phi(z) and log Phi(-z) """
+    if table is None:
+        return logCdfNormal(z), derivLogCdfNormal(z), logCdfNormal(-z)
+    log_cdf, ratio = table(z)
+    return log_cdf, ratio, table(-z)[0]
+
+
+def compute_moments_strict(mf, vf, mg, vg, nu2 = 1., table=None):
+    """ table is an optional probit_moments.ProbitTable for log Phi and phi/Phi, which are computed exactly if None """
 
     #############################################################################
     # Direct implementation (old)
@@ -80,11 +88,9 @@ def compute_moments_strict(mf, vf, mg, vg, nu2 = 1.):
     z_f = (mf)/(v*np.sqrt(1 + vf/v**2))
 
             
-    logZ_f = logCdfNormal(z_f)
-    logZ_f1m = logCdfNormal(-z_f)
+    logZ_f, phi_div_Phi_f, logZ_f1m = _log_cdf_and_ratio(z_f, table)
     Z_fp = np.exp(logZ_f)
 
-    phi_div_Phi_f = derivLogCdfNormal(z_f)
     mean_f = mf + vf/(v*np.sqrt(1 + vf/v**2))*phi_div_Phi_f #mu + sigma2*nz/(Z*v*np.sqrt(1 + sigma2/v**2))
     mean2_f = 2*mf*mean_f - mf**2 + vf - vf**2*z_f/((v**2 + vf))*phi_div_Phi_f # sigma2**2*z*nz/(Z*(v**2 + sigma2))
 
@@ -97,11 +103,9 @@ def compute_moments_strict(mf, vf, mg, vg, nu2 = 1.):
 
     z_g = mg/(v*np.sqrt(1 + vg/v**2))
 
-    logZ_g = logCdfNormal(z_g)
-    logZ_g1m = logCdfNormal(-z_g)
+    logZ_g, phi_div_Phi_g, logZ_g1m = _log_cdf_and_ratio(z_g, table)
     Z_g = np.exp(logZ_g)
 
-    phi_div_Phi_g = derivLogCdfNormal(z_g)
     mean_g = mg + vg/(v*np.sqrt(1 + vg/v**2))*phi_div_Phi_g #mu + sigma2*nz/(Z*v*np.sqrt(1 + sigma2/v**2))
     mean2_g = 2*mg*mean_g - mg**2 + vg - vg**2*z_g/((v**2 + vg))*phi_div_Phi_g # sigma2**2*z*nz/(Z*(v**2 + sigma2))
 
@@ -112,7 +116,7 @@ def compute_moments_strict(mf, vf, mg, vg, nu2 = 1.):
     # compute log normalizer: logZ = log[(1-Z_fp)*(1-Z_g) + Z_fp*Z_g]
     log_a1 = logZ_f1m + logZ_g1m
     log_a2 = logZ_f + logZ_g
-    logZ = logsumexp((log_a1, log_a2))
+    logZ = np.logaddexp(log_a1, log_a2)
 
     Z = np.exp(logZ)
 
@@ -129,3 +133,19 @@ def compute_moments_strict(mf, vf, mg, vg, nu2 = 1.):
 
     return Z, site_fp_m, site_fp_m2, site_g_m, site_g_m2
 
+
+
+def log_factor_strict(fp, g, nu2=1.):
+    """ Log of the factor whose moments compute_moments_strict computes,
+
+            log h = log[Phi(nu2*fp)*Phi(g) + Phi(-nu2*fp)*Phi(-g)],
+
+        and its derivatives with respect to fp and g """
+    a = nu2*fp
+    log_h = np.logaddexp(logCdfNormal(a) + logCdfNormal(g), logCdfNormal(-a) + logCdfNormal(-g))
+
+    # d/da log h = phi(a)*(2*Phi(g) - 1)/h and similarly for g
+    d_fp = nu2*np.exp(-0.5*a**2 - 0.5*np.log(2*np.pi) - log_h)*erf(g/np.sqrt(2))
+    d_g = np.exp(-0.5*g**2 - 0.5*np.log(2*np.pi) - log_h)*erf(a/np.sqrt(2))
+
+    return log_h, d_fp, d_g
@@ -0,0 +1,59 @@
+""" Reading and writing of uncompressed .npz files whose members can be memory-mapped.
+
+    np.load cannot memory-map the members of an .npz archive. np.savez stores the members uncompressed, so each member is a
+    regular .npy file at some offset in the archive and can be mapped with np.memmap after parsing its zip and npy headers.
+"""
+
+import os
+import struct
+import zipfile
+import numpy as np
+
+
+def save_npz(path, **arrays):
+    """ Save arrays to an uncompressed .npz file (with the suffix .npz added as by np.savez). The file is written to a
+        temporary file in the same directory and renamed, so that an interrupted write never leaves a partial file. """
+    if not path.endswith('.npz'):
+        path = path + '.npz'
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_npz(path, mmap=False):
+    """ Return a dict with the arrays in the .npz file at path. If mmap is True, the (non-scalar) members are memory-mapped
+        read-only, except compressed or object members, which are read into memory. """
+    if not mmap:
+        with np.load(path, allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            # data offset = local file header (30 bytes) + file name + extra field
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+
+            if dtype.hasobject or len(shape) == 0 or np.prod(shape) == 0:
+                f.seek(info.header_offset + 30 + name_length + extra_length)
+                arrays[name] = np.lib.format.read_array(f, allow_pickle=False)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', shape=shape, offset=f.tell(), order='F' if fortran_order else 'C')
+
+    return arrays
@@ -0,0 +1,23 @@
+""" Random number generators of the components.
+
+    Every component that draws random numbers takes an rng argument, which is None (fresh entropy), an int seed, a
+    np.random.SeedSequence or a np.random.Generator, and draws only from its own generator and never from the global
+    numpy state, so that fits and BO runs in threads or processes are reproducible and independent. Workers and
+    sub-components get independent child streams from spawn. Requires numpy >= 1.17.
+"""
+
+import numpy as np
+
+
+def as_generator(rng=None):
+    """ np.random.Generator for rng (a Generator is returned as is) """
+    return np.random.default_rng(rng)
+
+
+def spawn(rng, n):
+    """ n independent child generators of rng, e.g. one per worker or job """
+    rng = as_generator(rng)
+    if hasattr(rng, 'spawn'):
+        return rng.spawn(n)
+    # numpy < 1.25
+    return [np.random.default_rng(seed_sequence) for seed_sequence in rng.bit_generator._seed_seq.spawn(n)]
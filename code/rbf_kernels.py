@@ -0,0 +1,102 @@
+""" Closed-form RBF (+ Bias) covariances between function values and partial derivatives, using numpy only.
+
+    With k(x, x') = variance*exp(-0.5*sum_d (x_d - x'_d)**2/lengthscale_d**2) + bias and u_d = (x_d - x'_d)/lengthscale_d**2:
+
+        cov(f(x), f(x'))                = k(x, x')
+        cov(f(x), df(x')/dx'_d)         = k_rbf(x, x')*u_d
+        cov(df(x)/dx_d, df(x')/dx'_e)   = k_rbf(x, x')*(delta_de/lengthscale_d**2 - u_d*u_e)
+"""
+
+import numpy as np
+
+from random_streams import as_generator
+
+
+def rbf_parameters(kernel):
+    """ Return (variance, lengthscale, bias) of a GPy RBF kernel or a sum of an RBF and Bias kernels.
+        The lengthscale is returned as an array with one entry per input dimension. """
+    parts = kernel.parts if type(kernel).__name__ == 'Add' else [kernel]
+
+    variance, lengthscale, bias = None, None, 0.
+    for part in parts:
+        name = type(part).__name__
+        if name == 'RBF' and variance is None:
+            variance = float(part.variance.values[0])
+            lengthscale = np.ones(part.input_dim)*np.array(part.lengthscale.values, dtype=float)
+        elif name == 'Bias':
+            bias += float(part.variance.values[0])
+        else:
+            raise ValueError('Only RBF and RBF + Bias kernels are supported, got %s' % name)
+
+    if variance is None:
+        raise ValueError('Kernel has no RBF part')
+
+    return variance, lengthscale, bias
+
+
+def scaled_differences(X, X2, lengthscale):
+    """ Return u[i, j, d] = (X[i, d] - X2[j, d])/lengthscale[d]**2 and the RBF exponent r2[i, j] = sum_d u[i, j, d]*(X[i, d] - X2[j, d]) """
+    diff = X[:, None, :] - X2[None, :, :]
+    u = diff/lengthscale**2
+    return u, np.sum(u*diff, axis=2)
+
+
+def cross_covariance(Xp, X, Xd, variance, lengthscale, bias=0., return_gradient=False, dims=None):
+    """ Covariance between f(Xp) and [f(X), df/dx_1(Xd), ..., df/dx_D(Xd)], i.e. the columns of the multi-output
+        covariance of f used by UnimodalGP. dims selects the derivative blocks (default: all dimensions).
+        If return_gradient is True, the gradient with respect to Xp is returned as well with shape
+        (len(Xp), len(X) + len(dims)*len(Xd), D). """
+    D = Xp.shape[1]
+    dims = range(D) if dims is None else dims
+
+    u_X, r2_X = scaled_differences(Xp, X, lengthscale)
+    K_X = variance*np.exp(-0.5*r2_X)
+
+    u_d, r2_d = scaled_differences(Xp, Xd, lengthscale)
+    K_d = variance*np.exp(-0.5*r2_d)
+
+    K = np.column_stack([K_X + bias] + [K_d*u_d[:, :, d] for d in dims])
+    if not return_gradient:
+        return K
+
+    dK_X = -K_X[:, :, None]*u_X
+    dK_d = [K_d[:, :, None]*((np.arange(D) == d)/lengthscale[d]**2 - u_d[:, :, d, None]*u_d) for d in dims]
+    return K, np.concatenate([dK_X] + dK_d, axis=1)
+
+
+def derivative_cross_covariances(Xp, Xd, variance, lengthscale, bias):
+    """ Covariances between g_d(Xp) and [g_d(Xd), dg_d/dx_d(Xd)] for all dimensions d, where g_d has the RBF (+ Bias)
+        kernel with variance[d], lengthscale[d] and bias[d] (shapes (D,), (D, D) and (D,)). Equals cross_covariance(Xp,
+        Xd, Xd, ..., dims=[d]) for each d, but the differences Xp - Xd are computed once and the exponents of all
+        dimensions in one product. Returns an array of shape (D, len(Xp), 2*len(Xd)). """
+    diff = Xp[:, None, :] - Xd[None, :, :]
+    inverse_l2 = 1./np.asarray(lengthscale)**2
+
+    # K_rbf[d, i, j] = variance[d]*exp(-0.5*sum_e diff[i, j, e]**2/lengthscale[d, e]**2)
+    K_rbf = np.asarray(variance)[:, None, None]*np.exp(-0.5*np.moveaxis(np.dot(diff**2, inverse_l2.T), 2, 0))
+    u = np.moveaxis(diff, 2, 0)*np.diagonal(inverse_l2)[:, None, None]
+    return np.concatenate((K_rbf + np.asarray(bias)[:, None, None], K_rbf*u), axis=2)
+
+
+class RandomFourierFeatures(object):
+    """ Random Fourier features phi(x) of an RBF (+ Bias) kernel, such that k(x, x') is approximated by phi(x).dot(phi(x')).
+        The last feature is constant and represents the bias. The frequencies and phases are drawn from rng. """
+
+    def __init__(self, variance, lengthscale, bias=0., num_features=500, rng=None):
+        D = len(lengthscale)
+        rng = as_generator(rng)
+        self.W = rng.standard_normal((num_features, D))/lengthscale
+        self.b = rng.uniform(0, 2*np.pi, size=num_features)
+        self.scale = np.sqrt(2.*variance/num_features)
+        self.bias = np.sqrt(bias)
+        self.num_features = num_features + 1
+
+    def __call__(self, X):
+        return np.column_stack((self.scale*np.cos(np.dot(X, self.W.T) + self.b), self.bias*np.ones(len(X))))
+
+    def gradient(self, X, d=None):
+        """ Derivative of the features with respect to X, shape (len(X), num_features, D) or (len(X), num_features) if d is given. """
+        S = -self.scale*np.sin(np.dot(X, self.W.T) + self.b)
+        if d is not None:
+            return np.column_stack((S*self.W[:, d], np.zeros(len(X))))
+        return np.concatenate((S[:, :, None]*self.W[None, :, :], np.zeros((len(X), 1, self.W.shape[1]))), axis=1)
@@ -0,0 +1,153 @@
+""" Parallel random restarts of the hyperparameter optimization of a GPy/paramz model (e.g. UnimodalGP).
+
+    The starts are the current parameters and draws from the priors of the parameters (parameters without a prior, or
+    with a prior that draw_from_prior cannot sample, are perturbed by a standard normal in the optimizer space, as in
+    paramz' randomize). Each restart runs the model's
+    optimizer in chunks of check_every iterations on a process pool. After each chunk, the best objective seen by any
+    restart is shared between the workers, and a restart is cancelled if it cannot reach the incumbent even if it kept
+    improving at the rate of its last chunk for its remaining iterations. Each chunk restarts the curvature estimate of
+    L-BFGS, so check_every trades convergence speed for earlier cancellation.
+"""
+
+import math
+import traceback
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+
+import GPy
+from paramz.transformations import __fixed__
+
+from random_streams import as_generator
+
+Restart = namedtuple('Restart', ['index', 'f', 'x', 'iterations', 'status'])
+
+
+def draw_from_prior(prior, size, rng):
+    """ Draw from a GPy prior with the generator rng. GPy's HalfT.rvs clips negative draws of the t distribution to zero,
+        here |t| is used. Returns None for priors other than those below (e.g. the multivariate priors), whose rvs
+        methods draw from the global random state. """
+    if isinstance(prior, GPy.priors.HalfT):
+        return np.abs(prior.A*rng.standard_t(prior.nu, size))
+    if isinstance(prior, GPy.priors.StudentT):
+        return prior.mu + prior.sigma*rng.standard_t(prior.nu, size)
+    if isinstance(prior, GPy.priors.LogGaussian):
+        return np.exp(rng.normal(prior.mu, prior.sigma, size))
+    if isinstance(prior, GPy.priors.Gaussian):
+        return rng.normal(prior.mu, prior.sigma, size)
+    if isinstance(prior, GPy.priors.InverseGamma):
+        return 1./rng.gamma(prior.a, 1./prior.b, size)
+    if isinstance(prior, GPy.priors.Gamma):
+        return rng.gamma(prior.a, 1./prior.b, size)
+    if isinstance(prior, GPy.priors.Uniform):
+        return rng.uniform(prior.lower, prior.upper, size)
+    if isinstance(prior, GPy.priors.Exponential):
+        return rng.exponential(prior.l, size)
+    return None
+
+
+def draw_starts(model, num_starts, seed=0):
+    """ Return num_starts points in the optimizer space of model: its current parameters followed by draws from the
+        priors with the generator for seed (see random_streams). The model is not changed. """
+    rng = as_generator(seed)
+    proposal = model.copy()
+    proposal.update_model(False)
+
+    free = np.ones(model.size, dtype=bool)
+    free[model.constraints[__fixed__]] = False
+
+    x0 = model.optimizer_array.copy()
+    starts = [x0]
+    for i in range(num_starts - 1):
+        proposal.optimizer_array = x0 + rng.standard_normal(x0.size)
+        values = proposal.param_array.copy()
+        for prior, index in model.priors.items():
+            draw = draw_from_prior(prior, len(index), rng)
+            if draw is not None:
+                values[index] = draw
+        proposal.param_array[free] = values[free]
+        starts.append(proposal.optimizer_array.copy())
+
+    return starts
+
+
+# model and shared incumbent of a worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(model, incumbent):
+    _worker['model'], _worker['incumbent'] = model, incumbent
+
+
+def _run_restart(args):
+    """ Optimize the worker model from one start and return a Restart """
+    index, x, max_iters, check_every, tol, optimize_kwargs = args
+    model, incumbent = _worker['model'], _worker['incumbent']
+
+    try:
+        model.optimizer_array = x
+        f = model.objective_function()
+        iterations, status = 0, 'max_iters'
+
+        while iterations < max_iters:
+            chunk = min(check_every, max_iters - iterations)
+            opt = model.optimize(max_iters=chunk, **optimize_kwargs)
+            iterations += chunk
+
+            f_new = model.objective_function()
+            with incumbent.get_lock():
+                incumbent.value = min(incumbent.value, f_new)
+                best = incumbent.value
+
+            improvement, f = f - f_new, f_new
+            if opt.status == 'Converged' or improvement <= tol*max(1., abs(f)):
+                status = 'converged'
+                break
+
+            chunks_left = math.ceil((max_iters - iterations)/check_every)
+            if f - chunks_left*improvement > best:
+                status = 'cancelled'
+                break
+
+        # e.g. EP failing at extreme parameters, reported as a failure so that it is never selected as the best restart
+        if not np.isfinite(f):
+            return Restart(index, np.inf, x, iterations, 'failed: the objective is not finite')
+
+        return Restart(index, f, model.optimizer_array.copy(), iterations, status)
+
+    except Exception:
+        return Restart(index, np.inf, x, 0, 'failed:\n' + traceback.format_exc())
+
+
+def optimize_restarts(model, num_restarts=10, num_processes=None, max_iters=1000, check_every=50, tol=1e-6, seed=0, verbose=False, **optimize_kwargs):
+    """ Optimize model from num_restarts starts (see draw_starts) on num_processes worker processes (None for one per
+        start up to the number of CPUs, 1 to run in this process), set the parameters with the best objective on model
+        and return the list of Restart(index, f, x, iterations, status) ordered by start. status is 'converged',
+        'cancelled', 'max_iters' or 'failed' with a traceback or reason, e.g. an objective that is not finite. Failed
+        restarts have f = inf and are never selected. optimize_kwargs are passed to model.optimize. """
+
+    starts = draw_starts(model, num_restarts, seed)
+    tasks = [(i, x, max_iters, check_every, tol, optimize_kwargs) for i, x in enumerate(starts)]
+
+    if num_processes is None:
+        num_processes = min(num_restarts, multiprocessing.cpu_count())
+
+    incumbent = multiprocessing.Value('d', np.inf)
+    if num_processes == 1:
+        _init_worker(model.copy(), incumbent)
+        results = [_run_restart(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(num_processes, initializer=_init_worker, initargs=(model.copy(), incumbent)) as pool:
+            results = list(pool.imap_unordered(_run_restart, tasks))
+    results = sorted(results, key=lambda result: result.index)
+
+    if verbose:
+        for result in results:
+            print('Optimization restart %d/%d, f = %g, %d iterations, %s' % (result.index + 1, num_restarts, result.f, result.iterations, result.status.split(':')[0]))
+
+    best = min(results, key=lambda result: result.f)
+    if np.isfinite(best.f):
+        model.optimizer_array = best.x
+
+    return results
@@ -0,0 +1,211 @@
+""" Columnar store for benchmark results.
+
+    Runs are appended to a ResultsWriter and flushed as shards. A shard is a directory with one .npy file per column, such
+    that each column can be memory-mapped. Scalar fields (keys, tags, wall times) become one array with an entry per run.
+    Array fields (e.g. the f_min history or the evaluated X) are concatenated into a flat values array together with an
+    offsets array, an ndim array and a shapes array (padded to the largest ndim) for recovering the array of each run;
+    runs without the field have ndim -1 and are read as None. A shard becomes visible to readers when its
+    entry is appended to the manifest (manifest.jsonl in the root folder), so partially written shards are never read.
+"""
+
+import os
+import json
+import time
+import numpy as np
+
+MANIFEST = 'manifest.jsonl'
+VERSION = 2
+
+
+def _save_column(folder, name, array):
+    np.save(os.path.join(folder, name + '.npy'), np.ascontiguousarray(array))
+
+
+class ResultsWriter(object):
+    """ Writer of shards to root. The buffered runs are flushed as a shard when flush_every runs are buffered, or when
+        the oldest buffered run is older than flush_seconds (if given), which bounds the results lost if a writer is
+        killed without limiting the shard size. """
+
+    def __init__(self, root, worker=None, flush_every=1, flush_seconds=None):
+        self.root = root
+        self.worker = 'w%d' % os.getpid() if worker is None else worker
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.num_shards = 0
+        self.buffer = []
+        self._buffer_start = None
+
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def append(self, key, scalars=None, arrays=None):
+        """ Add a run identified by key. scalars is a dict of numbers or strings and arrays a dict of array-likes. """
+        if len(self.buffer) == 0:
+            self._buffer_start = time.time()
+        self.buffer.append((key, scalars or {}, {name: np.asarray(value) for name, value in (arrays or {}).items()}))
+        if len(self.buffer) >= self.flush_every or (self.flush_seconds is not None and time.time() - self._buffer_start >= self.flush_seconds):
+            self.flush()
+
+    def flush(self, publish=True):
+        if len(self.buffer) == 0:
+            return None
+
+        # unique name, also if another writer with the same worker name has written to root before
+        while True:
+            name = '%s-%05d' % (self.worker, self.num_shards)
+            self.num_shards += 1
+            if not os.path.exists(os.path.join(self.root, name)):
+                break
+        folder = os.path.join(self.root, name)
+        os.makedirs(folder)
+
+        keys = [key for key, _, _ in self.buffer]
+        _save_column(folder, 'key', np.array(keys))
+
+        columns = {'scalars': [], 'arrays': []}
+        for column in sorted(set().union(*[scalars.keys() for _, scalars, _ in self.buffer])):
+            values = [scalars.get(column) for _, scalars, _ in self.buffer]
+            if any(isinstance(value, str) for value in values):
+                array = np.array(['' if value is None else value for value in values])
+            else:
+                array = np.array([np.nan if value is None else value for value in values], dtype=float)
+            _save_column(folder, column, array)
+            columns['scalars'].append(column)
+
+        for column in sorted(set().union(*[arrays.keys() for _, _, arrays in self.buffer])):
+            values = [arrays.get(column) for _, _, arrays in self.buffer]
+            ndims = np.array([-1 if value is None else value.ndim for value in values], dtype=np.int64)
+            shapes = np.zeros((len(values), max(ndims.max(), 0)), dtype=np.int64)
+            for i, value in enumerate(values):
+                if value is not None:
+                    shapes[i, :value.ndim] = value.shape
+            offsets = np.cumsum([0] + [0 if value is None else value.size for value in values])
+            _save_column(folder, column, np.concatenate([value.ravel() for value in values if value is not None]))
+            _save_column(folder, column + '.offsets', offsets)
+            _save_column(folder, column + '.ndim', ndims)
+            _save_column(folder, column + '.shapes', shapes)
+            columns['arrays'].append(column)
+
+        # publish the shard with a single append to the manifest
+        entry = {'shard': name, 'num_runs': len(keys), 'version': VERSION}
+        entry.update(columns)
+        if publish:
+            with open(os.path.join(self.root, MANIFEST), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+        self.buffer = []
+        return entry
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ResultsStore(object):
+    """ Read access to the runs written by one or more ResultsWriters to root. If mmap is True, the columns are memory-mapped. """
+
+    def __init__(self, root, mmap=True):
+        self.root = root
+        self.mmap_mode = 'r' if mmap else None
+        self.shards = []
+
+        manifest = os.path.join(root, MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                self.shards = [json.loads(line) for line in f if line.strip()]
+
+        self._cache = {}
+
+    def _load(self, shard, column):
+        if (shard, column) not in self._cache:
+            self._cache[(shard, column)] = np.load(os.path.join(self.root, shard, column + '.npy'), mmap_mode=self.mmap_mode)
+        return self._cache[(shard, column)]
+
+    def __len__(self):
+        return sum(shard['num_runs'] for shard in self.shards)
+
+    def keys(self):
+        return [str(key) for shard in self.shards for key in self._load(shard['shard'], 'key')]
+
+    def column(self, name, **filters):
+        """ Return a scalar column as an array with one entry per run matching filters. """
+        values = []
+        for shard, index in self._select(filters):
+            if name in shard['scalars']:
+                values.append(self._load(shard['shard'], name)[index])
+            else:
+                values.append(np.full(len(index), np.nan))
+        return np.concatenate(values) if len(values) > 0 else np.zeros(0)
+
+    def arrays(self, name, **filters):
+        """ Return a list with the array stored in column name for each run matching filters, None for runs without it. """
+        result = []
+        for shard, index in self._select(filters):
+            result.extend(self._shard_arrays(shard, name, index))
+        return result
+
+    def regret_curves(self, **filters):
+        """ Simple regret f(x_min) - f_opt per iteration for each run matching filters, NaN padded to the longest run. """
+        curves = [np.asarray(f_min_ref) - f_opt for f_min_ref, f_opt in zip(self.arrays('f_min_ref', **filters), self.column('f_opt', **filters))]
+        regret = np.full((len(curves), max([len(curve) for curve in curves] + [0])), np.nan)
+        for i, curve in enumerate(curves):
+            regret[i, :len(curve)] = curve
+        return regret
+
+    def _select(self, filters):
+        """ Yield (shard, indices of the runs in the shard matching the scalar filters). """
+        for shard in self.shards:
+            mask = np.ones(shard['num_runs'], dtype=bool)
+            for name, value in filters.items():
+                if name not in shard['scalars']:
+                    mask[:] = False
+                    break
+                mask &= (self._load(shard['shard'], name) == value)
+            yield shard, np.flatnonzero(mask)
+
+    def compact(self, worker='compact'):
+        """ Merge all shards into a single shard and return a new ResultsStore for root. Must not run while writers are active. """
+        if len(self.shards) <= 1:
+            return self
+
+        writer = ResultsWriter(self.root, worker=worker, flush_every=np.inf)
+        for shard in self.shards:
+            keys = self._load(shard['shard'], 'key')
+            scalars = {name: self._load(shard['shard'], name) for name in shard['scalars']}
+            arrays = {name: self._shard_arrays(shard, name, range(shard['num_runs'])) for name in shard['arrays']}
+            for i in range(shard['num_runs']):
+                # runs without an array stay without it, as in the shards of the other columns
+                writer.append(str(keys[i]), {name: value[i].item() for name, value in scalars.items()},
+                              {name: np.array(value[i]) for name, value in arrays.items() if value[i] is not None})
+        entry = writer.flush(publish=False)
+
+        # the merged shard replaces all previous entries of the manifest
+        tmp_path = os.path.join(self.root, MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, os.path.join(self.root, MANIFEST))
+
+        for shard in self.shards:
+            folder = os.path.join(self.root, shard['shard'])
+            for filename in os.listdir(folder):
+                os.remove(os.path.join(folder, filename))
+            os.rmdir(folder)
+
+        return ResultsStore(self.root, mmap=self.mmap_mode is not None)
+
+    def _shard_arrays(self, shard, name, index):
+        """ Arrays of column name for the runs index of shard, None for runs without it. """
+        if name not in shard['arrays']:
+            return [None]*len(index)
+        values = self._load(shard['shard'], name)
+        offsets = self._load(shard['shard'], name + '.offsets')
+        shapes = self._load(shard['shard'], name + '.shapes')
+        # version 1 shards have no ndim column, their shapes are exact
+        ndims = self._load(shard['shard'], name + '.ndim') if shard.get('version', 1) >= 2 else np.full(len(shapes), shapes.shape[1])
+        return [None if ndims[i] < 0 else values[offsets[i]:offsets[i + 1]].reshape(tuple(int(s) for s in shapes[i, :ndims[i]]))
+                for i in index]
@@ -3,9 +3,10 @@ import os.path
 import numpy as np
 import numpy.random as rndm
 import scipy.linalg
-from scipy.stats import multivariate_normal
 import itertools
 
+from random_streams import as_generator, spawn
+
 
 def lzip(*args):
     """
@@ -20,9 +21,11 @@ class Noisifier(object):
     sd defines the magnitude of the noise, i.e., the standard deviation of the Gaussian.
     Example: ackley_noise_addp01 = Noisifier(Ackley(3), 'add', .01)
     Obviously, with the presence of noise, the max and min may no longer be accurate.
+    The noise is drawn from rng (see random_streams).
     """
-    def __init__(self, func, noise_type, level):
+    def __init__(self, func, noise_type, level, rng=None):
         assert isinstance(func, Normalizer)
+        self.vectorized = func.vectorized
         if level < 0:
             raise ValueError('Noise level must be positive, level={0}'.format(level))
         self.bounds, self.min_loc, self.fmax, self.fmin = func.bounds, func.min_loc, func.fmax, func.fmin
@@ -30,12 +33,15 @@ class Noisifier(object):
         self.level = level
         self.func = func
         self.dim = self.func.dim
+        self.rng = as_generator(rng)
 
     def do_evaluate(self, x):
+        f = self.func.do_evaluate(x)
+        noise = self.level * self.rng.standard_normal(np.shape(f))
         if self.type == 'add':
-            return self.func.do_evaluate(x) + self.level * np.random.normal()
+            return f + noise
         else:
-            return self.func.do_evaluate(x) * (1 + self.level * np.random.normal())
+            return f * (1 + noise)
 
     def evaluate_clean(self, x):
         return self.func.do_evaluate(x)
@@ -43,6 +49,7 @@ class Noisifier(object):
 class Normalizer(object):
     def __init__(self, func):
         self.func = func
+        self.vectorized = getattr(func, 'vectorized', False)
         self.dim = self.func.dim
         self.us_fmin = self.func.fmin
         self.deviation = self.func.fmax-self.func.do_evaluate(np.array(func.min_loc))
@@ -67,26 +74,40 @@ class Normalizer(object):
         return (self.func.do_evaluate( (x*self.lengths + self.us_bounds[:,0]) ) - self.us_fmin)/self.deviation
         
 class Gaussian(object):
+    vectorized = True
+
     def __init__(self, dim=1, num_peaks=1, seed=None, safe_limit=0.):
-        if seed is not None:
-            np.random.seed(seed)
+        # an int seed draws the same functions as seeding the global state did, a Generator is used as is
+        rng = seed if isinstance(seed, np.random.Generator) else rndm.RandomState(seed)
         self.num_peaks = num_peaks
         self.num_evals = 0
         self.dim = dim
-        self.weights = np.random.rand(num_peaks)+np.finfo(float).eps
-        self.centers = np.random.rand(num_peaks, dim)*(1.-2.*safe_limit)+safe_limit
-        og = [scipy.linalg.orth(np.random.randn(dim,dim)) for i in range(num_peaks)]
-        self.variances = [np.dot(np.dot(og[i], np.diag(np.random.rand(dim)*0.9+0.1)), og[i].T) / 7. for i in range(num_peaks)]
-        mins = [self.do_evaluate(self.centers[i,:]) for i in range(num_peaks)]
-        ind = np.argmin( [self.do_evaluate(self.centers[i,:]) for i in range(num_peaks)] )
+        self.weights = rng.random(num_peaks)+np.finfo(float).eps
+        self.centers = rng.random((num_peaks, dim))*(1.-2.*safe_limit)+safe_limit
+        og = [scipy.linalg.orth(rng.standard_normal((dim,dim))) for i in range(num_peaks)]
+        self.variances = [np.dot(np.dot(og[i], np.diag(rng.random(dim)*0.9+0.1)), og[i].T) / 7. for i in range(num_peaks)]
+        # whitening transforms and log-determinants of the peak covariances, computed once
+        chols = [np.linalg.cholesky(self.variances[i]) for i in range(num_peaks)]
+        self.chol_invs = np.array([scipy.linalg.solve_triangular(L, np.identity(dim), lower=True) for L in chols])
+        self.log_dets = np.array([2*np.sum(np.log(np.diag(L))) for L in chols])
+        mins = self.do_evaluate(self.centers)
+        ind = np.argmin(mins)
         self.fmin = mins[ind]
         self.min_loc = self.centers[ind,:]
         self.fmax = 0.0
         self.bounds = lzip([0] * self.dim, [1] * self.dim)
         
     def do_evaluate(self, x):
-        x = np.array(x)
-        return np.sum( [-self.weights[i]*scipy.stats.multivariate_normal.pdf(x, self.centers[i,:], self.variances[i]) for i in range(self.num_peaks)] )
+        """ Evaluate a single point x of shape (dim,) or a batch of points of shape (n, dim). """
+        x = np.array(x, dtype=float)
+        X = np.reshape(x, (-1, self.dim))
+
+        # whitened differences between all points and all peaks, shape (n, num_peaks, dim)
+        Z = np.einsum('pij,npj->npi', self.chol_invs, X[:, None, :] - self.centers[None, :, :])
+        log_pdfs = -0.5*np.sum(Z**2, axis=2) - 0.5*self.log_dets - 0.5*self.dim*np.log(2*np.pi)
+        f = -np.dot(np.exp(log_pdfs), self.weights)
+
+        return f[0] if x.ndim < 2 else f
         
 def function_of_dimension(funcs, dim):
     ret = []
@@ -105,11 +126,11 @@ def get_gaussian_functions(num, max_dim, num_peaks):
 def get_gaussian_functions_of_dim(num, dim=1, num_peaks=1,):
     return [Gaussian(dim = dim, num_peaks=num_peaks, seed=i) for i in range(num)]
 
-def noisify_functions(func_list, noise_level):
+def noisify_functions(func_list, noise_level, rng=None):
     if isinstance(func_list, list):
-        return [noisify_functions(func, noise_level) for func in func_list]
+        return [noisify_functions(func, noise_level, child) for func, child in zip(func_list, spawn(rng, len(func_list)))]
     else:
-        return Noisifier(func_list, 'add', noise_level)
+        return Noisifier(func_list, 'add', noise_level, rng)
     
 def normalize_functions(func_list):
     if isinstance(func_list, list):
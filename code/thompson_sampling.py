@@ -0,0 +1,122 @@
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+
+from rbf_kernels import rbf_parameters, cross_covariance, RandomFourierFeatures
+from random_streams import as_generator
+
+
+class SamplePath(object):
+    """ Approximate posterior sample path
+
+            f(x) = phi(x).dot(w) + k(x, Xf).dot(alpha)
+
+        where phi are random Fourier features of the prior kernel. For a regular GP the path is the weight space
+        posterior sample (alpha = 0); for UnimodalGP, alpha is the pathwise update conditioning the prior sample on a
+        sample of the EP posterior of f and its derivatives at Xf. Evaluations and gradients are closed-form. """
+
+    def __init__(self, features, w, X=None, Xd=None, alpha=None, kernel_parameters=None):
+        self.features = features
+        self.w = w
+        self.X, self.Xd, self.alpha = X, Xd, alpha
+        self.kernel_parameters = kernel_parameters
+
+    def __call__(self, X):
+        """ Return the path and its gradient at X with shapes (len(X),) and (len(X), D). """
+        f = np.dot(self.features(X), self.w)
+        df = np.einsum('nfd,f->nd', self.features.gradient(X), self.w)
+
+        if self.alpha is not None:
+            K, dK = cross_covariance(X, self.X, self.Xd, *self.kernel_parameters, return_gradient=True)
+            f += np.dot(K, self.alpha)
+            df += np.einsum('nmd,m->nd', dK, self.alpha)
+
+        return f, df
+
+
+def sample_path(model, num_features=500, jitter=1e-8, rng=None):
+    """ Draw an approximate posterior sample path from a GPy GP with Gaussian likelihood or a UnimodalGP,
+        both with an RBF or RBF + Bias kernel for f, using the generator rng (see random_streams) """
+    rng = as_generator(rng)
+
+    if hasattr(model, 'Kf_kernel'):
+        return _sample_path_unimodal(model, num_features, jitter, rng)
+
+    # weight space posterior of the features of a regular GP, sampled in the dual (N x N) form
+    variance, lengthscale, bias = rbf_parameters(model.kern)
+    features = RandomFourierFeatures(variance, lengthscale, bias, num_features, rng)
+    X, y = np.asarray(model.X), np.asarray(model.Y)[:, 0]
+    noise = float(model.likelihood.variance.values[0])
+
+    Phi = features(X)
+    w0 = rng.standard_normal(features.num_features)
+    eps = np.sqrt(noise)*rng.standard_normal(len(X))
+    A = cho_factor(np.dot(Phi, Phi.T) + (noise + jitter)*np.identity(len(X)), lower=True)
+    w = w0 + np.dot(Phi.T, cho_solve(A, y - np.dot(Phi, w0) - eps))
+
+    return SamplePath(features, w)
+
+
+def _sample_path_unimodal(model, num_features, jitter, rng):
+    """ Pathwise update of a prior sample: f = f_prior + k(., Xf) Kff^-1 (f_Xf - f_prior(Xf)),
+        where f_Xf ~ N(mu, Sigma) is the EP posterior for f and f' at Xf """
+
+    kernel_parameters = rbf_parameters(model.f_kernel_base)
+    features = RandomFourierFeatures(*kernel_parameters, num_features=num_features, rng=rng)
+    w = rng.standard_normal(features.num_features)
+
+    # prior sample at the function values and at the derivatives in each dimension
+    f_prior = np.hstack([np.dot(features(model.X), w)] + [np.dot(features.gradient(model.Xd, d), w) for d in range(model.D)])
+
+    # posterior sample at Xf
+    mu, Sigma = model.f_posterior.mu, model.f_posterior.Sigma
+    L = np.linalg.cholesky(Sigma + 1e-6*np.identity(len(mu)))
+    f_post = mu + np.dot(L, rng.standard_normal(len(mu)))
+
+    Kff = model.Kf_kernel.K(model.Xf)
+    alpha = cho_solve(cho_factor(Kff + jitter*np.mean(np.diag(Kff))*np.identity(len(Kff)), lower=True), f_post - f_prior)
+
+    return SamplePath(features, w, np.asarray(model.X), np.asarray(model.Xd), alpha, kernel_parameters)
+
+
+class ThompsonSampling(object):
+    """ Thompson sampling acquisition with the same interface as EI, LCB and PI in bayesian_optimization.
+        A single sample path is drawn per BO iteration (i.e. per model and data set size n) and minimized directly.
+        The paths are drawn from rng; concurrent BO runs should use their own instance (see copy). """
+
+    def __init__(self, num_features=500, rng=None):
+        self.num_features = num_features
+        self.rng = as_generator(rng)
+        self.model, self.n, self.path = None, None, None
+
+    def copy(self, rng=None):
+        """ New instance with the same settings, no cached path and its own generator """
+        return ThompsonSampling(self.num_features, rng)
+
+    def __call__(self, x, fmin=None, model=None, n=None, d=None):
+        if model is not self.model or n != self.n:
+            self.model, self.n = model, n
+            self.path = sample_path(model, self.num_features, rng=self.rng)
+        return self.path(x)
+
+    def propose_batch(self, model, bounds, batch_size, num_restarts=5, num_candidates=1000):
+        """ Propose batch_size points by minimizing independent sample paths. Each path is minimized with L-BFGS-B
+            started from the best of num_candidates random points and num_restarts - 1 further random starts. """
+        bounds = np.asarray(bounds, dtype=float)
+        D = len(bounds)
+
+        X_batch = np.zeros((batch_size, D))
+        for b in range(batch_size):
+            path = sample_path(model, self.num_features, rng=self.rng)
+
+            candidates = bounds[:, 0] + (bounds[:, 1] - bounds[:, 0])*self.rng.random((num_candidates, D))
+            f_candidates, _ = path(candidates)
+            starts = [candidates[np.argmin(f_candidates)]] + [candidates[i] for i in self.rng.choice(num_candidates, num_restarts - 1, replace=False)]
+
+            best = np.inf
+            for x0 in starts:
+                opt = minimize(lambda x: tuple(v[0] for v in path(x[None, :])), x0, method='L-BFGS-B', bounds=bounds, jac=True)
+                if opt.fun < best:
+                    best, X_batch[b] = opt.fun, opt.x
+
+        return X_batch
@@ -1,19 +1,48 @@
 import numpy as np
+import json
+import warnings
 
 import GPy
 import paramz
 
 from copy import deepcopy
 
-from importlib import reload
-
 import ep_unimodality as ep
-reload(ep)
+
+from rbf_kernels import rbf_parameters, derivative_cross_covariances
+from frozen_predictor import FrozenUnimodalGP, site_woodbury, predict_stacked
+from npz_io import save_npz, load_npz
+from derivative_kernel import RBFDerivative, supports
+from grid_structure import detect_grid, KroneckerPrior, MIN_STRUCTURED_SIZE
+from variational_unimodality import vi_unimodality
+from ep_stats import EPStats
+from kernel_cache import KernelCache
+from iterative_backend import IterativeBackend
+from random_streams import as_generator
+import restarts
+import mode_locator
+
+from GPy.inference.latent_function_inference.expectation_propagation import posteriorParams, gaussianApproximation
+
+# version of the layout written by UnimodalGP.save
+FORMAT_VERSION = 1
+
+# inference engines, functions with the signature and return values of ep.ep_unimodality(..., return_sites=True)
+INFERENCE = {'ep': ep.ep_unimodality, 'variational': vi_unimodality}
+
+
+def inference_engine(inference):
+    """ Return the engine for a name in INFERENCE or a function with the signature of ep.ep_unimodality """
+    if callable(inference):
+        return inference
+    if inference not in INFERENCE:
+        raise ValueError('Unknown inference %s' % inference)
+    return INFERENCE[inference]
 
 class UnimodalGP(GPy.core.Model):
 
 
-    def __init__(self, X, Y, Xd, f_kernel_base, g_kernel_base, sigma2, name='UnimodalGP'):
+    def __init__(self, X, Y, Xd, f_kernel_base, g_kernel_base, sigma2, name='UnimodalGP', fused_kernel=True, g_structure='auto', backend=None, dtype=np.float64, inference='ep'):
 
         super(UnimodalGP, self).__init__(name=name)
 
@@ -28,6 +57,32 @@ class UnimodalGP(GPy.core.Model):
         # Fixed hyperparameters
         self.sigma2 = sigma2
 
+        # linear algebra backend for EP, None for dense Cholesky factorizations
+        self.backend = backend
+
+        # construction options, stored by save
+        self.fused_kernel, self.g_structure = fused_kernel, g_structure
+
+        # inference engine, e.g. 'variational' for hyperparameter search and 'ep' for the final fit (see set_inference).
+        # 'variational' optimizes the ELBO of vi_unimodality, a lower bound and a different objective than the EP
+        # approximation of the marginal likelihood, and lower than it, so the log likelihoods of the two engines are not
+        # comparable and their optimal hyperparameters differ
+        self.inference = inference_engine(inference)
+
+        # dtype of the kernel matrices in EP and of the cross-covariances in prediction (np.float32 trades accuracy
+        # for memory). Cholesky factors, log determinants and site parameters are always float64. The kernels still
+        # compute their matrices in float64 and they are cast afterwards, so np.float32 halves the matrices held during
+        # EP and prediction but not the peak memory while a kernel matrix is evaluated.
+        self.dtype = np.dtype(dtype)
+        self._woodbury_cache = {}
+
+        # kernel matrices shared by EP, the gradient updates and prediction (see kernel_cache)
+        self.kernel_cache = KernelCache()
+
+        # telemetry of the last inference run (an ep_stats.EPStats), stats_callback(stats) is called after each iteration
+        self.stats = None
+        self.stats_callback = None
+
         ###################################################################################
         # Contruct kernel for f
         ###################################################################################
@@ -40,7 +95,13 @@ class UnimodalGP(GPy.core.Model):
 
         # TODO: Remove y_dummy_list
         self.Xf, _, self.Xf_output_index = GPy.util.multioutput.build_XY(t_list, y_dummy_list)
-        self.Kf_kernel = GPy.kern.MultioutputKern(kernels=f_kernel_list, cross_covariances={}, name='Kf')
+
+        # for RBF (+ Bias) kernels, all blocks are computed by a single fused kernel
+        if fused_kernel and supports(self.f_kernel_base):
+            self.Kf_kernel = RBFDerivative(self.f_kernel_base, name='Kf')
+            self.Kf_kernel.kernel_cache = self.kernel_cache
+        else:
+            self.Kf_kernel = GPy.kern.MultioutputKern(kernels=f_kernel_list, cross_covariances={}, name='Kf')
 
         self.link_parameter(self.Kf_kernel)
 
@@ -52,18 +113,65 @@ class UnimodalGP(GPy.core.Model):
         self.Kg_kernel_list = []
         for d in range(self.D):
             g_kernel = self.g_kernel_base.copy()
-            g_kernel_der = GPy.kern.DiffKern(g_kernel, d)
-            Kg_kernel = GPy.kern.MultioutputKern(kernels=[g_kernel, g_kernel_der], cross_covariances={}, name='Kg%d'%d)
+            if fused_kernel and supports(g_kernel):
+                Kg_kernel = RBFDerivative(g_kernel, dims=[d], name='Kg%d'%d)
+                Kg_kernel.kernel_cache = self.kernel_cache
+            else:
+                g_kernel_der = GPy.kern.DiffKern(g_kernel, d)
+                Kg_kernel = GPy.kern.MultioutputKern(kernels=[g_kernel, g_kernel_der], cross_covariances={}, name='Kg%d'%d)
             self.Kg_kernel_list.append(Kg_kernel)
             self.link_parameter(self.Kg_kernel_list[d])
 
         self.Xg, _, self.Xg_output_index = GPy.util.multioutput.build_XY([Xd, Xd], [None, None])
 
-    def parameters_changed(self):
+        ###################################################################################
+        # Kronecker structure for g if Xd is a tensor grid
+        ###################################################################################
+        # 'auto': use the structure for grids with at least MIN_STRUCTURED_SIZE rows in Xg, 'kronecker': always, 'dense': never
+        self.grid = None
+        if g_structure not in ['auto', 'kronecker', 'dense']:
+            raise ValueError('Unknown g_structure %s' % g_structure)
+        if g_structure != 'dense':
+            grid = detect_grid(Xd)
+            structured = grid is not None and supports(self.g_kernel_base) and rbf_parameters(self.g_kernel_base)[2] == 0
+            if g_structure == 'kronecker' and not structured:
+                raise ValueError('Kronecker structure for g requires Xd to be a tensor grid in at least 2 dimensions and an RBF kernel for g')
+            if structured and (g_structure == 'kronecker' or 2*self.M >= MIN_STRUCTURED_SIZE):
+                self.grid = grid
+
+        # EP state set by load, used instead of running EP when the model is initialized
+        self._restored_state = None
 
-        # Run EP
-        self.f_posterior, self.g_posterior_list, Kf, self._log_lik, self.grad_dict = ep.ep_unimodality(self.Xf, self.Xg, self.X, self.Y, Kf_kernel=self.Kf_kernel.copy(), Kg_kernel_list=self.Kg_kernel_list, sigma2=self.sigma2, t2=self.Xd, verbose=0, nu2=1., tol=1e-10, max_itt=100)
+    def parameters_changed(self):
 
+        if self._restored_state is not None:
+            self._restore_ep_state(self._restored_state)
+            self._restored_state = None
+            return
+
+        # structured priors for g
+        g_priors = None
+        if self.grid is not None:
+            g_priors = []
+            for d in range(self.D):
+                variance, lengthscale, _ = rbf_parameters(self.Kg_kernel_list[d].parts[0])
+                g_priors.append(KroneckerPrior(self.grid, variance, lengthscale, d))
+
+        # Run EP (or another inference engine)
+        self.stats = EPStats(callback=self.stats_callback)
+        self._set_inference_result(self.inference(self.Xf, self.Xg, self.X, self.Y, Kf_kernel=self.Kf_kernel, Kg_kernel_list=self.Kg_kernel_list, sigma2=self.sigma2, t2=self.Xd, verbose=0, nu2=1., tol=1e-10, max_itt=100, return_sites=True, g_priors=g_priors, backend=self.backend, kernel_dtype=self.dtype, stats=self.stats))
+
+    def set_inference(self, inference):
+        """ Switch to another inference engine (see inference_engine) and rerun inference """
+        self.inference = inference_engine(inference)
+        self.parameters_changed()
+
+    def _set_inference_result(self, result):
+        """ Store the return_sites=True output of ep_unimodality (or another engine) and update the kernel gradients """
+        self.f_posterior, self.g_posterior_list, Kf, self._log_lik, self.grad_dict, self.f_ga_approx, self.g_ga_approx_list = result
+        self._update_gradients()
+
+    def _update_gradients(self):
         # update gradients for f
         self.Kf_kernel.update_gradients_full(self.grad_dict['dL_dK_f'], self.Xf)
 
@@ -71,9 +179,47 @@ class UnimodalGP(GPy.core.Model):
         for d in range(self.D):
             self.Kg_kernel_list[d].update_gradients_full(self.grad_dict['dL_dK_g%d' % d], self.Xg)
 
+    @staticmethod
+    def update_batch(models, seed=0):
+        """ Run EP for many models at once with ep.ep_unimodality_batch and update their posteriors, log likelihoods and
+            gradients as parameters_changed does. The models must have the same input dimension and number of virtual
+            points; dense covariances are used regardless of g_structure, backend and dtype, and no stats are recorded. """
+        if len(set((model.D, model.M) for model in models)) > 1:
+            raise ValueError('Batched EP requires the same input dimension and number of virtual points for all models')
+
+        results = ep.ep_unimodality_batch([model.Kf_kernel.K(model.Xf) for model in models],
+                                          [[kernel.K(model.Xg) for kernel in model.Kg_kernel_list] for model in models],
+                                          [model.Y for model in models], [model.sigma2 for model in models],
+                                          nu2=1., tol=1e-10, max_itt=100, seed=seed)
+        for model, result in zip(models, results):
+            model.stats = None
+            model._set_inference_result(result)
+
+    def optimize_restarts(self, num_restarts=10, num_processes=None, max_iters=1000, check_every=50, seed=0, verbose=False, **kwargs):
+        """ Optimize the hyperparameters from the current parameters and num_restarts - 1 draws from their priors on a
+            process pool, cancelling hopeless restarts early, and keep the best parameters (see restarts.optimize_restarts) """
+        return restarts.optimize_restarts(self, num_restarts=num_restarts, num_processes=num_processes, max_iters=max_iters,
+                                          check_every=check_every, seed=seed, verbose=verbose, **kwargs)
+
     def log_likelihood(self):
         return self._log_lik
 
+    def _woodbury(self, g_index=None):
+        """ Woodbury vector and matrix (see frozen_predictor) of the posterior of f (g_index None) or g, in self.dtype.
+            Computed once per EP posterior. """
+        if g_index is None:
+            posterior, sites = self.f_posterior, self.f_ga_approx
+        else:
+            posterior, sites = self.g_posterior_list[g_index], self.g_ga_approx_list[g_index]
+
+        cached = self._woodbury_cache.get(g_index)
+        if cached is None or cached[0] is not posterior:
+            vector, matrix = site_woodbury(posterior.mu, posterior.Sigma, sites.v, sites.tau)
+            cached = (posterior, vector.astype(self.dtype), matrix.astype(self.dtype))
+            self._woodbury_cache[g_index] = cached
+
+        return cached[1], cached[2]
+
     def predict(self, Xnew, full_cov=False, Y_metadata=None, include_likelihood=True):
 
         if Y_metadata is not None:
@@ -86,67 +232,194 @@ class UnimodalGP(GPy.core.Model):
         Xp = np.column_stack(  (Xnew, np.zeros((len(Xnew), 1))) )
 
         # construct kernels
-        Kff = self.Kf_kernel.K(self.Xf)
-        Kpp = self.Kf_kernel.K(Xp, Xp)
-        Kpf = self.Kf_kernel.K(Xp, self.Xf)
+        Kpp = self.Kf_kernel.Kdiag(Xp)
+        Kpf = self.kernel_cache.K(self.Kf_kernel, Xp, self.Xf, source=Xnew).astype(self.dtype, copy=False)
 
         # Compute predictive distributions
-        H =  np.linalg.solve(Kff, Kpf.T)
-        pred_mean = np.dot(H.T, self.f_posterior.mu)
-        pred_cov = Kpp -  np.dot(Kpf, H) + np.dot(H.T, np.dot(self.f_posterior.Sigma, H))
+        a, W = self._woodbury()
+        pred_mean = np.dot(Kpf, a)
+        pred_var_ = Kpp - np.sum(np.dot(Kpf, W)*Kpf, axis=1)
 
-        # if not full_cov:
-        pred_var_ = np.diag(pred_cov)
-
-        if include_likelihood:
-            pred_var = pred_var_ + self.sigma2
+        pred_var = pred_var_ + self.sigma2 if include_likelihood else pred_var_
 
         return pred_mean, pred_var
 
 
     def predict_g(self, Xnew, g_index=0, full_cov=False):
-        mu_g, Sigma_full_g = self.g_posterior_list[g_index].mu, self.g_posterior_list[g_index].Sigma
 
         # augment Xnew with kernel index
         Xp = np.column_stack(  (Xnew, np.zeros((len(Xnew), 1))) )
 
-        # concatenate and augment Xd + Xd with kernel indeces (equal to self.Xf when predicting f)
-        Xg = np.column_stack(  (self.Xd, np.zeros((self.M, 1))) )
-        Xg = np.row_stack([Xg] + [np.column_stack(  (self.Xd, np.ones((self.M, 1))) )])
-
         # construct kernels
         Kg_kernel = self.Kg_kernel_list[g_index]
-        Kgg = Kg_kernel.K(Xg)
-        Kpp = Kg_kernel.K(Xp, Xp)
-        Kpg = Kg_kernel.K(Xp, Xg)
+        Kpg = self.kernel_cache.K(Kg_kernel, Xp, self.Xg, source=Xnew).astype(self.dtype, copy=False)
 
         # Compute predictive distributions
-        H =  np.linalg.solve(Kgg, Kpg.T)
-        pred_mean = np.dot(H.T, mu_g)
-        pred_cov = Kpp -  np.dot(Kpg, H) + np.dot(H.T, np.dot(Sigma_full_g, H))
+        a, W = self._woodbury(g_index)
+        pred_mean = np.dot(Kpg, a)
 
-        if not full_cov:
-            pred_cov = np.diag(pred_cov)
+        if full_cov:
+            pred_cov = Kg_kernel.K(Xp, Xp) - np.dot(np.dot(Kpg, W), Kpg.T)
+        else:
+            pred_cov = Kg_kernel.Kdiag(Xp) - np.sum(np.dot(Kpg, W)*Kpg, axis=1)
 
         return pred_mean, pred_cov
     
+    def _stacked_g_woodbury(self):
+        """ Woodbury vectors (D, 2M) and matrices (D, 2M, 2M) of all g posteriors, stacked once per EP posterior """
+        vectors, matrices = zip(*[self._woodbury(d) for d in range(self.D)])
+        cached = self._woodbury_cache.get('g_all')
+        if cached is None or any(v is not w for v, w in zip(cached[0], vectors)):
+            cached = (vectors, np.array(vectors), np.array(matrices))
+            self._woodbury_cache['g_all'] = cached
+        return cached[1], cached[2]
+
+    def predict_g_all(self, Xnew):
+        """ Predictive means and variances of g for all dimensions at Xnew, both of shape (len(Xnew), D). For RBF (+ Bias)
+            g kernels, the cross-covariances of all dimensions share one computation of the differences to Xd
+            (rbf_kernels.derivative_cross_covariances); other kernels use predict_g per dimension. """
+        try:
+            variance, lengthscale, bias = [np.array(p) for p in zip(*[rbf_parameters(kernel.parts[0]) for kernel in self.Kg_kernel_list])]
+        except ValueError:
+            means, variances = zip(*[self.predict_g(Xnew, g_index=d) for d in range(self.D)])
+            return np.column_stack(means), np.column_stack(variances)
+
+        Xnew = np.asarray(Xnew, dtype=self.dtype)
+        Kpg = derivative_cross_covariances(Xnew, np.asarray(self.Xd, dtype=self.dtype), variance, lengthscale, bias)
+        return predict_stacked(Kpg, variance + bias, *self._stacked_g_woodbury())
+
     def predictive_gradients(self, Xnew):
-        pred_mean, pred_cov =  self.predict_g(Xnew)
-        return np.reshape(pred_mean, (pred_mean.shape[0], self.D,1)), pred_cov
+        """ Predictive means (shape (len(Xnew), D, 1), as in GPy) and variances (shape (len(Xnew), D)) of g """
+        pred_mean, pred_var = self.predict_g_all(Xnew)
+        return pred_mean[:, :, None], pred_var
         
-    def sample_z_probabilities(self, Xnew, g_index=0, num_samples=1000):
+    def locate_mode(self, bounds=None, **kwargs):
+        """ Mode of f bracketed by the sign changes of the posterior means of g (see mode_locator.locate_mode) """
+        return mode_locator.locate_mode(self, bounds=bounds, **kwargs)
+
+    def sample_z_probabilities(self, Xnew, g_index=0, num_samples=1000, rng=None):
+        """ Mean and variance of Phi(g) at Xnew over num_samples posterior samples of g drawn from rng (see random_streams) """
+        rng = as_generator(rng)
 
         pred_mean, pred_cov = self.predict_g(Xnew, g_index=g_index, full_cov=True)
         D = pred_cov.shape[0]
 
         L = np.linalg.cholesky(pred_cov + 1e-6*np.identity(D)) 
 
-        zs = pred_mean[:, None] + np.dot(L, np.random.normal(0, 1, size=(D, num_samples)))
+        zs = pred_mean[:, None] + np.dot(L, rng.standard_normal((D, num_samples)))
         pzs = ep.phi(zs)
 
         return np.mean(pzs, axis = 1), np.var(pzs, axis = 1)    
 
 
+    def freeze(self):
+        """ Export the fitted model as a FrozenUnimodalGP, which predicts without GPy (requires RBF or RBF + Bias kernels) """
+
+        f_variance, f_lengthscale, f_bias = rbf_parameters(self.f_kernel_base)
+        f_vector, f_matrix = self._woodbury()
+
+        g_parameters, g_vectors, g_matrices = [], [], []
+        for d in range(self.D):
+            g_parameters.append(rbf_parameters(self.Kg_kernel_list[d].parts[0]))
+            vector, matrix = self._woodbury(d)
+            g_vectors.append(vector)
+            g_matrices.append(matrix)
+
+        g_variance, g_lengthscale, g_bias = [np.array(p) for p in zip(*g_parameters)]
+
+        return FrozenUnimodalGP(np.asarray(self.X), np.asarray(self.Xd), self.sigma2, f_variance, f_lengthscale, f_bias, f_vector, f_matrix,
+                                g_variance, g_lengthscale, g_bias, np.array(g_vectors), np.array(g_matrices)).astype(self.dtype)
+
+    def save(self, path):
+        """ Save the kernels, hyperparameters, construction options, data and EP state (site parameters, posteriors and
+            marginal likelihood gradients of f and each g) to an uncompressed .npz file. Parameter constraints other than
+            the kernel defaults and priors are not saved. """
+
+        g_posteriors, g_sites = self.g_posterior_list, self.g_ga_approx_list
+
+        # Cholesky factors are only stored for dense posteriors
+        factors = {}
+        if self.f_posterior.L is not None:
+            factors['f_L'] = self.f_posterior.L
+        if all(isinstance(post, (posteriorParams, ep.LeanPosterior)) for post in g_posteriors):
+            factors['g_L'] = np.array([post.L for post in g_posteriors])
+
+        # engines other than those in INFERENCE are saved as 'ep'
+        inference = [name for name, engine in INFERENCE.items() if engine is self.inference] or ['ep']
+
+        # backends without a to_dict method are saved as the dense default
+        backend = None
+        if self.backend is not None:
+            if hasattr(self.backend, 'to_dict'):
+                backend = self.backend.to_dict()
+            else:
+                warnings.warn('Backend %s cannot be saved, the loaded model uses dense factorizations' % type(self.backend).__name__)
+
+        save_npz(path, version=FORMAT_VERSION, name=self.name, dtype=self.dtype.name, inference=inference[0],
+                 fused_kernel=self.fused_kernel, g_structure=self.g_structure, backend=json.dumps(backend),
+                 dL_dK_f=self.grad_dict['dL_dK_f'], dL_dK_g=np.array([self.grad_dict['dL_dK_g%d' % d] for d in range(self.D)]),
+                 f_kernel=json.dumps(self.f_kernel_base.to_dict()), g_kernel=json.dumps(self.g_kernel_base.to_dict()),
+                 param_array=self.param_array, X=np.asarray(self.X), Y=np.asarray(self.Y), Xd=np.asarray(self.Xd), sigma2=self.sigma2,
+                 log_likelihood=self._log_lik,
+                 f_v=self.f_ga_approx.v, f_tau=self.f_ga_approx.tau,
+                 f_mu=self.f_posterior.mu, f_Sigma=self.f_posterior.Sigma,
+                 g_v=np.array([site.v for site in g_sites]), g_tau=np.array([site.tau for site in g_sites]),
+                 g_mu=np.array([post.mu for post in g_posteriors]), g_Sigma=np.array([post.Sigma for post in g_posteriors]), **factors)
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """ Load a model saved with save, ready for prediction and optimization without running EP (the gradient is
+            restored as well). If mmap is True, the arrays (e.g. the posterior covariances) are memory-mapped read-only.
+            EP runs again once the parameters change. """
+
+        data = load_npz(path, mmap=mmap)
+        if int(data['version']) != FORMAT_VERSION:
+            raise ValueError('Unsupported UnimodalGP format version %d' % int(data['version']))
+
+        f_kernel = GPy.kern.Kern.from_dict(json.loads(str(data['f_kernel'])))
+        g_kernel = GPy.kern.Kern.from_dict(json.loads(str(data['g_kernel'])))
+
+        backend = json.loads(str(data.get('backend', 'null')))
+        options = dict(fused_kernel=bool(data.get('fused_kernel', True)), g_structure=str(data.get('g_structure', 'auto')),
+                       backend=None if backend is None else IterativeBackend.from_dict(backend),
+                       dtype=str(data.get('dtype', 'float64')), inference=str(data.get('inference', 'ep')))
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            model = cls(np.array(data['X']), np.array(data['Y']), np.array(data['Xd']), f_kernel, g_kernel, float(data['sigma2']), name=str(data['name']), initialize=False, **options)
+
+        # set the parameters before the (single) update, in which parameters_changed restores the EP state and the
+        # gradients instead of running EP
+        model.update_model(False)
+        model.initialize_parameter()
+        model.param_array[:] = data['param_array']
+        model._restored_state = data
+        model.update_model(True)
+
+        return model
+
+    def _restore_ep_state(self, data):
+        self.f_ga_approx = gaussianApproximation(v=data['f_v'], tau=data['f_tau'])
+        self.f_posterior = posteriorParams(mu=data['f_mu'], Sigma=data['f_Sigma'], L=data.get('f_L'))
+
+        self.g_ga_approx_list = [gaussianApproximation(v=data['g_v'][d], tau=data['g_tau'][d]) for d in range(self.D)]
+        self.g_posterior_list = [posteriorParams(mu=data['g_mu'][d], Sigma=data['g_Sigma'][d], L=data['g_L'][d] if 'g_L' in data else None) for d in range(self.D)]
+
+        self._log_lik = float(data['log_likelihood'])
+
+        if 'dL_dK_f' in data:
+            self.grad_dict = {'dL_dK_f': np.asarray(data['dL_dK_f'])}
+            self.grad_dict.update(('dL_dK_g%d' % d, np.asarray(data['dL_dK_g'][d])) for d in range(self.D))
+        else:
+            # files written before the gradients were saved: dL_dK = 0.5*(a a^T - W) of the dense EP marginal likelihood,
+            # with the woodbury vector a and matrix W of the sites
+            self.grad_dict = {}
+            for name, post, sites in [('dL_dK_f', self.f_posterior, self.f_ga_approx)] + [('dL_dK_g%d' % d, post, sites) for d, (post, sites) in enumerate(zip(self.g_posterior_list, self.g_ga_approx_list))]:
+                a, W = site_woodbury(post.mu, post.Sigma, sites.v, sites.tau)
+                self.grad_dict[name] = 0.5*(np.outer(a, a) - W)
+
+        self._update_gradients()
+
     def log_predictive_density(self, Xtest, ytest, Y_metadata=None):
         
         if Y_metadata is not None:
@@ -1,8 +1,9 @@
 import numpy as np
-import pylab as plt
 
 
 def plot_with_uncertainty(x, y, ystd=None, color='r', linestyle='-', fill=True, label=''):
+	# matplotlib is slow to import and only needed for plotting
+	import pylab as plt
 	
 	plt.plot(x, y, color=color, linestyle=linestyle, label=label)
 	
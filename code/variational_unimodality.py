@@ -0,0 +1,197 @@
+""" Variational inference for UnimodalGP, a faster alternative to ep_unimodality.
+
+    The posteriors of f and of each g are approximated by Gaussians with the site parameterization of EP,
+    Sigma = (K^-1 + S)^-1 and mu = Sigma v with S = diag(tau), and the sites are fitted by natural-gradient
+    (conjugate-computation) variational inference: for a factor t_i and the marginal q(z_i) = N(m_i, s_i), each iteration
+    moves site i towards
+
+        tau_i = -E[d2/dz2 log t_i],    v_i = E[d/dz log t_i] + tau_i m_i
+
+    with step size rho, where the expectations are computed by Gauss-Hermite quadrature. The factors are those of
+    ep_unimodality: the Gaussian likelihood (exact sites), the probit factors Phi(m nu g'(xd)) and the factors
+    Phi(nu2 f'(xd))Phi(g(xd)) + Phi(-nu2 f'(xd))Phi(-g(xd)) of moment_functions.compute_moments_strict, where f and g are
+    independent under q as in EP. All sites are updated at once from the current posteriors, so an iteration costs D + 1
+    posterior updates and no loop over the sites.
+
+    The log marginal likelihood is approximated by the evidence lower bound
+
+        ELBO = sum_i E[log t_i] - KL(q || p),    KL = 0.5*(log det(B) + mu^T alpha - sum(tau*diag(Sigma)))
+
+    with B = I + S^(1/2) K S^(1/2) and alpha = K^-1 mu = v - tau*mu. At a fixed point of the site updates, its gradient
+    with respect to K is 0.5*(alpha alpha^T - (K + S^-1)^-1) as for EP, so the posteriors and gradients are computed with
+    the backends of ep_unimodality.
+"""
+
+import time
+import numpy as np
+
+from ep_unimodality import DenseBackend, update_g_posterior, log_2_pi
+from moment_functions import log_factor_strict, logCdfNormal, derivLogCdfNormal
+from ep_stats import EPStats
+
+
+def vi_unimodality(X1, X2, t, y, Kf_kernel, Kg_kernel_list, sigma2, t2=None, m=None, max_itt=100, nu=10., nu2=1., rho=0.5, tol=1e-6, verbose=0, num_points=20, return_sites=False, g_priors=None, backend=None, kernel_dtype=np.float64, stats=None):
+    """ Variational counterpart of ep_unimodality with the same arguments and return values, where logZ is the ELBO.
+        rho is the step size of the site updates and num_points the number of Gauss-Hermite points per dimension. """
+    from GPy.inference.latent_function_inference.expectation_propagation import gaussianApproximation
+
+    t0 = time.time()
+
+    if backend is None:
+        backend = DenseBackend()
+
+    if stats is None:
+        stats = EPStats()
+
+    if t2 is None:
+        t2 = t.copy()
+
+    N, D = t.shape
+    M = len(t2)
+    Df = N + D*M
+
+    if m is None:
+        m = np.ones((D, M))
+
+    nodes, weights = np.polynomial.hermite.hermgauss(num_points)
+    weights = weights/np.sqrt(np.pi)
+
+    ###################################################################################
+    # Contruct kernels, sites and posteriors
+    ###################################################################################
+    Kf = Kf_kernel.K(X1).astype(kernel_dtype, copy=False)
+    Kg_list = [kg.K(X2).astype(kernel_dtype, copy=False) for kg in Kg_kernel_list] if g_priors is None else g_priors
+
+    f_ga_approx = gaussianApproximation(v=np.zeros(Df), tau=np.zeros(Df))
+    f_ga_approx.v[:N] = y[:, 0]/sigma2
+    f_ga_approx.tau[:N] = 1./sigma2
+    g_ga_approx_list = [gaussianApproximation(v=np.zeros(2*M), tau=np.zeros(2*M)) for d in range(D)]
+
+    f_posterior = backend.posterior(Kf, f_ga_approx.v, f_ga_approx.tau)
+    g_posterior_list = [update_g_posterior(Kg_list[d], g_ga_approx_list[d].v, g_ga_approx_list[d].tau, backend) for d in range(D)]
+
+    values, derivatives = slice(0, M), slice(M, 2*M)
+
+    ###################################################################################
+    # Iterate
+    ###################################################################################
+    for itt in range(max_itt):
+
+        old_params = np.hstack((f_posterior.mu, f_posterior.Sigma_diag))
+        stats.start_iteration()
+
+        for d in range(D):
+            g_posterior, g_ga_approx = g_posterior_list[d], g_ga_approx_list[d]
+            f_index = slice(N + d*M, N + (d + 1)*M)
+
+            # probit factors for g' and the factors coupling f' and g, all from the current posteriors
+            with stats.phase('g_sweep'):
+                _, g_grad, g_hess = expected_log_probit(g_posterior.mu[derivatives], g_posterior.Sigma_diag[derivatives], m[d]*nu, nodes, weights)
+                natural_step(g_ga_approx, derivatives, g_posterior.mu[derivatives], g_grad, g_hess, rho)
+
+            with stats.phase('fg_sweep'):
+                _, (fp_grad, fp_hess), (g0_grad, g0_hess) = expected_log_factor_strict(f_posterior.mu[f_index], f_posterior.Sigma_diag[f_index],
+                                                                                       g_posterior.mu[values], g_posterior.Sigma_diag[values], nu2, nodes, weights)
+                natural_step(g_ga_approx, values, g_posterior.mu[values], g0_grad, g0_hess, rho)
+                natural_step(f_ga_approx, f_index, f_posterior.mu[f_index], fp_grad, fp_hess, rho)
+
+            with stats.phase('posterior'):
+                g_posterior_list[d] = update_g_posterior(Kg_list[d], g_ga_approx.v, g_ga_approx.tau, backend)
+
+        with stats.phase('posterior'):
+            f_posterior = backend.posterior(Kf, f_ga_approx.v, f_ga_approx.tau)
+
+        # check for convergence
+        new_params = np.hstack((f_posterior.mu, f_posterior.Sigma_diag))
+        residual = np.mean((new_params-old_params)**2)/np.mean(old_params**2)
+        stats.end_iteration(residual)
+        if residual < tol:
+            if verbose > 0:
+                print('Converged in %d iterations in %4.3fs' % (itt + 1, time.time() - t0))
+            break
+
+    #############################################################################3
+    # Evidence lower bound & gradients
+    #############################################################################3
+    with stats.phase('marginal_likelihood'):
+        mu, s = f_posterior.mu[:N], f_posterior.Sigma_diag[:N]
+        expected_log_lik = np.sum(-0.5*np.log(2*np.pi*sigma2) - 0.5*((y[:, 0] - mu)**2 + s)/sigma2)
+
+        for d in range(D):
+            g_posterior = g_posterior_list[d]
+            f_index = slice(N + d*M, N + (d + 1)*M)
+            expected_log_lik += np.sum(expected_log_probit(g_posterior.mu[derivatives], g_posterior.Sigma_diag[derivatives], m[d]*nu, nodes, weights)[0])
+            expected_log_lik += np.sum(expected_log_factor_strict(f_posterior.mu[f_index], f_posterior.Sigma_diag[f_index],
+                                                                  g_posterior.mu[values], g_posterior.Sigma_diag[values], nu2, nodes, weights)[0])
+
+        f_KL, f_dL_dK = _kl_and_gradient(Kf, f_ga_approx, f_posterior, backend)
+        grad_dict = {'dL_dK_f': f_dL_dK}
+        KL = f_KL
+
+        for d in range(D):
+            g_KL, grad_dict['dL_dK_g%d' % d] = _kl_and_gradient(Kg_list[d], g_ga_approx_list[d], g_posterior_list[d], backend)
+            KL += g_KL
+
+        logZ = expected_log_lik - KL
+
+    stats.finish(converged=len(stats.residuals) > 0 and stats.residuals[-1] < tol)
+
+    if return_sites:
+        return f_posterior, g_posterior_list, Kf, logZ, grad_dict, f_ga_approx, g_ga_approx_list
+
+    return f_posterior, g_posterior_list, Kf, logZ, grad_dict
+
+
+def natural_step(ga_approx, index, mu, grad, hess, rho):
+    """ Move the sites at index a step rho towards tau = -hess, v = grad - hess*mu, keeping tau positive as in EP """
+    tau = np.maximum((1 - rho)*ga_approx.tau[index] - rho*hess, np.finfo(float).eps)
+    ga_approx.v[index] = (1 - rho)*ga_approx.v[index] + rho*(grad - hess*mu)
+    ga_approx.tau[index] = tau
+
+
+def expected_log_probit(mu, s, c, nodes, weights):
+    """ E[log Phi(c z)] for z ~ N(mu, s) and its derivatives with respect to mu and 2*s (see _derivatives) """
+    x = np.sqrt(2*s)[:, None]*nodes
+    cz = c[:, None]*(mu[:, None] + x)
+    value = np.dot(logCdfNormal(cz), weights)
+    grad, hess = _derivatives(c[:, None]*derivLogCdfNormal(cz), x, s[:, None], weights)
+    return value, grad, hess
+
+
+def expected_log_factor_strict(mu_fp, s_fp, mu_g, s_g, nu2, nodes, weights):
+    """ Expectation of moment_functions.log_factor_strict for independent fp ~ N(mu_fp, s_fp), g ~ N(mu_g, s_g) by tensor
+        Gauss-Hermite quadrature, and its derivatives with respect to the means and 2*variances of fp and g """
+    x_fp = np.sqrt(2*s_fp)[:, None, None]*nodes[None, :, None]
+    x_g = np.sqrt(2*s_g)[:, None, None]*nodes[None, None, :]
+    log_h, d_fp, d_g = log_factor_strict(mu_fp[:, None, None] + x_fp, mu_g[:, None, None] + x_g, nu2)
+
+    W = np.outer(weights, weights).ravel()
+    n = len(mu_fp)
+    flat = lambda A: np.broadcast_to(A, log_h.shape).reshape(n, -1)
+    return (np.dot(flat(log_h), W), _derivatives(flat(d_fp), flat(x_fp), s_fp[:, None], W),
+            _derivatives(flat(d_g), flat(x_g), s_g[:, None], W))
+
+
+def _derivatives(d, x, s, weights):
+    """ Derivatives with respect to mu and 2*s of the quadrature sum(weights*F(mu + x)), x = sqrt(2*s)*nodes, from the
+        derivative d of F at the nodes. These are E[F'] and E[F''] for exact expectations (by Stein's lemma), but unlike
+        quadratures of F'' they are the exact derivatives of the quadrature used for the ELBO, so that the fixed points
+        of the site updates are stationary points of the computed ELBO. """
+    return np.dot(d, weights), np.dot(d*x/s, weights)
+
+
+def _kl_and_gradient(K, ga_approx, posterior, backend):
+    """ KL(q || p) and the gradient of -KL with respect to K for the Gaussian q with sites ga_approx (see module docstring) """
+    if hasattr(K, 'inference'):
+        _, log_marginal, grad = K.inference(ga_approx, 0.)
+    else:
+        _, log_marginal, grad = backend.inference(K, ga_approx, None, 0.)
+
+    # the Gaussian marginal likelihood of the sites is 0.5*(-n*log(2 pi) - log det(B) + v^T mu)
+    n = len(ga_approx.tau)
+    B_logdet = -2*log_marginal - n*log_2_pi + np.dot(ga_approx.v, posterior.mu)
+
+    alpha = ga_approx.v - ga_approx.tau*posterior.mu
+    KL = 0.5*(B_logdet + np.dot(posterior.mu, alpha) - np.sum(ga_approx.tau*posterior.Sigma_diag))
+
+    return KL, grad['dL_dK']
@@ -0,0 +1,63 @@
+import numpy as np
+import sys
+import os
+import json
+import shutil
+import tempfile
+
+sys.path.append('../code/')
+from benchmark_runner import Job, get_jobs, run_job, write_results, FAILED
+from results_store import ResultsStore
+
+
+class TestBenchmarkRunner:
+
+	def test_run_job(self):
+
+		job = Job(dim=1, func_index=0, seed=0, model='vanilla', acquisition='EI')
+		key, record, error = run_job(job, max_iter=1, design='lhs', design_size=3)
+
+		# the job succeeded, with the traceback in the assertion message otherwise
+		assert error is None, error
+		assert record is not None and key == job.key
+
+		scalars, arrays = record
+		assert scalars['dim'] == 1 and scalars['model'] == 'vanilla' and scalars['acquisition'] == 'EI'
+		assert scalars['f_id'] == 0 and scalars['seed'] == 0
+		assert scalars['wall_time'] > 0
+
+		# one BO iteration after the initial design of 3 points
+		assert arrays['x'].shape == (4, 1) and arrays['y'].shape == (4, 1)
+		assert len(arrays['f_min']) == len(arrays['x_min']) == 1
+		assert len(arrays['time_initial_fit']) == 1
+		assert len(arrays['time_fit']) == len(arrays['time_acquisition']) == 1
+		assert np.all(np.asarray(arrays['time_initial_fit']) > 0)
+		assert np.all(np.isfinite(arrays['y'])) and np.all(np.isfinite(arrays['f_min']))
+
+	def test_get_jobs(self):
+
+		jobs = get_jobs(4, 2, [0])
+		# 2 dimensions x 2 functions x 2 models x 4 acquisitions, without the 2 x 4 unimodal jobs in 2-D
+		assert len(jobs) == 2*2*2*4 - 2*4
+		assert all(job.dim == 1 for job in jobs if job.model == 'unimodal')
+		assert any(job.dim == 2 for job in jobs if job.model == 'vanilla')
+
+	def test_write_results(self):
+
+		root = tempfile.mkdtemp()
+		try:
+			results = [('job%d' % i, ({'seed': i}, {'f_min': np.arange(i + 1.)}), None) for i in range(5)]
+			results.insert(2, ('broken', None, 'Traceback'))
+			failed = write_results(results, root, flush_every=2)
+
+			# the shards of the successful jobs are merged although a job failed
+			store = ResultsStore(root)
+			assert len(store.shards) == 1
+			assert sorted(store.keys()) == ['job%d' % i for i in range(5)]
+			assert [len(f_min) for f_min in store.arrays('f_min')] == [1, 2, 3, 4, 5]
+
+			assert failed == {'broken': 'Traceback'}
+			with open(os.path.join(root, FAILED)) as f:
+				assert json.load(f) == failed
+		finally:
+			shutil.rmtree(root)
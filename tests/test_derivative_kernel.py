@@ -0,0 +1,80 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+import pytest
+import GPy
+from derivative_kernel import RBFDerivative
+from kernel_cache import KernelCache
+
+eps = 1e-5
+max_tol = 1e-6
+
+
+def base_kernel(D):
+	return GPy.kern.RBF(D, variance=1.3, lengthscale=np.linspace(0.6, 1.1, D), ARD=D > 1) + GPy.kern.Bias(D, variance=0.4)
+
+
+def inputs(D, random_state):
+	""" Multi-output inputs of f at X and of its derivatives in every dimension at Xd, as built by UnimodalGP """
+	X, Xd = random_state.uniform(-1, 1, size=(4, D)), random_state.uniform(-1, 1, size=(3, D))
+	return GPy.util.multioutput.build_XY([X] + [Xd]*D, [None]*(D + 1))[0]
+
+
+def diff_kern_error():
+	""" None if MultioutputKern over DiffKern can be built and evaluated by the installed GPy, the error otherwise """
+	try:
+		base = base_kernel(1)
+		GPy.kern.MultioutputKern(kernels=[base, GPy.kern.DiffKern(base, 0)], cross_covariances={}).K(inputs(1, np.random.RandomState(0)))
+	except Exception as e:
+		return '%s: %s' % (type(e).__name__, e)
+
+
+diff_kern_unsupported = diff_kern_error()
+
+
+class TestDerivativeKernel:
+
+	@pytest.mark.skipif(diff_kern_unsupported is not None, reason='DiffKern is not supported by the installed GPy (%s)' % diff_kern_unsupported)
+	def test_K(self):
+
+		random_state = np.random.RandomState(0)
+		for D in [1, 2]:
+			base = base_kernel(D)
+			reference = GPy.kern.MultioutputKern(kernels=[base] + [GPy.kern.DiffKern(base, d) for d in range(D)], cross_covariances={})
+			kernel = RBFDerivative(base.copy())
+			X, X2 = inputs(D, random_state), inputs(D, random_state)
+
+			assert np.allclose(kernel.K(X), reference.K(X))
+			assert np.allclose(kernel.K(X, X2), reference.K(X, X2))
+			assert np.allclose(kernel.Kdiag(X), np.diag(reference.K(X)))
+
+			# a single derivative block, as used for g
+			kernel = RBFDerivative(base.copy(), dims=[D - 1])
+			reference = GPy.kern.MultioutputKern(kernels=[base, GPy.kern.DiffKern(base, D - 1)], cross_covariances={})
+			Xg = GPy.util.multioutput.build_XY([X2[:3, :-1], X2[:3, :-1]], [None, None])[0]
+			assert np.allclose(kernel.K(Xg), reference.K(Xg))
+
+	def test_gradients(self):
+
+		random_state = np.random.RandomState(1)
+		for D in [1, 2]:
+			for kernel_cache in [None, KernelCache()]:
+				kernel = RBFDerivative(base_kernel(D))
+				kernel.kernel_cache = kernel_cache
+				X = inputs(D, random_state)
+				dL_dK = random_state.normal(size=(len(X), len(X)))
+
+				kernel.update_gradients_full(dL_dK, X)
+				gradient = kernel.gradient.copy()
+
+				# central differences of L = sum(dL_dK*K) in the variance, lengthscales and bias
+				params = kernel.param_array.copy()
+				for i in range(len(params)):
+					L = []
+					for step in [eps, -eps]:
+						kernel[:] = params + step*(np.arange(len(params)) == i)
+						L.append(np.sum(dL_dK*kernel.K(X)))
+					numerical = (L[0] - L[1])/(2*eps)
+					assert np.abs(gradient[i] - numerical) < max_tol*max(1., np.abs(numerical))
+				kernel[:] = params
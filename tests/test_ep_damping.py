@@ -0,0 +1,69 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+from ep_damping import AdaptiveDamping
+
+
+class _Arrays(object):
+	""" Stand-in for the GPy EP containers """
+
+	def __init__(self, **arrays):
+		self.__dict__.update(arrays)
+
+
+def _site(tau, target_tau, n=1):
+	""" Site, cavity, posterior and moments of n sites whose update has precision step target_tau - tau """
+	ga_approx = _Arrays(v=np.zeros(n), tau=np.full(n, tau))
+	cavity = _Arrays(v=np.zeros(n), tau=np.ones(n))
+	post = _Arrays(mu=np.zeros(n), Sigma_diag=np.full(n, 1./(1. + tau)))
+	moments = _Arrays(mu_hat=np.zeros(n), sigma2_hat=np.full(n, 1./(1. + target_tau)))
+	return ga_approx, cavity, post, moments
+
+
+class TestAdaptiveDamping:
+
+	def test_fixed_point(self):
+
+		# without oscillation the damping stays at alpha_max and the update matches the damped EP update
+		damping = AdaptiveDamping(alpha=0.5)
+		ga_approx, cavity, post, moments = _site(1., 3.)
+		assert damping.update_site('f', ga_approx, 0, 1., post, moments, cavity)
+		assert np.isclose(ga_approx.tau[0], 2.)
+		assert damping.damping['f'][0] == 0.5
+
+		# power EP scales the step by 1/eta
+		ga_approx, cavity, post, moments = _site(1., 3.)
+		damping.update_site('f', ga_approx, 0, 0.5, post, moments, cavity)
+		assert np.isclose(ga_approx.tau[0], 3.)
+
+	def test_oscillation_and_rejection(self):
+
+		damping = AdaptiveDamping(alpha=1., window=2)
+		ga_approx, cavity, post, moments = _site(1., 2.)
+
+		# precision steps that change sign in consecutive updates lower the damping of the site
+		for target in [2., 0.5, 2.]:
+			moments.sigma2_hat[0] = 1./(1. + target)
+			damping.update_site('f', ga_approx, 0, 1., post, moments, cavity)
+		assert damping.num_oscillations == 1 and damping.damping['f'][0] == 0.5
+
+		# negative cavity precisions are rejected and leave the site unchanged
+		cavity.tau[0] = -1.
+		tau = ga_approx.tau[0]
+		assert not damping.update_site('f', ga_approx, 0, 1., post, moments, cavity)
+		assert ga_approx.tau[0] == tau and damping.damping['f'][0] == 0.25 and damping.num_rejected == 1
+
+	def test_divergence(self):
+
+		damping = AdaptiveDamping(patience=3, min_progress=0.5)
+		assert not any(damping.end_iteration(r) for r in [1., 0.1, 0.01, 0.001])
+
+		# no progress in patience iterations
+		assert not damping.end_iteration(0.002)
+		assert not damping.end_iteration(0.002)
+		assert damping.end_iteration(0.002)
+
+		# not finite
+		damping.reset()
+		assert damping.end_iteration(np.nan) and damping.diverged
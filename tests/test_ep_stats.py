@@ -0,0 +1,45 @@
+import numpy as np
+import sys
+import json
+
+sys.path.append('../code/')
+from ep_stats import EPStats, PHASES
+
+
+class TestEPStats:
+
+	def test_iterations(self):
+
+		calls = []
+		stats = EPStats(callback=lambda s: calls.append(s.iterations))
+
+		for itt in range(3):
+			stats.start_iteration()
+			with stats.phase('g_sweep'):
+				pass
+			with stats.phase('posterior'):
+				pass
+			with stats.phase('posterior'):
+				pass
+			if itt == 1:
+				stats.skip('fg', itt, 0, 4)
+			stats.end_iteration(10.**-itt)
+
+		with stats.phase('marginal_likelihood'):
+			pass
+		stats.finish(converged=True)
+
+		# one timing per iteration for the sweep phases, one for the marginal likelihood
+		assert [len(stats.timings[phase]) for phase in PHASES] == [3, 3, 3, 1]
+		assert stats.timings['fg_sweep'] == [0., 0., 0.]
+		assert all(t >= 0 for t in stats.timings['posterior'])
+
+		assert calls == [1, 2, 3]
+		assert stats.residuals == [1., 0.1, 0.01]
+		assert stats.num_skipped == {'g': 0, 'fg': 1}
+		assert stats.skipped['fg'] == [(1, 0, 4)]
+		assert stats.converged and stats.total_time >= 0
+
+		summary = json.loads(json.dumps(stats.summary()))
+		assert summary['iterations'] == 3
+		assert summary['final_residual'] == 0.01
@@ -0,0 +1,105 @@
+import numpy as np
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.append('../code/')
+import pytest
+import GPy
+import ep_unimodality as ep
+import unimodal
+from ep_damping import AdaptiveDamping
+
+max_tol = 1e-8
+
+
+def make_model(N, seed):
+	random_state = np.random.RandomState(seed)
+	X = random_state.uniform(-3, 3, size=(N, 1))
+	y = 0.5*X**2 + 0.2*random_state.normal(size=(N, 1))
+	f_kernel_base = GPy.kern.RBF(1, variance=2., lengthscale=1.5) + GPy.kern.Bias(1, variance=0.5)
+	return unimodal.UnimodalGP(X=X, Y=y, Xd=np.linspace(-3, 3, 6)[:, None], f_kernel_base=f_kernel_base, g_kernel_base=GPy.kern.RBF(1, lengthscale=2.), sigma2=0.1)
+
+
+def run_ep(model, **kwargs):
+	""" return_sites=True output of ep_unimodality for the current parameters of model """
+	return ep.ep_unimodality(model.Xf, model.Xg, model.X, model.Y, model.Kf_kernel, model.Kg_kernel_list, model.sigma2, t2=model.Xd, nu2=1., return_sites=True, **kwargs)
+
+
+class TestEPUnimodality:
+
+	def setup_method(self, method):
+		self.root = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.root)
+
+	def test_lean_posterior(self):
+
+		random_state = np.random.RandomState(2)
+		X = random_state.uniform(-3, 3, size=(30, 1))
+		K = np.exp(-0.5*(X - X.T)**2) + 1e-6*np.identity(30)
+		eta, theta = random_state.normal(size=30), random_state.rand(30)
+		theta[:5] = 0.
+
+		Sigma = K - np.dot(K, np.linalg.solve(K + np.diag(1./np.maximum(theta, 1e-300)), K))
+		dense = ep.update_posterior(K, eta, theta)
+		for K_dtype in [np.float64, np.float32]:
+			lean = ep.update_posterior(K.astype(K_dtype), eta, theta, lean=True)
+			tol = 1e-8 if K_dtype == np.float64 else 1e-4
+			assert np.allclose(lean.mu, dense.mu, atol=tol) and np.allclose(lean.mu, np.dot(Sigma, eta), atol=tol)
+			assert np.allclose(lean.Sigma_diag, np.diag(dense.Sigma), atol=tol) and np.allclose(lean.Sigma_diag, np.diag(Sigma), atol=tol)
+			assert np.allclose(lean.Sigma, dense.Sigma, atol=tol)
+			assert np.allclose(np.dot(lean.L, lean.L.T), np.identity(30) + np.sqrt(theta)[:, None]*K*np.sqrt(theta), atol=tol)
+
+	def test_resume(self):
+
+		model = make_model(8, 0)
+		path = os.path.join(self.root, 'checkpoint.npz')
+
+		# uninterrupted run, and a run stopped after 3 iterations and resumed with another generator
+		rng = np.random.default_rng(5)
+		result = run_ep(model, max_itt=8, tol=1e-14, seed=rng)
+		run_ep(model, max_itt=3, tol=1e-14, seed=np.random.default_rng(5), checkpoint=path)
+		resumed_rng = np.random.default_rng(0)
+		resumed = run_ep(model, max_itt=8, tol=1e-14, seed=resumed_rng, resume_from=path)
+
+		assert resumed_rng.bit_generator.state == rng.bit_generator.state
+		assert np.allclose(resumed[5].tau, result[5].tau) and np.allclose(resumed[5].v, result[5].v)
+		assert np.allclose(resumed[6][0].tau, result[6][0].tau) and np.allclose(resumed[6][0].v, result[6][0].v)
+		assert np.abs(resumed[3] - result[3]) < max_tol*np.abs(result[3])
+
+	def test_checkpoint_mismatch(self, monkeypatch):
+
+		path = os.path.join(self.root, 'checkpoint.npz')
+		run_ep(make_model(8, 0), max_itt=2, checkpoint=path)
+
+		# a problem of a different size
+		with pytest.raises(ValueError, match='does not match the problem'):
+			run_ep(make_model(13, 1), max_itt=4, resume_from=path)
+
+		# a checkpoint of another version
+		monkeypatch.setattr(ep, 'CHECKPOINT_VERSION', ep.CHECKPOINT_VERSION + 1)
+		with pytest.raises(ValueError, match='Unsupported EP checkpoint version'):
+			run_ep(make_model(8, 0), max_itt=4, resume_from=path)
+
+	def test_batch(self):
+
+		models = [make_model(8, 0), make_model(13, 1)]
+		for eta, damped in [(1., False), (0.7, False), (1., True)]:
+			damping = lambda: AdaptiveDamping(alpha=0.5, alpha_max=1.) if damped else None
+			results = [run_ep(model, max_itt=30, tol=1e-10, eta=eta, damping=damping()) for model in models]
+			batch = ep.ep_unimodality_batch([model.Kf_kernel.K(model.Xf) for model in models],
+			                                [[kernel.K(model.Xg) for kernel in model.Kg_kernel_list] for model in models],
+			                                [model.Y for model in models], [model.sigma2 for model in models],
+			                                nu2=1., max_itt=30, tol=1e-10, eta=eta, damping=[damping() for model in models] if damped else None)
+
+			for result, batch_result in zip(results, batch):
+				f_posterior, _, _, logZ, grad_dict, f_sites, g_sites = result
+				assert np.abs(logZ - batch_result[3]) < max_tol*np.abs(logZ)
+				assert np.allclose(f_sites.tau, batch_result[5].tau) and np.allclose(f_sites.v, batch_result[5].v)
+				assert np.allclose(g_sites[0].tau, batch_result[6][0].tau) and np.allclose(g_sites[0].v, batch_result[6][0].v)
+				assert np.allclose(f_posterior.mu, batch_result[0].mu)
+				for key in grad_dict:
+					assert np.allclose(grad_dict[key], batch_result[4][key])
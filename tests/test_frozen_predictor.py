@@ -0,0 +1,122 @@
+import numpy as np
+import sys
+import os
+import tempfile
+
+sys.path.append('../code/')
+import GPy
+import unimodal
+from frozen_predictor import FrozenUnimodalGP, woodbury, site_woodbury
+
+
+def random_posterior(K):
+	L = np.linalg.cholesky(K + 1e-8*np.identity(len(K)))
+	mu = np.dot(L, np.random.normal(size=len(K)))
+	Sigma = 0.5*K
+	return woodbury(K, mu, Sigma)
+
+
+class TestFrozenPredictor:
+
+	def setup_method(self, method):
+		np.random.seed(0)
+		N, M, D = 5, 4, 2
+		f_vector, f_matrix = random_posterior(np.identity(N + D*M))
+		g = [random_posterior(np.identity(2*M)) for d in range(D)]
+		self.predictor = FrozenUnimodalGP(np.random.rand(N, D), np.random.rand(M, D), 0.1, 2., [0.5, 1.], 0.3, f_vector, f_matrix,
+		                                  [1., 2.], [[1., 1.], [0.5, 0.5]], [0., 0.], [v for v, _ in g], [W for _, W in g])
+
+	def test_woodbury(self):
+
+		A = np.random.normal(size=(6, 6))
+		K = np.dot(A, A.T) + np.identity(6)
+		mu, Sigma = np.random.normal(size=6), 0.3*K
+		vector, matrix = woodbury(K, mu, Sigma)
+
+		assert np.allclose(np.dot(K, vector), mu)
+		assert np.allclose(K - np.dot(np.dot(K, matrix), K), Sigma)
+
+	def test_site_woodbury(self):
+
+		A = np.random.normal(size=(6, 6))
+		K = np.dot(A, A.T) + np.identity(6)
+		v, tau = np.random.normal(size=6), np.random.uniform(0.1, 2., size=6)
+		Sigma = np.linalg.inv(np.linalg.inv(K) + np.diag(tau))
+		mu = np.dot(Sigma, v)
+
+		for a, b in zip(site_woodbury(mu, Sigma, v, tau), woodbury(K, mu, Sigma)):
+			assert np.allclose(a, b)
+
+	def test_astype(self):
+
+		Xp = np.random.rand(7, 2)
+		single = self.predictor.astype(np.float32)
+		assert single.dtype == np.float32 and single.X.dtype == np.float32
+
+		mean, var = single.predict(Xp)
+		assert mean.dtype == np.float32
+		assert np.allclose(mean, self.predictor.predict(Xp)[0], atol=1e-4)
+		assert np.allclose(var, self.predictor.predict(Xp)[1], atol=1e-4)
+
+	def test_predict_g_full_cov(self):
+
+		Xp = np.random.rand(7, 2)
+		for d in range(2):
+			mean, var = self.predictor.predict_g(Xp, d)
+			mean_full, cov = self.predictor.predict_g(Xp, d, full_cov=True)
+			assert np.allclose(mean, mean_full)
+			assert np.allclose(var, np.diag(cov))
+
+	def test_predict_g_all(self):
+
+		Xp = np.random.rand(7, 2)
+		mean, var = self.predictor.predict_g_all(Xp)
+		assert mean.shape == var.shape == (7, 2)
+		for d in range(2):
+			mean_d, var_d = self.predictor.predict_g(Xp, d)
+			assert np.allclose(mean[:, d], mean_d)
+			assert np.allclose(var[:, d], var_d)
+
+	def test_save_load(self):
+
+		Xp = np.random.rand(7, 2)
+		path = os.path.join(tempfile.mkdtemp(), 'frozen.npz')
+		self.predictor.save(path)
+
+		for mmap in [False, True]:
+			loaded = FrozenUnimodalGP.load(path, mmap=mmap)
+			assert isinstance(loaded.g_woodbury_matrix, np.memmap) == mmap
+
+			for a, b in zip(self.predictor.predict(Xp), loaded.predict(Xp)):
+				assert np.allclose(a, b)
+			for a, b in zip(self.predictor.predict_g(Xp, 1), loaded.predict_g(Xp, 1)):
+				assert np.allclose(a, b)
+			del loaded
+
+		os.remove(path)
+		assert np.allclose(self.predictor.predict(Xp)[1] - 0.1, self.predictor.predict(Xp, include_likelihood=False)[1])
+
+
+class TestFreeze:
+
+	def test_freeze(self):
+
+		random_state = np.random.RandomState(0)
+		X = random_state.uniform(-3, 3, size=(10, 2))
+		y = 0.3*np.sum(X**2, axis=1)[:, None] + 0.1*random_state.normal(size=(10, 1))
+		Xd = np.column_stack([x.ravel() for x in np.meshgrid(np.linspace(-3, 3, 3), np.linspace(-3, 3, 3))])
+		f_kernel_base = GPy.kern.RBF(2, variance=2., lengthscale=[1.5, 2.], ARD=True) + GPy.kern.Bias(2, variance=0.5)
+		model = unimodal.UnimodalGP(X=X, Y=y, Xd=Xd, f_kernel_base=f_kernel_base, g_kernel_base=GPy.kern.RBF(2, lengthscale=2.), sigma2=0.1)
+		model.optimize(max_iters=10)
+
+		frozen = model.freeze()
+		Xp = random_state.uniform(-4, 4, size=(7, 2))
+		for include_likelihood in [True, False]:
+			for a, b in zip(frozen.predict(Xp, include_likelihood=include_likelihood), model.predict(Xp, include_likelihood=include_likelihood)):
+				assert np.allclose(a, b)
+
+		for d in range(2):
+			for a, b in zip(frozen.predict_g(Xp, d), model.predict_g(Xp, d)):
+				assert np.allclose(a, b)
+		for a, b in zip(frozen.predict_g_all(Xp), model.predict_g_all(Xp)):
+			assert np.allclose(a, b)
@@ -0,0 +1,66 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+from grid_structure import detect_grid, KroneckerPrior
+from rbf_kernels import cross_covariance
+
+
+class TestGridStructure:
+
+	def setup_method(self, method):
+		self.rng = np.random.default_rng(0)
+		X1, X2 = np.meshgrid(np.linspace(-3, 3, 6), np.linspace(-2, 2, 4))
+		self.Xd = np.column_stack((X1.ravel(), X2.ravel()))[self.rng.permutation(24)]
+		self.lengthscale = np.array([1.3, 0.8])
+
+	def test_detect_grid(self):
+
+		grid = detect_grid(self.Xd)
+		assert grid.row_of.shape == (6, 4)
+		assert np.allclose(self.Xd[grid.row_of[2, 3]], [grid.axes[0][2], grid.axes[1][3]])
+
+		assert detect_grid(self.Xd[:-1]) is None
+		assert detect_grid(self.rng.random((4, 2))) is None
+
+		# 1-D grids have no structure to exploit
+		assert detect_grid(np.linspace(0, 1, 10)[:, None]) is None
+
+	def test_full_rank_prior(self):
+
+		grid = detect_grid(self.Xd)
+		M = len(self.Xd)
+		for d in range(2):
+			K = KroneckerPrior(grid, 1.7, self.lengthscale, d, rtol=0).dense()
+			assert np.allclose(K, K.T)
+			assert np.allclose(K[:M], cross_covariance(self.Xd, self.Xd, self.Xd, 1.7, self.lengthscale, dims=[d]))
+
+	def test_posterior(self):
+
+		prior = KroneckerPrior(detect_grid(self.Xd), 1.7, self.lengthscale, 1, rtol=1e-12)
+		K = prior.dense()
+		v, tau = self.rng.normal(size=48), self.rng.random(48)
+
+		Sigma = np.linalg.inv(np.linalg.inv(K) + np.diag(tau))
+		post = prior.posterior(v, tau)
+		assert np.allclose(post.mu, np.dot(Sigma, v))
+		assert np.allclose(post.Sigma_diag, np.diag(Sigma))
+		assert np.allclose(post.Sigma, Sigma)
+
+	def test_no_dense_factorization(self, monkeypatch):
+
+		# record the sizes of all eigendecompositions and Cholesky factorizations
+		sizes = []
+		for name in ['eigh', 'cholesky']:
+			function = getattr(np.linalg, name)
+			monkeypatch.setattr(np.linalg, name, lambda A, function=function, **kwargs: sizes.append(len(A)) or function(A, **kwargs))
+
+		X1, X2 = np.meshgrid(np.linspace(-3, 3, 12), np.linspace(-2, 2, 10))
+		Xd = np.column_stack((X1.ravel(), X2.ravel()))
+		prior = KroneckerPrior(detect_grid(Xd), 1.7, self.lengthscale, 0)
+		random_state = np.random.RandomState(1)
+		prior.posterior(random_state.normal(size=240), random_state.rand(240))
+
+		# factors of at most 2*12 rows and an r x r Cholesky factor, never the 240 x 240 covariance
+		assert prior.rank < 240
+		assert max(sizes) <= max(24, prior.rank)
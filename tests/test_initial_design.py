@@ -0,0 +1,60 @@
+import numpy as np
+import sys
+import pytest
+
+sys.path.append('../code/')
+import initial_design
+import test_function_base
+from get_factorial import get_factorial
+
+class TestInitialDesign:
+
+	def test_factorial_any_dimension(self):
+
+		for dim in range(1, 30):
+			x = get_factorial(dim)
+			assert x.shape[1] == dim
+			assert np.all(np.abs(x) == 1)
+
+			# balanced and orthogonal columns
+			assert np.all(np.sum(x, axis=0) == 0)
+			assert np.all(np.dot(x.T, x) == len(x)*np.identity(dim))
+
+	def test_designs(self):
+
+		np.random.seed(0)
+		bounds = np.array([[-1., 1.], [0., 10.], [2., 3.]])
+
+		for name in sorted(initial_design.DESIGNS):
+			x = initial_design.get_design(name, None if name == 'factorial' else 16, 3, bounds)
+			assert x.shape == (5 if name == 'factorial' else 16, 3)
+			assert np.all(x >= bounds[:, 0]) and np.all(x <= bounds[:, 1])
+		assert initial_design.get_design('lhs', None, 3).shape == (7, 3)
+
+		# one point in each stratum of each dimension
+		x = initial_design.latin_hypercube(20, 4)
+		assert np.all(np.sort(np.floor(20*x), axis=0) == np.arange(20)[:, None])
+
+	def test_batch_evaluation(self):
+
+		np.random.seed(0)
+		func = test_function_base.Normalizer(test_function_base.Gaussian(dim=20, num_peaks=2, seed=0))
+		x = initial_design.get_design('maximin', 41, 20)
+
+		y = initial_design.evaluate_design(func, x)
+		assert y.shape == (41, 1)
+		assert np.allclose(y[:, 0], [func.do_evaluate(xi) for xi in x])
+
+	def test_generators(self):
+
+		# designs are reproducible from their generator and independent of the global state
+		for name in ['lhs', 'maximin', 'sobol']:
+			x = initial_design.get_design(name, 8, 3, rng=np.random.default_rng(2))
+			np.random.seed(7)
+			assert np.all(x == initial_design.get_design(name, 8, 3, rng=2))
+
+	def test_factorial_size(self):
+
+		assert initial_design.factorial_design(5, 3).shape == (5, 3)
+		with pytest.raises(ValueError):
+			initial_design.get_design('factorial', 16, 3)
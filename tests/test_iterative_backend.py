@@ -0,0 +1,77 @@
+import numpy as np
+import sys
+from collections import namedtuple
+
+sys.path.append('../code/')
+from iterative_backend import block_cg, lanczos_logdet, IterativeBackend
+
+Sites = namedtuple('Sites', ['v', 'tau'])
+
+
+def rbf(X, lengthscale):
+	return np.exp(-0.5*np.sum((X[:, None, :] - X[None, :, :])**2, axis=2)/lengthscale**2) + 1e-8*np.identity(len(X))
+
+
+def logdet_sd(A, sketch, m):
+	""" Standard deviation of the log determinant of A from the sketch and m probes, as documented in iterative_backend """
+	P = np.identity(len(A))
+	if sketch is not None:
+		Q = np.linalg.qr(np.dot(A, sketch))[0]
+		P -= np.dot(Q, Q.T)
+	lam, V = np.linalg.eigh(A)
+	R = np.dot(P, np.dot(V*np.log(lam), np.dot(V.T, P)))
+	return np.sqrt(2*(np.sum(R**2) - np.sum(np.diag(R)**2))/m)
+
+
+class TestIterativeBackend:
+
+	def setup_method(self, method):
+		np.random.seed(0)
+		self.K = rbf(np.random.uniform(-3, 3, size=(40, 2)), 1.5)
+		self.v, self.tau = np.random.normal(size=40), np.random.rand(40)
+		self.Sigma = np.linalg.inv(np.linalg.inv(self.K) + np.diag(self.tau))
+
+	def test_block_cg(self):
+
+		A = self.K + np.identity(40)
+		R = np.random.normal(size=(40, 3))
+		X = block_cg(lambda X: np.dot(A, X), R, 1./np.diag(A), tol=1e-12)
+		assert np.allclose(np.dot(A, X), R)
+
+	def test_lanczos_logdet(self):
+
+		A = self.K + np.identity(40)
+		mvm = lambda X: np.dot(A, X)
+		probes = np.random.RandomState(0).choice([-1., 1.], size=(40, 200))
+		exact = np.linalg.slogdet(A)[1]
+
+		# plain Hutchinson probes, and Hutch++ with a third of the probes as sketch
+		assert np.abs(lanczos_logdet(mvm, 40, probes, 30) - exact) < 3*logdet_sd(A, None, 200)
+		assert np.abs(lanczos_logdet(mvm, 40, probes[:, 20:60], 30, sketch=probes[:, :20]) - exact) < 3*logdet_sd(A, probes[:, :20], 40)
+
+		# a sketch spanning the whole space gives the exact log determinant
+		assert np.isclose(lanczos_logdet(mvm, 40, probes[:, 40:50], 30, sketch=probes[:, :40]), exact)
+
+	def test_posterior(self):
+
+		# with as many probes as rows, the Nystrom approximation is exact
+		post = IterativeBackend(num_probes=40).posterior(self.K, self.v, self.tau)
+		assert np.allclose(post.mu, np.dot(self.Sigma, self.v))
+		assert np.allclose(post.Sigma_diag, np.diag(self.Sigma))
+		assert np.allclose(post.Sigma, self.Sigma)
+
+		# fewer probes give conservative variances
+		post = IterativeBackend(num_probes=10).posterior(self.K, self.v, self.tau)
+		assert np.all(post.Sigma_diag >= np.diag(self.Sigma) - 1e-10)
+		assert np.all(post.Sigma_diag <= np.diag(self.K) + 1e-10)
+
+	def test_inference(self):
+
+		backend = IterativeBackend(num_probes=40)
+		_, log_marginal, grads = backend.inference(self.K, Sites(self.v, self.tau), None, 0.)
+
+		B = np.identity(40) + np.sqrt(self.tau)[:, None]*self.K*np.sqrt(self.tau)
+		expected = 0.5*(-40*np.log(2*np.pi) - np.linalg.slogdet(B)[1] + np.dot(self.v, np.dot(self.Sigma, self.v)))
+		# the documented accuracy of the log determinant, halved in the log marginal likelihood
+		assert np.abs(log_marginal - expected) < 1.5*logdet_sd(B, backend._probes(40, 1, True)[:, :13], 27)
+		assert grads['dL_dK'].shape == (40, 40)
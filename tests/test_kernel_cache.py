@@ -0,0 +1,117 @@
+import numpy as np
+import sys
+import copy
+import gc
+import pickle
+
+sys.path.append('../code/')
+import kernel_cache
+from kernel_cache import KernelCache
+
+
+class _Kernel(object):
+	""" Squared exponential kernel that counts its evaluations """
+
+	def __init__(self, lengthscale=1.):
+		self.param_array = np.array([lengthscale])
+		self.calls = 0
+
+	def K(self, X, X2=None):
+		self.calls += 1
+		X2 = X if X2 is None else X2
+		return np.exp(-0.5*(X[:, None, 0] - X2[None, :, 0])**2/self.param_array[0]**2)
+
+
+class TestKernelCache:
+
+	def test_hits_and_invalidation(self):
+
+		cache, kernel = KernelCache(), _Kernel()
+		rng = np.random.RandomState(0)
+		X, X2 = rng.normal(0, 1, (5, 1)), rng.normal(0, 1, (3, 1))
+
+		K = cache.K(kernel, X)
+		assert np.array_equal(cache.K(kernel, X), K) and kernel.calls == 1 and cache.hits == 1
+
+		# other inputs, parameters or contents of the inputs are misses
+		cache.K(kernel, X, X2)
+		kernel.param_array[0] = 2.
+		assert not np.array_equal(cache.K(kernel, X), K)
+		X[0] += 1.
+		cache.K(kernel, X)
+		assert kernel.calls == 4 and cache.misses == 4
+
+		# values of other kernels are separate
+		other = _Kernel(2.)
+		cache.K(other, X)
+		assert other.calls == 1
+
+	def test_eviction(self):
+
+		kernel = _Kernel()
+		rng = np.random.RandomState(1)
+		X = [rng.normal(0, 1, (10, 1)) for i in range(3)]
+		cache = KernelCache(max_bytes=2*10*10*8)
+
+		for x in X:
+			cache.K(kernel, x)
+		assert len(cache) == 2 and cache.nbytes == 2*800
+
+		# the least recently used entry was evicted
+		cache.K(kernel, X[2])
+		cache.K(kernel, X[0])
+		assert kernel.calls == 4
+
+	def test_copies_are_empty(self):
+
+		cache, kernel = KernelCache(), _Kernel()
+		cache.K(kernel, np.zeros((4, 1)))
+
+		holder = dict(a=cache, b=cache)
+		copied = copy.deepcopy(holder)
+		assert len(copied['a']) == 0 and copied['a'] is copied['b']
+		assert len(pickle.loads(pickle.dumps(cache))) == 0 and len(cache) == 1
+
+	def test_collected_kernels(self):
+
+		cache = KernelCache()
+		X = np.random.RandomState(2).normal(0, 1, (6, 1))
+		kernel = _Kernel()
+		cache.K(kernel, X)
+		assert len(cache) == 1
+
+		# the values of a collected kernel are dropped, and a new kernel (possibly with the same id) is a miss
+		del kernel
+		gc.collect()
+		assert len(cache) == 0 and cache.nbytes == 0
+		kernel = _Kernel()
+		cache.K(kernel, X)
+		assert kernel.calls == 1
+
+	def test_one_off_inputs(self, monkeypatch):
+
+		cache, kernel = KernelCache(), _Kernel()
+		rng = np.random.RandomState(3)
+		Xnew, X2 = rng.normal(0, 1, (4, 1)), rng.normal(0, 1, (5, 1))
+
+		hashed = []
+		monkeypatch.setattr(kernel_cache, '_array_key', lambda X: hashed.append(X) or (None if X is None else (X.shape, hash(X.tobytes()))))
+
+		# the first call for a source is neither hashed nor stored
+		K = cache.K(kernel, Xnew.copy(), X2, source=Xnew)
+		assert len(hashed) == 0 and len(cache) == 0
+
+		# the same source again is cached by content
+		assert np.array_equal(cache.K(kernel, Xnew.copy(), X2, source=Xnew), K) and len(cache) == 1
+		cache.K(kernel, Xnew.copy(), X2, source=Xnew)
+		assert kernel.calls == 2 and cache.hits == 1
+
+		# in-place changes of the source are misses
+		Xnew[0] += 1.
+		assert not np.array_equal(cache.K(kernel, Xnew.copy(), X2, source=Xnew), K)
+		assert kernel.calls == 3
+
+		# sources that cannot be tracked are never cached
+		cache.K(kernel, Xnew, X2, source=Xnew.tolist())
+		cache.K(kernel, Xnew, X2, source=Xnew.tolist())
+		assert kernel.calls == 5
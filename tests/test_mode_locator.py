@@ -0,0 +1,37 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+from mode_locator import locate_mode
+
+
+class QuadraticModel(object):
+	""" Predictor of f(x) = sum((x - center)**2) with g_d = x_d - center_d and predictive variances of 0.1 """
+
+	def __init__(self, center):
+		self.center = np.asarray(center, dtype=float)
+		self.D = len(self.center)
+		self.X = np.array([[-5.]*self.D, [5.]*self.D])
+		self.Xd = np.zeros((1, self.D))
+
+	def predict(self, Xnew):
+		return np.sum((Xnew - self.center)**2, axis=1), np.full(len(Xnew), 0.1)
+
+	def predict_g(self, Xnew, g_index=0, full_cov=False):
+		return Xnew[:, g_index] - self.center[g_index], np.full(len(Xnew), 0.1)
+
+
+class TestModeLocator:
+
+	def test_interior(self):
+		mode = locate_mode(QuadraticModel([1.3, -2.7, 0.4]))
+		assert np.allclose(mode.x, [1.3, -2.7, 0.4])
+		assert np.allclose(mode.std, np.sqrt(0.1))
+		assert np.isclose(mode.f_mean, 0.)
+		assert not mode.on_boundary.any()
+
+	def test_boundary(self):
+		mode = locate_mode(QuadraticModel([7., -2.]), bounds=[[-5., 5.], [-5., 5.]])
+		assert np.allclose(mode.x, [5., -2.])
+		assert mode.on_boundary.tolist() == [True, False]
+		assert np.isnan(mode.std[0]) and np.isclose(mode.std[1], np.sqrt(0.1))
@@ -3,7 +3,7 @@ import sys
 import nose
 
 sys.path.append('../code/')
-from probit_moments import ProbitMoments
+from probit_moments import ProbitMoments, ProbitTable, logCdfNormal, derivLogCdfNormal
 
 from scipy.stats import norm
 phi = lambda x: norm.cdf(x)
@@ -185,3 +185,37 @@ class TestProbitMoments:
 
 
 
+
+	def test_vectorized_moments(self):
+
+		# moments of arrays of parameters agree with the elementwise computation
+		m, v = np.random.normal(0, 1, 20), np.random.exponential(1, 20)
+		mu, sigma2 = 5*np.random.normal(0, 1, 20), np.random.exponential(1, 20)
+
+		computation = ProbitMoments.compute_moments(m, v, mu, sigma2, return_normalizer=True)
+		for i in range(20):
+			elementwise = ProbitMoments.compute_moments(m[i], v[i], mu[i], sigma2[i], return_normalizer=True)
+			assert np.allclose([c[i] for c in computation], elementwise, rtol=1e-12)
+
+	def test_table(self):
+
+		# interpolated log Phi and phi/Phi are within the error bound of the table, inside and outside of its range
+		table = ProbitTable()
+		rng = np.random.RandomState(0)
+		z = np.concatenate((rng.uniform(-12, 12, 10000), table.z_min + table.step*np.arange(10)))
+
+		log_cdf, ratio = table(z)
+		assert np.max(np.abs(log_cdf - logCdfNormal(z))) <= table.error_bound[0]
+		assert np.max(np.abs(ratio - derivLogCdfNormal(z))) <= table.error_bound[1]
+		assert max(table.error_bound) < 1e-10
+
+		# scalars take a separate path
+		for i in range(100):
+			assert np.allclose(table(z[i]), (log_cdf[i], ratio[i]), rtol=0, atol=1e-14)
+
+		# moments with the table
+		m, v = rng.normal(0, 1, 20), rng.exponential(1, 20)
+		mu, sigma2 = 5*rng.normal(0, 1, 20), rng.exponential(1, 20)
+		exact = ProbitMoments.compute_moments(m, v, mu, sigma2)
+		interpolated = ProbitMoments.compute_moments(m, v, mu, sigma2, table=table)
+		assert np.allclose(exact, interpolated, rtol=1e-8, atol=1e-8)
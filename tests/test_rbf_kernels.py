@@ -0,0 +1,52 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+from rbf_kernels import cross_covariance, RandomFourierFeatures
+
+eps = 1e-6
+max_tol = 1e-4
+
+def rbf(x, x2, variance, lengthscale):
+	return variance*np.exp(-0.5*np.sum((x - x2)**2/lengthscale**2))
+
+class TestRBFKernels:
+
+	def test_cross_covariance(self):
+
+		np.random.seed(0)
+		D = 3
+		X, Xd, Xp = np.random.rand(4, D), np.random.rand(5, D), np.random.rand(6, D)
+		variance, lengthscale, bias = 1.3, np.array([0.4, 0.7, 1.1]), 0.2
+
+		K, dK = cross_covariance(Xp, X, Xd, variance, lengthscale, bias, return_gradient=True)
+		assert K.shape == (6, 4 + D*5)
+		assert dK.shape == (6, 4 + D*5, D)
+
+		# derivative columns are finite differences of the kernel wrt. the second argument
+		for i in range(len(Xp)):
+			for d in range(D):
+				for j in range(len(Xd)):
+					numerical = (rbf(Xp[i], Xd[j] + eps*(np.arange(D) == d), variance, lengthscale) - rbf(Xp[i], Xd[j], variance, lengthscale))/eps
+					assert np.abs(K[i, 4 + d*5 + j] - numerical) < max_tol
+
+		# gradient wrt. Xp
+		for d in range(D):
+			numerical = (cross_covariance(Xp + eps*(np.arange(D) == d), X, Xd, variance, lengthscale, bias) - K)/eps
+			assert np.max(np.abs(dK[:, :, d] - numerical)) < max_tol
+
+	def test_random_fourier_features(self):
+
+		np.random.seed(0)
+		X = np.random.rand(10, 2)
+		variance, lengthscale, bias = 1.3, np.array([0.4, 0.7]), 0.2
+
+		features = RandomFourierFeatures(variance, lengthscale, bias, num_features=50000, rng=0)
+		Phi = features(X)
+		K = np.array([[rbf(x, x2, variance, lengthscale) + bias for x2 in X] for x in X])
+		assert np.max(np.abs(np.dot(Phi, Phi.T) - K)) < 2e-2
+
+		G = features.gradient(X)
+		for d in range(2):
+			assert np.max(np.abs(G[:, :, d] - (features(X + eps*(np.arange(2) == d)) - Phi)/eps)) < max_tol
+			assert np.all(features.gradient(X, d) == G[:, :, d])
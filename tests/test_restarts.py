@@ -0,0 +1,77 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+import GPy
+import unimodal
+import restarts
+
+
+def make_model():
+	random_state = np.random.RandomState(0)
+	X = random_state.uniform(-3, 3, size=(8, 1))
+	y = 0.5*X**2 + 0.1*random_state.normal(size=(8, 1))
+	f_kernel_base = GPy.kern.RBF(1, variance=2., lengthscale=1.5) + GPy.kern.Bias(1, variance=0.5)
+	return unimodal.UnimodalGP(X=X, Y=y, Xd=np.linspace(-3, 3, 5)[:, None], f_kernel_base=f_kernel_base, g_kernel_base=GPy.kern.RBF(1, lengthscale=2.), sigma2=0.01)
+
+
+class TestRestarts:
+
+	def check_best(self, model, results):
+		""" The model has the parameters of the restart with the best objective """
+		best = min(results, key=lambda result: result.f)
+		assert np.allclose(model.optimizer_array, best.x)
+		assert np.isclose(-model.log_likelihood(), best.f)
+		assert all(-model.log_likelihood() <= result.f + 1e-8 for result in results)
+
+	def test_draw_from_prior(self):
+
+		state = np.random.get_state()
+		for prior in [GPy.priors.Uniform(1., 2.), GPy.priors.Exponential(0.5), GPy.priors.HalfT(1., 1.), GPy.priors.Gamma(2., 3.)]:
+			draws = [restarts.draw_from_prior(prior, 4, np.random.default_rng(7)) for _ in range(2)]
+			assert draws[0].shape == (4,) and np.array_equal(draws[0], draws[1])
+			assert np.all(np.isfinite(prior.lnpdf(draws[0])))
+
+		# priors without a sampler keep the perturbed start
+		assert restarts.draw_from_prior(GPy.priors.MultivariateGaussian(np.zeros(2), np.identity(2)), 2, np.random.default_rng(7)) is None
+
+		# the global random state is not used
+		assert all(np.array_equal(a, b) for a, b in zip(state[1:], np.random.get_state()[1:]))
+
+	def test_optimize_restarts(self):
+
+		model = make_model()
+		starts = restarts.draw_starts(model, 2, seed=1)
+		results = model.optimize_restarts(num_restarts=2, num_processes=2, max_iters=20, check_every=10, seed=1)
+
+		assert [result.index for result in results] == [0, 1]
+		assert all(result.status in ['converged', 'cancelled', 'max_iters'] for result in results)
+		self.check_best(model, results)
+
+		# the restarts start from the current parameters and a draw, and the optimization improves on both
+		for result, x in zip(results, starts):
+			model.optimizer_array = x
+			assert result.f <= model.objective_function() + 1e-8
+
+	def test_failed_restarts(self, monkeypatch):
+
+		# inference fails at extreme parameters
+		parameters_changed = unimodal.UnimodalGP.parameters_changed
+		def failing_parameters_changed(model):
+			if np.any(model.param_array > 1e10):
+				raise RuntimeError('EP failed')
+			parameters_changed(model)
+		monkeypatch.setattr(unimodal.UnimodalGP, 'parameters_changed', failing_parameters_changed)
+
+		# a start where the objective is not finite and one where inference raises
+		draw_starts = restarts.draw_starts
+		monkeypatch.setattr(restarts, 'draw_starts', lambda model, num_starts, seed: draw_starts(model, num_starts - 2, seed) + [np.full(model.size, np.nan), np.full(model.size, 1e11)])
+
+		for num_processes in [1, 2]:
+			model = make_model()
+			results = model.optimize_restarts(num_restarts=4, num_processes=num_processes, max_iters=10, check_every=10)
+
+			assert results[2].status == 'failed: the objective is not finite' and results[2].f == np.inf
+			assert results[3].status.startswith('failed:') and 'RuntimeError: EP failed' in results[3].status and results[3].f == np.inf
+			assert all(np.isfinite(result.f) for result in results[:2])
+			self.check_best(model, results)
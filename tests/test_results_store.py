@@ -0,0 +1,103 @@
+import numpy as np
+import sys
+import shutil
+import tempfile
+
+sys.path.append('../code/')
+from results_store import ResultsStore, ResultsWriter
+
+
+def write_runs(root, num_runs, worker):
+	writer = ResultsWriter(root, worker=worker, flush_every=2)
+	for i in range(num_runs):
+		scalars = {'seed': i, 'model': 'unimodal' if i % 2 else 'vanilla', 'f_opt': 0.5}
+		arrays = {'f_min_ref': 0.5 + 1./(1 + np.arange(i + 1)), 'x': np.random.rand(i + 3, 2)}
+		writer.append('%s_%d' % (worker, i), scalars, arrays)
+	writer.close()
+
+
+class TestResultsStore:
+
+	def setup_method(self, method):
+		self.root = tempfile.mkdtemp()
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.root)
+
+	def test_roundtrip(self):
+
+		np.random.seed(0)
+		write_runs(self.root, 5, 'a')
+		write_runs(self.root, 3, 'b')
+
+		store = ResultsStore(self.root)
+		assert len(store) == 8
+		assert store.keys() == ['a_0', 'a_1', 'a_2', 'a_3', 'a_4', 'b_0', 'b_1', 'b_2']
+
+		# filters select across shards and writers
+		assert np.all(store.column('seed', model='unimodal') == [1, 3, 1])
+		xs = store.arrays('x', model='vanilla')
+		assert [x.shape for x in xs] == [(3, 2), (5, 2), (7, 2), (3, 2), (5, 2)]
+
+		# columns are memory-mapped
+		assert isinstance(store.arrays('x')[0], np.memmap)
+
+	def test_regret_curves(self):
+
+		write_runs(self.root, 4, 'a')
+		regret = ResultsStore(self.root).regret_curves(model='vanilla')
+
+		assert regret.shape == (2, 3)
+		assert np.allclose(regret[0], [1., np.nan, np.nan], equal_nan=True)
+		assert np.allclose(regret[1], [1., 1./2, 1./3])
+
+	def test_compact(self):
+
+		np.random.seed(0)
+		write_runs(self.root, 5, 'a')
+		store = ResultsStore(self.root, mmap=False)
+		assert len(store.shards) == 3
+		keys, xs = store.keys(), store.arrays('x')
+
+		compacted = store.compact()
+		assert len(compacted.shards) == 1
+		assert compacted.keys() == keys
+		for x1, x2 in zip(compacted.arrays('x'), xs):
+			assert np.all(x1 == x2)
+
+	def test_mixed_arrays(self):
+
+		# arrays of different ndim in one column, and runs without the column
+		values = [np.array(1.5), np.arange(3.), None, np.arange(6.).reshape(2, 3), np.zeros((0, 2))]
+		writer = ResultsWriter(self.root, worker='a', flush_every=3)
+		for i, value in enumerate(values):
+			writer.append('a_%d' % i, {'seed': i}, {} if value is None else {'x': value})
+		writer.close()
+		ResultsWriter(self.root, worker='b').append('b_0', {'seed': 5})
+
+		store = ResultsStore(self.root)
+		assert len(store.shards) == 3
+		for compacted in [False, True]:
+			xs = store.arrays('x')
+			assert len(xs) == 6 and xs[2] is None and xs[5] is None
+			for x, value in zip(xs, values):
+				if value is not None:
+					assert x.shape == value.shape and np.all(x == value)
+			store = store.compact()
+			assert len(store.shards) == 1
+
+	def test_flush_seconds(self):
+
+		# runs older than flush_seconds are flushed before flush_every runs are buffered
+		writer = ResultsWriter(self.root, worker='a', flush_every=10, flush_seconds=0.)
+		for i in range(3):
+			writer.append('a_%d' % i, {'seed': i})
+		assert len(writer.buffer) == 0
+		assert len(ResultsStore(self.root).shards) == 3
+
+		writer = ResultsWriter(self.root, worker='b', flush_every=10, flush_seconds=3600.)
+		for i in range(3):
+			writer.append('b_%d' % i, {'seed': i})
+		assert len(writer.buffer) == 3
+		writer.close()
+		assert len(ResultsStore(self.root).shards) == 4
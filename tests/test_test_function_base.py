@@ -0,0 +1,61 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+import test_function_base
+
+from scipy.stats import multivariate_normal
+
+max_tol = 1e-10
+
+class TestGaussian:
+
+	def test_batch_evaluation(self):
+
+		for dim in [1, 2, 5]:
+
+			func = test_function_base.Gaussian(dim=dim, num_peaks=3, seed=dim)
+			X = np.random.rand(50, dim)
+
+			# reference: sum of scipy densities, one point at a time
+			reference = np.array([np.sum([-func.weights[i]*multivariate_normal.pdf(x, func.centers[i,:], func.variances[i]) for i in range(func.num_peaks)]) for x in X])
+
+			batch = func.do_evaluate(X)
+			assert batch.shape == (50,)
+			assert np.max(np.abs(batch - reference)) < max_tol
+
+			# single points are still evaluated to scalars
+			assert np.ndim(func.do_evaluate(X[0])) == 0
+			assert np.abs(func.do_evaluate(X[0]) - reference[0]) < max_tol
+
+	def test_wrappers_pass_batches(self):
+
+		func = test_function_base.Noisifier(test_function_base.Normalizer(test_function_base.Gaussian(dim=2, num_peaks=2, seed=0)), 'add', 0.1, rng=1)
+		X = np.random.rand(20, 2)
+
+		clean = func.evaluate_clean(X)
+		assert clean.shape == (20,)
+		assert np.max(np.abs(clean - np.array([func.evaluate_clean(x) for x in X]))) < max_tol
+
+		# the minimum of the normalized function is zero
+		assert np.abs(func.evaluate_clean(func.min_loc)) < max_tol
+
+		# the noise is drawn from the generator of the wrapper, not from the global state
+		np.random.seed(1)
+		noisy = func.do_evaluate(X)
+		assert np.all(noisy == clean + 0.1*np.random.default_rng(1).standard_normal(20))
+
+	def test_seeds(self):
+
+		# an int seed gives the functions of the global seeding used before, without touching the global state
+		np.random.seed(3)
+		reference = np.random.rand(2)
+		np.random.seed(0)
+		state = np.random.get_state()[1].copy()
+		func = test_function_base.Gaussian(dim=2, num_peaks=2, seed=3)
+		assert np.all(func.weights == reference + np.finfo(float).eps)
+		assert np.all(np.random.get_state()[1] == state)
+
+		# Generators are used as is
+		funcs = [test_function_base.Gaussian(dim=2, num_peaks=2, seed=np.random.default_rng(5)) for i in range(2)]
+		assert np.all(funcs[0].centers == funcs[1].centers)
@@ -0,0 +1,53 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+import GPy
+import unimodal
+from thompson_sampling import sample_path, ThompsonSampling
+
+num_paths = 2000
+
+
+def f_kernel():
+	return GPy.kern.RBF(1, variance=2., lengthscale=1.5) + GPy.kern.Bias(1, variance=0.5)
+
+
+def check_moments(model, Xp, mean, var, seed):
+	""" The sample paths at Xp have the predictive mean and variance of f within Monte Carlo error (and the error of the
+	    random Fourier features, about 1e-3 in the variances) """
+	rng = np.random.default_rng(seed)
+	F = np.array([sample_path(model, num_features=1000, rng=rng)(Xp)[0] for _ in range(num_paths)])
+	mean, var = np.ravel(mean), np.ravel(var)
+
+	assert np.all(np.abs(F.mean(axis=0) - mean) < 5*np.sqrt(var/num_paths) + 1e-3)
+	assert np.all(np.abs(F.var(axis=0) - var) < 5*np.sqrt(2./num_paths)*var + 1e-3)
+
+
+class TestThompsonSampling:
+
+	def setup_method(self, method):
+		random_state = np.random.RandomState(0)
+		self.X = random_state.uniform(-3, 3, size=(8, 1))
+		self.y = 0.3*self.X**2 + 0.1*random_state.normal(size=(8, 1))
+		self.Xp = np.linspace(-3.5, 3.5, 7)[:, None]
+
+	def test_sample_path_gp(self):
+
+		model = GPy.models.GPRegression(self.X, self.y, f_kernel(), noise_var=0.01)
+		check_moments(model, self.Xp, *model.predict(self.Xp, include_likelihood=False), seed=1)
+
+	def test_sample_path_unimodal(self):
+
+		Xd = np.linspace(-3, 3, 5)[:, None]
+		model = unimodal.UnimodalGP(X=self.X, Y=self.y, Xd=Xd, f_kernel_base=f_kernel(), sigma2=0.01,
+		                            g_kernel_base=GPy.kern.RBF(1, variance=1., lengthscale=2.))
+		check_moments(model, self.Xp, *model.predict(self.Xp, include_likelihood=False), seed=2)
+
+	def test_propose_batch(self):
+
+		model = GPy.models.GPRegression(self.X, self.y, f_kernel(), noise_var=0.01)
+		batches = [ThompsonSampling(num_features=200, rng=3).propose_batch(model, [[-3, 3]], 3, num_restarts=2, num_candidates=100) for _ in range(2)]
+		assert batches[0].shape == (3, 1)
+		assert np.all(batches[0] == batches[1])
+		assert np.all((batches[0] >= -3) & (batches[0] <= 3))
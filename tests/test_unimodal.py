@@ -0,0 +1,107 @@
+import numpy as np
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.append('../code/')
+import pytest
+import GPy
+import unimodal
+from iterative_backend import IterativeBackend
+from npz_io import load_npz
+
+
+def make_model(**kwargs):
+	random_state = np.random.RandomState(0)
+	X = random_state.uniform(-3, 3, size=(10, 2))
+	y = 0.3*np.sum(X**2, axis=1)[:, None] + 0.1*random_state.normal(size=(10, 1))
+	Xd = np.column_stack([x.ravel() for x in np.meshgrid(np.linspace(-3, 3, 3), np.linspace(-3, 3, 3))])
+	f_kernel_base = GPy.kern.RBF(2, variance=2., lengthscale=[1.5, 2.], ARD=True) + GPy.kern.Bias(2, variance=0.5)
+	return unimodal.UnimodalGP(X=X, Y=y, Xd=Xd, f_kernel_base=f_kernel_base, g_kernel_base=GPy.kern.RBF(2, lengthscale=2.), sigma2=0.1, **kwargs)
+
+
+def fit_model(**kwargs):
+	model = make_model(**kwargs)
+	model.optimize(max_iters=10)
+	return model
+
+
+def diff_kern_error():
+	""" None if the DiffKern kernels of fused_kernel=False can be built and evaluated by the installed GPy, the error otherwise """
+	try:
+		base = GPy.kern.RBF(1)
+		X = GPy.util.multioutput.build_XY([np.zeros((2, 1))]*2, [None]*2)[0]
+		GPy.kern.MultioutputKern(kernels=[base, GPy.kern.DiffKern(base, 0)], cross_covariances={}).K(X)
+	except Exception as e:
+		return '%s: %s' % (type(e).__name__, e)
+
+
+diff_kern_unsupported = diff_kern_error()
+
+
+class TestUnimodalGP:
+
+	def setup_method(self, method):
+		self.root = tempfile.mkdtemp()
+		self.Xp = np.random.RandomState(1).uniform(-4, 4, size=(7, 2))
+
+	def teardown_method(self, method):
+		shutil.rmtree(self.root)
+
+	def check_equal(self, model, loaded):
+		for a, b in zip(model.predict(self.Xp), loaded.predict(self.Xp)):
+			assert np.allclose(a, b)
+		for d in range(model.D):
+			for a, b in zip(model.predict_g(self.Xp, d), loaded.predict_g(self.Xp, d)):
+				assert np.allclose(a, b)
+		assert np.isclose(model.log_likelihood(), loaded.log_likelihood())
+		assert np.allclose(model.param_array, loaded.param_array)
+		assert np.allclose(model.gradient, loaded.gradient)
+
+	def test_float32(self):
+
+		# float32 kernel matrices keep the EP approximation and the predictions within 1e-4 of double precision (observed differences are ~1e-6)
+		model, single = make_model(), make_model(dtype=np.float32)
+		assert np.isclose(single.log_likelihood(), model.log_likelihood(), rtol=0, atol=1e-4)
+		assert np.allclose(single.gradient, model.gradient, rtol=1e-4, atol=1e-4)
+
+		mean, var = single.predict(self.Xp)
+		assert mean.dtype == np.float32
+		for a, b in zip((mean, var), model.predict(self.Xp)):
+			assert np.allclose(a, b, rtol=1e-4, atol=1e-4)
+		for d in range(model.D):
+			for a, b in zip(single.predict_g(self.Xp, d), model.predict_g(self.Xp, d)):
+				assert np.allclose(a, b, rtol=1e-4, atol=1e-4)
+
+	def test_save_load(self):
+
+		model = fit_model()
+		path = os.path.join(self.root, 'model.npz')
+		model.save(path)
+
+		for mmap in [False, True]:
+			self.check_equal(model, unimodal.UnimodalGP.load(path, mmap=mmap))
+
+		# the gradients of files without saved gradients are recomputed from the EP sites
+		data = load_npz(path)
+		del data['dL_dK_f'], data['dL_dK_g']
+		np.savez(path, **data)
+		self.check_equal(model, unimodal.UnimodalGP.load(path))
+
+	@pytest.mark.skipif(diff_kern_unsupported is not None, reason='DiffKern is not supported by the installed GPy (%s)' % diff_kern_unsupported)
+	def test_save_load_options(self):
+
+		model = fit_model(fused_kernel=False, g_structure='dense', backend=IterativeBackend(num_probes=20, seed=3))
+		path = os.path.join(self.root, 'model.npz')
+		model.save(path)
+
+		loaded = unimodal.UnimodalGP.load(path)
+		assert loaded.fused_kernel is False and loaded.g_structure == 'dense'
+		assert isinstance(loaded.Kf_kernel, GPy.kern.MultioutputKern)
+		assert loaded.backend.to_dict() == model.backend.to_dict()
+		self.check_equal(model, loaded)
+
+		# optimization continues from the loaded state
+		loaded.optimize(max_iters=2)
+		assert np.isfinite(loaded.log_likelihood())
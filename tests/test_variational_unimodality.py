@@ -0,0 +1,40 @@
+import numpy as np
+import sys
+
+sys.path.append('../code/')
+import GPy
+import unimodal
+
+
+def make_model(inference):
+	""" UnimodalGP with fixed hyperparameters on noisy observations of a parabola with its minimum at x = 0.5 """
+	random_state = np.random.RandomState(0)
+	X = random_state.uniform(-3, 3, size=(15, 1))
+	y = 0.5*(X - 0.5)**2 + 0.1*random_state.normal(size=(15, 1))
+	f_kernel_base = GPy.kern.RBF(1, variance=2., lengthscale=1.5) + GPy.kern.Bias(1, variance=0.5)
+	return unimodal.UnimodalGP(X=X, Y=y, Xd=np.linspace(-3, 3, 8)[:, None], f_kernel_base=f_kernel_base, g_kernel_base=GPy.kern.RBF(1, lengthscale=2.),
+	                           sigma2=0.01, inference=inference)
+
+
+class TestVariationalUnimodality:
+
+	def test_agrees_with_ep(self):
+
+		ep_model, vi_model = make_model('ep'), make_model('variational')
+		Xp = np.linspace(-3, 3, 13)[:, None]
+
+		# posterior means of f within a tenth of the posterior standard deviation
+		ep_mean, ep_var = ep_model.predict(Xp, include_likelihood=False)
+		vi_mean, vi_var = vi_model.predict(Xp, include_likelihood=False)
+		assert np.all(np.abs(vi_mean - ep_mean) < 0.1*np.sqrt(ep_var))
+		assert np.allclose(vi_var, ep_var, rtol=0.1)
+
+		# g changes sign at the same place, away from the minimum
+		ep_g, _ = ep_model.predict_g(Xp, 0)
+		vi_g, _ = vi_model.predict_g(Xp, 0)
+		decided = np.abs(ep_g) > 0.1
+		assert np.sum(decided) >= 10
+		assert np.all(np.sign(vi_g[decided]) == np.sign(ep_g[decided]))
+
+		# the ELBO is a different objective and lower than the EP approximation of the marginal likelihood
+		assert vi_model.log_likelihood() < ep_model.log_likelihood()